@@ -1,8 +1,4 @@
-import geopandas as gpd
-import pandas as pd
 import json
-import numpy as np
-from shapely.geometry import Point
 
 # Landmark data with approximate coordinates
 metro_landmarks = {
@@ -1,112 +1,104 @@
-import geopandas as gpd
-import pandas as pd
 import json
-import numpy as np
-from shapely.geometry import Point, LineString, Polygon
-import requests
 import os
+import time
+import argparse
 
-def fetch_osm_data(bbox, feature_type):
+# The Overpass client, OSM geometry assembly and metro boundaries (requests,
+# shapely, geopandas) are imported where they are used, so writing the
+# synthetic layers needs none of them
+
+# Overpass queries for each feature type; {bbox} is south,west,north,east
+OSM_QUERIES = {
+    'water': '''
+        [out:json][timeout:25];
+        (
+            way["natural"="water"]({bbox});
+            way["waterway"="river"]({bbox});
+            way["waterway"="stream"]({bbox});
+            way["waterway"="canal"]({bbox});
+            relation["natural"="water"]({bbox});
+            relation["waterway"="river"]({bbox});
+        );
+        out body;
+        >;
+        out skel qt;
+    ''',
+    'parks': '''
+        [out:json][timeout:25];
+        (
+            way["leisure"="park"]({bbox});
+            way["leisure"="recreation_ground"]({bbox});
+            way["landuse"="recreation_ground"]({bbox});
+            way["natural"="wood"]({bbox});
+            way["natural"="forest"]({bbox});
+            relation["leisure"="park"]({bbox});
+            relation["landuse"="recreation_ground"]({bbox});
+        );
+        out body;
+        >;
+        out skel qt;
+    ''',
+    'coastline': '''
+        [out:json][timeout:25];
+        (
+            way["natural"="coastline"]({bbox});
+            relation["natural"="coastline"]({bbox});
+        );
+        out body;
+        >;
+        out skel qt;
+    '''
+}
+
+def fetch_osm_data(bbox, feature_type, client=None):
     """Fetch data from OpenStreetMap Overpass API"""
     
-    # Define queries for different feature types
-    queries = {
-        'water': '''
-            [out:json][timeout:25];
-            (
-                way["natural"="water"]({bbox});
-                way["waterway"="river"]({bbox});
-                way["waterway"="stream"]({bbox});
-                way["waterway"="canal"]({bbox});
-                relation["natural"="water"]({bbox});
-                relation["waterway"="river"]({bbox});
-            );
-            out body;
-            >;
-            out skel qt;
-        ''',
-        'parks': '''
-            [out:json][timeout:25];
-            (
-                way["leisure"="park"]({bbox});
-                way["leisure"="recreation_ground"]({bbox});
-                way["landuse"="recreation_ground"]({bbox});
-                way["natural"="wood"]({bbox});
-                way["natural"="forest"]({bbox});
-                relation["leisure"="park"]({bbox});
-                relation["landuse"="recreation_ground"]({bbox});
-            );
-            out body;
-            >;
-            out skel qt;
-        ''',
-        'coastline': '''
-            [out:json][timeout:25];
-            (
-                way["natural"="coastline"]({bbox});
-                relation["natural"="coastline"]({bbox});
-            );
-            out body;
-            >;
-            out skel qt;
-        '''
-    }
-    
-    if feature_type not in queries:
+    if feature_type not in OSM_QUERIES:
         return None
     
-    query = queries[feature_type].format(bbox=bbox)
-    url = "https://overpass-api.de/api/interpreter"
+    query = OSM_QUERIES[feature_type].format(bbox=bbox)
     
     try:
-        response = requests.post(url, data=query)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Error fetching {feature_type}: {response.status_code}")
-            return None
+        if client is None:
+            from overpass import OverpassClient
+            with OverpassClient() as client:
+                return client.fetch(query, bbox)
+        return client.fetch(query, bbox)
     except Exception as e:
         print(f"Error fetching {feature_type}: {e}")
         return None
 
-def get_metro_bbox(metro_name):
-    """Get bounding box for metro area"""
+def fetch_all_osm_data(metro_names, client):
+    """Fetch every feature type for every metro concurrently; {(metro_name, feature_type): data or None}"""
     
-    # Approximate bounding boxes for major metro areas
-    bboxes = {
-        "New York-Newark-Jersey City, NY-NJ-PA": "40.4,-74.3,40.9,-73.6",
-        "Los Angeles-Long Beach-Anaheim, CA": "33.6,-118.7,34.3,-117.9",
-        "Chicago-Naperville-Elgin, IL-IN-WI": "41.6,-88.2,42.2,-87.4",
-        "Dallas-Fort Worth-Arlington, TX": "32.5,-97.4,33.2,-96.6",
-        "Houston-The Woodlands-Sugar Land, TX": "29.4,-95.8,30.2,-94.9",
-        "Washington-Arlington-Alexandria, DC-VA-MD-WV": "38.7,-77.3,39.1,-76.8",
-        "Miami-Fort Lauderdale-West Palm Beach, FL": "25.4,-80.8,26.4,-80.0",
-        "Philadelphia-Camden-Wilmington, PA-NJ-DE-MD": "39.8,-75.4,40.2,-74.9",
-        "Atlanta-Sandy Springs-Roswell, GA": "33.5,-84.8,34.2,-84.2",
-        "Phoenix-Mesa-Chandler, AZ": "33.2,-112.4,33.8,-111.6",
-        "Boston-Cambridge-Newton, MA-NH": "42.2,-71.3,42.5,-70.9",
-        "San Francisco-Oakland-Fremont, CA": "37.6,-122.6,38.1,-122.0",
-        "Riverside-San Bernardino-Ontario, CA": "33.7,-117.8,34.3,-117.0",
-        "Detroit-Warren-Dearborn, MI": "42.1,-83.5,42.6,-82.8",
-        "Seattle-Tacoma-Bellevue, WA": "47.4,-122.6,47.8,-122.0",
-        "Minneapolis-St. Paul-Bloomington, MN-WI": "44.8,-93.6,45.2,-92.9",
-        "Tampa-St. Petersburg-Clearwater, FL": "27.7,-82.8,28.2,-82.3",
-        "San Diego-Chula Vista-Carlsbad, CA": "32.5,-117.4,33.2,-116.8",
-        "Denver-Aurora-Centennial, CO": "39.5,-105.2,40.0,-104.6",
-        "Orlando-Kissimmee-Sanford, FL": "28.2,-81.6,28.8,-80.9",
-        "Charlotte-Concord-Gastonia, NC-SC": "35.0,-81.2,35.5,-80.5",
-        "Baltimore-Columbia-Towson, MD": "39.1,-76.9,39.4,-76.4",
-        "St. Louis, MO-IL": "38.4,-90.6,38.9,-89.9",
-        "San Antonio-New Braunfels, TX": "29.2,-98.8,29.8,-98.1",
-        "Austin-Round Rock-San Marcos, TX": "30.0,-98.0,30.6,-97.3",
-        "Las Vegas-Henderson-North Las Vegas, NV": "36.0,-115.5,36.4,-114.8",
-        "Sacramento-Roseville-Folsom, CA": "38.3,-121.8,38.8,-121.0"
-    }
+    jobs = {}
+    for metro_name in metro_names:
+        bbox = get_metro_bbox(metro_name)
+        if bbox:
+            for feature_type in OSM_QUERIES:
+                jobs[(metro_name, feature_type)] = (OSM_QUERIES[feature_type].format(bbox=bbox), bbox)
+    
+    results = client.fetch_many(jobs)
+    for (metro_name, feature_type), result in results.items():
+        if isinstance(result, Exception):
+            print(f"Error fetching {feature_type} for {metro_name}: {result}")
+            results[(metro_name, feature_type)] = None
+    return results
+
+def get_metro_bbox(metro_name):
+    """Get bounding box for metro area as an Overpass south,west,north,east string"""
+    from metro_boundaries import metro_bounds, overpass_bbox
     
-    return bboxes.get(metro_name)
+    bounds = metro_bounds(metro_name)
+    if bounds is None:
+        return None
+    return overpass_bbox(bounds)
 
-def create_water_parks_geojson():
+def create_water_parks_geojson(client=None):
     """Create GeoJSON files with water features and parks for each metro area"""
+    from shapely.geometry import mapping
+    from osm_geometry import assemble_features
+    from overpass import OverpassCache, OverpassClient
     
     metro_areas = [
         "New York-Newark-Jersey City, NY-NJ-PA",
@@ -138,6 +130,12 @@ def create_water_parks_geojson():
         "Sacramento-Roseville-Folsom, CA"
     ]
     
+    if client is None:
+        client = OverpassClient(cache=OverpassCache())
+    
+    # All queries go out up front, as many at once as the client allows
+    osm_data = fetch_all_osm_data(metro_areas, client)
+    
     for metro_name in metro_areas:
         print(f"Processing {metro_name}...")
         
@@ -146,69 +144,59 @@ def create_water_parks_geojson():
             print(f"  No bbox found for {metro_name}")
             continue
         
-        # Fetch water features
-        water_data = fetch_osm_data(bbox, 'water')
-        parks_data = fetch_osm_data(bbox, 'parks')
-        coastline_data = fetch_osm_data(bbox, 'coastline')
+        water_data = osm_data.get((metro_name, 'water'))
+        parks_data = osm_data.get((metro_name, 'parks'))
+        coastline_data = osm_data.get((metro_name, 'coastline'))
         
         # Create features list
         features = []
         
         # Add water features
         if water_data:
-            print(f"  Found {len(water_data.get('elements', []))} water features")
-            for element in water_data.get('elements', []):
-                if element['type'] == 'way':
-                    feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": []  # Would need to resolve coordinates
-                        },
-                        "properties": {
-                            "name": element.get('tags', {}).get('name', 'Water'),
-                            "type": "water",
-                            "water_type": element.get('tags', {}).get('waterway', 'water')
-                        }
+            water = assemble_features(water_data)
+            print(f"  Found {len(water)} water features")
+            for tags, geometry in water:
+                feature = {
+                    "type": "Feature",
+                    "geometry": mapping(geometry),
+                    "properties": {
+                        "name": tags.get('name', 'Water'),
+                        "type": "water",
+                        "water_type": tags.get('waterway', 'water')
                     }
-                    features.append(feature)
+                }
+                features.append(feature)
         
         # Add parks
         if parks_data:
-            print(f"  Found {len(parks_data.get('elements', []))} park features")
-            for element in parks_data.get('elements', []):
-                if element['type'] == 'way':
-                    feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": []  # Would need to resolve coordinates
-                        },
-                        "properties": {
-                            "name": element.get('tags', {}).get('name', 'Park'),
-                            "type": "park",
-                            "park_type": element.get('tags', {}).get('leisure', 'park')
-                        }
+            parks = assemble_features(parks_data)
+            print(f"  Found {len(parks)} park features")
+            for tags, geometry in parks:
+                feature = {
+                    "type": "Feature",
+                    "geometry": mapping(geometry),
+                    "properties": {
+                        "name": tags.get('name', 'Park'),
+                        "type": "park",
+                        "park_type": tags.get('leisure', 'park')
                     }
-                    features.append(feature)
+                }
+                features.append(feature)
         
         # Add coastline
         if coastline_data:
-            print(f"  Found {len(coastline_data.get('elements', []))} coastline features")
-            for element in coastline_data.get('elements', []):
-                if element['type'] == 'way':
-                    feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": []  # Would need to resolve coordinates
-                        },
-                        "properties": {
-                            "name": "Coastline",
-                            "type": "coastline"
-                        }
+            coastline = assemble_features(coastline_data)
+            print(f"  Found {len(coastline)} coastline features")
+            for tags, geometry in coastline:
+                feature = {
+                    "type": "Feature",
+                    "geometry": mapping(geometry),
+                    "properties": {
+                        "name": "Coastline",
+                        "type": "coastline"
                     }
-                    features.append(feature)
+                }
+                features.append(feature)
         
         # Create GeoJSON structure
         geojson = {
@@ -370,7 +358,48 @@ def create_synthetic_water_parks():
         
         print(f"  Saved {len(features)} features to {filename}")
 
+def fetch_water_parks(osm=False, fake_overpass=False, overpass_url=None, concurrency=None,
+                      min_interval=None, cache_dir=None, cache_ttl_hours=None, no_cache=False):
+    """Write every metro's water/parks layer, synthetic unless osm or fake_overpass is set"""
+    if not (osm or fake_overpass):
+        print("Creating synthetic water and park features...")
+        create_synthetic_water_parks()
+        print("Water and park GeoJSON files created!")
+        return
+
+    from overpass import (DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL, DEFAULT_CONCURRENCY, DEFAULT_MIN_INTERVAL,
+                          OVERPASS_URL, OverpassCache, OverpassClient)
+    url = overpass_url or OVERPASS_URL
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    min_interval = DEFAULT_MIN_INTERVAL if min_interval is None else min_interval
+    if fake_overpass:
+        from fake_overpass import start_fake_overpass
+        server, fake, url = start_fake_overpass(slots=concurrency)
+        print(f"Using fake Overpass API at {url}")
+    ttl = DEFAULT_CACHE_TTL if cache_ttl_hours is None else cache_ttl_hours * 3600
+    cache = None if no_cache else OverpassCache(cache_dir or DEFAULT_CACHE_DIR, ttl=ttl)
+
+    start = time.time()
+    with OverpassClient(url, concurrency, min_interval, cache=cache) as client:
+        create_water_parks_geojson(client)
+    stats = client.stats
+    print(f"Water and park GeoJSON files created in {time.time() - start:.1f}s "
+          f"({stats['requests']} requests, {stats['cache_hits']} cache hits, {stats['retries']} retries)")
+
 if __name__ == "__main__":
-    print("Creating synthetic water and park features...")
-    create_synthetic_water_parks()
-    print("Water and park GeoJSON files created!") 
\ No newline at end of file
+    # Options left unset fall back to overpass.py's defaults inside fetch_water_parks,
+    # so --help and synthetic runs never import requests
+    parser = argparse.ArgumentParser(description="Create water and park GeoJSON files for each metro area")
+    parser.add_argument('--osm', action='store_true',
+                        help="Fetch features from the Overpass API instead of writing synthetic ones")
+    parser.add_argument('--overpass-url', help="Overpass API endpoint (default: overpass-api.de)")
+    parser.add_argument('--fake-overpass', action='store_true',
+                        help="Fetch from a local fake Overpass server (offline testing and benchmarks)")
+    parser.add_argument('--concurrency', type=int, help="Queries in flight at once (default 2)")
+    parser.add_argument('--min-interval', type=float, help="Seconds between the starts of two queries (default 1)")
+    parser.add_argument('--cache-dir', help="Response cache directory (default: osm_cache)")
+    parser.add_argument('--cache-ttl', type=float, help="Cache lifetime in hours (default 168)")
+    parser.add_argument('--no-cache', action='store_true', help="Always query the server")
+    args = parser.parse_args()
+    fetch_water_parks(args.osm, args.fake_overpass, args.overpass_url, args.concurrency, args.min_interval,
+                      args.cache_dir, args.cache_ttl, args.no_cache)
@@ -0,0 +1,409 @@
+import os
+import io
+import sys
+import gc
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+import numpy as np
+import geopandas as gpd
+import shapely
+from geo_io import read_geojson
+from geoparquet_store import TRACT_COLUMNS, to_browser_geojson
+from tract_store import legacy_filename
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = 'bench'
+
+# Bump whenever the generator changes, so stale synthetic data is rebuilt
+GENERATOR_VERSION = 1
+SEED = 45300
+
+# Size of the Tampa tract file the scales are measured against
+BASE_TRACTS = 788
+BASE_VERTICES_PER_TRACT = 160
+BASE_BOUNDS = (-83.02236, 27.53075, -82.054012, 28.694908)
+
+SYNTHETIC_CODE = '99999'
+BENCH_YEAR = 2023
+DEFAULT_SCALES = [1, 10]
+
+# Boundary meanders: (wavelength in segments, phase). Each adds a displacement
+# whose slope is WIGGLE_SLOPE, so the sum stays below 1 and no ring can cross
+# itself or its neighbors
+WIGGLES = [(6, 1.0), (24, 2.1), (96, 4.6)]
+WIGGLE_SLOPE = 0.08
+
+# Hexagon resolution of the overview render benchmark (4 km cells)
+HEX_RESOLUTION = 2
+
+# A timed run repeats a fast call until it takes at least this long
+MIN_RUN_SECONDS = 0.2
+
+def scale_directory(scale, base=BENCH_DIR):
+    return os.path.join(base, f'synthetic_{scale}x')
+
+def synthetic_name(scale):
+    return f'Synthetic Tampa {scale}x'
+
+@contextmanager
+def working_directory(path):
+    """Run the block inside path; the export reads and writes relative to the working directory"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def tract_centers(rng, count, bounds):
+    """Seed points of the tessellation: dense clusters around a few cities plus a rural spread"""
+    minx, miny, maxx, maxy = bounds
+    width, height = maxx - minx, maxy - miny
+    cities = rng.uniform([minx + width / 5, miny + height / 5], [maxx - width / 5, maxy - height / 5],
+                         size=(max(3, round(3 * math.sqrt(count / BASE_TRACTS))), 2))
+    urban = int(count * 0.7)
+    points = cities[rng.integers(len(cities), size=urban)] + rng.normal(scale=min(width, height) / 10,
+                                                                       size=(urban, 2))
+    points = np.vstack([points, rng.uniform([minx, miny], [maxx, maxy], size=(count - urban, 2))])
+    return np.clip(points, [minx, miny], [maxx, maxy])
+
+def wiggle(coords, segment):
+    """Displace coordinates by a smooth field of position, so shared borders move together"""
+    moved = coords.copy()
+    for wavelength, phase in WIGGLES:
+        k = 2 * math.pi / (wavelength * segment)
+        amplitude = WIGGLE_SLOPE / k
+        moved[:, 0] += amplitude * np.sin(k * coords[:, 1] + phase)
+        moved[:, 1] += amplitude * np.sin(k * coords[:, 0] - phase)
+    return np.round(moved, 6)
+
+def synthetic_tracts(scale, seed=SEED):
+    """A tessellation with scale times the tracts (and vertices) of the Tampa file
+
+    Tracts are Voronoi cells of clustered seed points, so they are small in
+    the cities and large in between, densified to the Tampa file's vertices
+    per tract and given meandering shared borders. The area grows with the
+    scale, so tracts keep about the same size. The same scale and seed always
+    give the same tracts.
+    """
+    rng = np.random.default_rng([seed, scale])
+    count = BASE_TRACTS * scale
+    minx, miny, maxx, maxy = BASE_BOUNDS
+    cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+    half = math.sqrt(scale) / 2
+    bounds = (cx - (maxx - minx) * half, cy - (maxy - miny) * half,
+              cx + (maxx - minx) * half, cy + (maxy - miny) * half)
+
+    points = shapely.multipoints(tract_centers(rng, count, bounds))
+    extent = shapely.box(*bounds)
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent, ordered=True))
+    cells = shapely.intersection(cells, extent)
+
+    segment = shapely.length(cells).sum() / (count * BASE_VERTICES_PER_TRACT)
+    cells = shapely.transform(shapely.segmentize(cells, segment), lambda coords: wiggle(coords, segment))
+    return gpd.GeoDataFrame({
+        'tract_geoid': [f'99{i:09d}' for i in range(count)],
+        'tract_name': [f'{i // 100 + 1}.{i % 100:02d}' for i in range(count)]
+    }, geometry=cells, crs='EPSG:4326')
+
+def synthetic_attributes(count, year, scale, seed=SEED):
+    """Application counts and approval rates of one year, distributed like the Tampa file"""
+    rng = np.random.default_rng([seed, scale, year])
+    white_total = rng.integers(10, 100, size=count)
+    black_total = rng.integers(5, 50, size=count)
+    # A few tracts below the minimum, so every gap class is drawn
+    sparse = rng.random(count) < 0.03
+    white_total[sparse] = rng.integers(0, 3, size=sparse.sum())
+    black_total[sparse] = rng.integers(0, 2, size=sparse.sum())
+
+    white_rate = np.clip(rng.normal(0.745, 0.095, size=count), 0, 1)
+    black_rate = np.clip(white_rate - rng.normal(0.095, 0.138, size=count), 0, 1)
+    return {
+        'white_rate': white_rate,
+        'black_rate': black_rate,
+        'gap': white_rate - black_rate,
+        'white_total': white_total,
+        'black_total': black_total
+    }
+
+def generate(scale, years=(BENCH_YEAR,), base=BENCH_DIR, seed=SEED):
+    """Write the synthetic tract files of one scale, unless they are already there"""
+    directory = scale_directory(scale, base)
+    marker = os.path.join(directory, 'synthetic.json')
+    spec = {'version': GENERATOR_VERSION, 'seed': seed, 'scale': scale}
+    try:
+        with open(marker, 'r') as f:
+            existing = json.load(f)
+        written = existing.pop('years')
+        if existing == spec:
+            if set(years) <= set(written):
+                return directory
+            years = set(years) | set(written)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    start = time.perf_counter()
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    tracts = synthetic_tracts(scale, seed)
+    for year in sorted(years):
+        gdf = tracts.assign(year=year, cbsa_code=SYNTHETIC_CODE, metro_name=synthetic_name(scale),
+                            **synthetic_attributes(len(tracts), year, scale, seed))
+        to_browser_geojson(gdf, os.path.join(directory, legacy_filename(SYNTHETIC_CODE, year)), TRACT_COLUMNS)
+    with open(marker, 'w') as f:
+        json.dump(dict(spec, years=sorted(years)), f)
+
+    vertices = int(shapely.get_num_coordinates(tracts.geometry.values).sum())
+    print(f"Generated {scale}x: {len(tracts):,} tracts, {vertices:,} vertices, {len(years)} years "
+          f"in {time.perf_counter() - start:.1f}s")
+    return directory
+
+def tract_file(directory, year=BENCH_YEAR):
+    return os.path.join(directory, legacy_filename(SYNTHETIC_CODE, year))
+
+def strip_crs(source, target):
+    """Copy a GeoJSON file without its crs member, as the CRS fix finds files in the wild"""
+    with open(source, 'rb') as f:
+        data = f.read()
+    start = data.find(b'"crs":')
+    end = data.find(b'"features":', start)
+    with open(target, 'wb') as f:
+        f.write(data[:start] + data[end:] if start >= 0 else data)
+
+def time_call(func, setup=None, repeat=3):
+    """Seconds per call of func(setup()) over repeat runs; setup is not timed
+
+    Calls faster than MIN_RUN_SECONDS are looped within a run, and the run's
+    time divided by the number of calls, as timeit does.
+    """
+    def run(number):
+        total = 0.0
+        gc.collect()
+        for _ in range(number):
+            argument = setup() if setup else None
+            start = time.perf_counter()
+            func(argument)
+            total += time.perf_counter() - start
+        return total / number
+
+    first = run(1)
+    number = max(1, math.ceil(MIN_RUN_SECONDS / first)) if first < MIN_RUN_SECONDS else 1
+    return [first] + [run(number) for _ in range(repeat - 1)], number
+
+# Each benchmark takes the directory of one scale's synthetic data and the
+# scale, and returns (func, setup, counts); func(setup()) is the timed call
+def bench_load_geojson(directory, scale):
+    filename = tract_file(directory)
+    return lambda _: read_geojson(filename), None, {'file_bytes': os.path.getsize(filename)}
+
+def bench_from_features(directory, scale):
+    with open(tract_file(directory), 'r') as f:
+        features = json.load(f)['features']
+    return lambda _: gpd.GeoDataFrame.from_features(features), None, {'features': len(features)}
+
+def bench_classify(directory, scale):
+    from gap_classes import gap_colors
+    gdf = read_geojson(tract_file(directory), columns=['gap', 'white_total', 'black_total'])
+    columns = gdf['gap'].to_numpy(), gdf['white_total'].to_numpy(), gdf['black_total'].to_numpy()
+    return lambda _: gap_colors(*columns), None, {'tracts': len(gdf)}
+
+def render_benchmark(directory, scale, image_format):
+    from export_metro_maps import create_metro_map
+    counts = {}
+
+    def render(_):
+        with working_directory(directory), redirect_stdout(io.StringIO()):
+            filename = create_metro_map(SYNTHETIC_CODE, synthetic_name(scale), BENCH_YEAR,
+                                        image_format=image_format)
+            counts['output_bytes'] = os.path.getsize(filename)
+    return render, None, counts
+
+def bench_render_svg(directory, scale):
+    return render_benchmark(directory, scale, 'svg')
+
+def bench_render_png(directory, scale):
+    return render_benchmark(directory, scale, 'png')
+
+def bench_render_hex(directory, scale):
+    from hex_grid import build_hex_layers, render_overview
+    with working_directory(directory), redirect_stdout(io.StringIO()):
+        build_hex_layers(SYNTHETIC_CODE, [BENCH_YEAR])
+    counts = {}
+
+    def render(_):
+        with working_directory(directory):
+            filename = render_overview(SYNTHETIC_CODE, synthetic_name(scale), BENCH_YEAR, HEX_RESOLUTION, 'png')
+            counts['output_bytes'] = os.path.getsize(filename)
+    return render, None, counts
+
+def bench_fix_crs(directory, scale):
+    from fix_geojson_crs import fix_file_crs
+    source, target = tract_file(directory), os.path.join(directory, 'no_crs.geojson')
+
+    def fix(_):
+        status, message = fix_file_crs(target)
+        if status != 'fixed':
+            raise RuntimeError(f"CRS fix returned {status}: {message}")
+    return fix, lambda: strip_crs(source, target), {'file_bytes': os.path.getsize(source)}
+
+def bench_fix_crs_full(directory, scale):
+    from fix_geojson_crs import rewrite_file_crs
+    source, target = tract_file(directory), os.path.join(directory, 'no_crs.geojson')
+
+    def fix(_):
+        status, message = rewrite_file_crs(target)
+        if status != 'fixed':
+            raise RuntimeError(f"CRS rewrite returned {status}: {message}")
+    return fix, lambda: strip_crs(source, target), {'file_bytes': os.path.getsize(source)}
+
+def bench_overpass_parse(directory, scale):
+    from fake_overpass import FakeOverpass
+    from osm_geometry import assemble_features
+    south, west, north, east = BASE_BOUNDS[1], BASE_BOUNDS[0], BASE_BOUNDS[3], BASE_BOUNDS[2]
+    query = (f'[out:json];(way["natural"="water"]({south},{west},{north},{east});'
+             f'relation["natural"="water"]({south},{west},{north},{east});'
+             f'way["waterway"="river"]({south},{west},{north},{east});'
+             f'relation["waterway"="river"]({south},{west},{north},{east});'
+             f'way["leisure"="park"]({south},{west},{north},{east}););out body;>;out skel qt;')
+    text = json.dumps(FakeOverpass(features=20 * scale).respond(query))
+    return lambda _: assemble_features(json.loads(text)), None, {'response_bytes': len(text)}
+
+BENCHMARKS = {
+    'load_geojson': bench_load_geojson,
+    'from_features': bench_from_features,
+    'classify': bench_classify,
+    'render_svg': bench_render_svg,
+    'render_png': bench_render_png,
+    'render_hex': bench_render_hex,
+    'fix_crs': bench_fix_crs,
+    'fix_crs_full': bench_fix_crs_full,
+    'overpass_parse': bench_overpass_parse
+}
+
+def environment():
+    """Versions and commit a result file was measured with"""
+    import matplotlib
+    import pyogrio
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'versions': {
+            'numpy': np.__version__,
+            'geopandas': gpd.__version__,
+            'shapely': shapely.__version__,
+            'geos': shapely.geos_version_string,
+            'pyogrio': pyogrio.__version__,
+            'matplotlib': matplotlib.__version__
+        },
+        'generator': {'version': GENERATOR_VERSION, 'seed': SEED}
+    }
+
+def run_benchmarks(names=None, scales=DEFAULT_SCALES, repeat=3, base=BENCH_DIR, output=None):
+    """Time every benchmark at every scale and write the results as JSON"""
+    names = names or list(BENCHMARKS)
+    results = []
+    for scale in scales:
+        directory = generate(scale, base=base)
+        for name in names:
+            func, setup, counts = BENCHMARKS[name](directory, scale)
+            seconds, number = time_call(func, setup, repeat)
+            results.append({
+                'benchmark': name,
+                'scale': scale,
+                'repeat': repeat,
+                'number': number,
+                'seconds': seconds,
+                'min': min(seconds),
+                'median': statistics.median(seconds),
+                'counts': counts
+            })
+            print(f"  {name:<15} {scale:>4}x  min {min(seconds) * 1000:>10.2f} ms  "
+                  f"median {statistics.median(seconds) * 1000:>10.2f} ms")
+            del func, setup
+            gc.collect()
+
+    output = output or os.path.join(base, f"results_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    print(f"Saved {len(results)} results to {output}")
+    return output
+
+def compare_results(before_file, after_file, threshold=0.1):
+    """Print the change of every benchmark between two result files; returns the regressions
+
+    Runs are compared by their fastest time, which is the least disturbed by
+    other load on the machine. A benchmark is a regression when it got slower
+    by more than threshold (a fraction).
+    """
+    with open(before_file, 'r') as f:
+        before = {(result['benchmark'], result['scale']): result for result in json.load(f)['results']}
+    with open(after_file, 'r') as f:
+        after = {(result['benchmark'], result['scale']): result for result in json.load(f)['results']}
+
+    regressions = []
+    print(f"{'benchmark':<16} {'scale':>5} {'before':>12} {'after':>12} {'ratio':>6}")
+    for key in sorted(before.keys() & after.keys(), key=lambda key: (key[1], list(BENCHMARKS).index(key[0])
+                                                                    if key[0] in BENCHMARKS else 0)):
+        old, new = before[key]['min'], after[key]['min']
+        ratio = new / old if old else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print(f"{key[0]:<16} {key[1]:>4}x {old * 1000:>10.2f}ms {new * 1000:>10.2f}ms {ratio:>6.2f}{flag}")
+
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[0]:<16} {key[1]:>4}x only in {'before' if key in before else 'after'}")
+    print(f"{len(regressions)} regressions over {threshold:.0%}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic tract data")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Run the benchmarks and save the results as JSON")
+    run.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    run.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                     help="Multiples of the Tampa file's size (default: 1 10; 100 needs several GB for from_features)")
+    run.add_argument('--repeat', type=int, default=3, help="Timed runs of each benchmark")
+    run.add_argument('--dir', default=BENCH_DIR, help="Directory for synthetic data and results")
+    run.add_argument('-o', '--output', help="Result file (default: <dir>/results_<time>.json)")
+
+    generate_parser = commands.add_parser('generate', help="Write the synthetic tract files only")
+    generate_parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    generate_parser.add_argument('--years', type=int, nargs='+', default=[BENCH_YEAR])
+    generate_parser.add_argument('--dir', default=BENCH_DIR)
+
+    compare = commands.add_parser('compare', help="Compare two result files and flag regressions")
+    compare.add_argument('before', help="Result file of the baseline run")
+    compare.add_argument('after', help="Result file of the run to check")
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help="Slowdown that counts as a regression (default 0.1 = 10%%)")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_benchmarks(args.only, args.scales, args.repeat, args.dir, args.output)
+    elif args.command == 'generate':
+        for scale in args.scales:
+            generate(scale, args.years, args.dir)
+    else:
+        sys.exit(1 if compare_results(args.before, args.after, args.threshold) else 0)
@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import tempfile
+
+MANIFEST_VERSION = 1
+
+# mkstemp creates files readable by the owner only; manifests get the mode a
+# plain open() would give them, so other users and nodes can read shared ones
+_umask = os.umask(0)
+os.umask(_umask)
+MANIFEST_MODE = 0o666 & ~_umask
+
+def file_hash(filename, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, or None when the file does not exist"""
+    if not os.path.exists(filename):
+        return None
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def value_hash(value):
+    """SHA-256 of any JSON-serializable value, independent of dict ordering"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+class BuildManifest:
+    """Record of the input hashes each output was last built from
+
+    The manifest maps an output path to a dict of named input hashes. An output
+    is up to date when it exists and its recorded inputs match the current ones.
+    Every save goes through a temp file and an atomic rename, so an interrupted
+    run leaves either the previous manifest or the new one, never a partial file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.outputs = {}
+        self._file_hashes = {}
+        self.load()
+
+    def load(self):
+        """Read the manifest, starting empty if it is missing or unreadable"""
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.restore(data)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.filename):
+                print(f"  Ignoring unreadable build manifest {self.filename}: {e}")
+            self.outputs = {}
+
+    def restore(self, data):
+        """Take over the contents of a manifest file of the current version"""
+        self.outputs = data.get('outputs', {})
+
+    def contents(self):
+        """Everything save writes, as a JSON-ready dict"""
+        return {'version': MANIFEST_VERSION, 'outputs': self.outputs}
+
+    def hash_file(self, filename):
+        """File hash, computed once per run however many outputs share the file"""
+        if filename not in self._file_hashes:
+            self._file_hashes[filename] = file_hash(filename)
+        return self._file_hashes[filename]
+
+    def is_fresh(self, output, inputs):
+        """Whether an output exists and was built from exactly these inputs"""
+        return os.path.exists(output) and self.outputs.get(output) == inputs
+
+    def record(self, output, inputs):
+        """Remember the inputs an output was just built from"""
+        self.outputs[output] = inputs
+
+    def save(self):
+        """Atomically replace the manifest on disk"""
+        directory = os.path.dirname(self.filename) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_filename = tempfile.mkstemp(prefix='.manifest-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.contents(), f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_filename, MANIFEST_MODE)
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
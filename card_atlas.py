@@ -0,0 +1,202 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import geopandas as gpd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+from build_cache import file_hash
+from gap_classes import gap_colors
+from geo_io import read_geojson
+from metro_boundaries import water_parks_filename
+from metros import metro_areas, safe_metro_name
+from tract_store import has_tract_year, load_tract_attributes, load_tract_geometry
+
+ATLAS_DIR = 'atlas'
+INDEX_FILE = os.path.join(ATLAS_DIR, 'cards.json')
+YEARS = [2018, 2019, 2020, 2021, 2022, 2023, 2024]
+
+# Size of a card's map in index.html, in CSS pixels
+CARD_WIDTH = 380
+CARD_HEIGHT = 250
+# Cards per row of an atlas image
+ATLAS_COLUMNS = 6
+
+# d3.geoAlbers: conic equal-area with standard parallels 29.5 and 45.5 around -96,
+# so the sprites have the same shapes as the cards index.html draws live
+ALBERS = '+proj=aea +lat_1=29.5 +lat_2=45.5 +lat_0=37.5 +lon_0=-96 +datum=WGS84 +units=m +no_defs'
+
+# One CSS pixel in points, for line widths and marker sizes at 100 dpi
+PX = 72 / 100
+
+def fit_extent(ax, bounds):
+    """Center bounds in the card and scale them to fit, as d3's fitSize does"""
+    minx, miny, maxx, maxy = bounds
+    k = min(CARD_WIDTH / max(maxx - minx, 1e-9), CARD_HEIGHT / max(maxy - miny, 1e-9))
+    cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+    ax.set_xlim(cx - CARD_WIDTH / k / 2, cx + CARD_WIDTH / k / 2)
+    ax.set_ylim(cy - CARD_HEIGHT / k / 2, cy + CARD_HEIGHT / k / 2)
+
+def add_context(ax, metro_name):
+    """Water, parks and landmarks in the card styles of index.html"""
+    water_parks_file = water_parks_filename(metro_name)
+    water_parks = read_geojson(water_parks_file) if os.path.exists(water_parks_file) else None
+    if water_parks is not None and 'type' in water_parks:
+        water_parks = water_parks.to_crs(ALBERS)
+        water = water_parks[water_parks['type'].isin(['water', 'coastline'])]
+        if not water.empty:
+            # The live card only strokes water, so lakes are drawn as outlines
+            outlines = np.where(water.geom_type.str.contains('Polygon'), water.boundary, water.geometry)
+            gpd.GeoSeries(outlines, crs=water.crs).plot(ax=ax, color='#808080', linewidth=2 * PX, alpha=0.7)
+        parks = water_parks[water_parks['type'] == 'park']
+        if not parks.empty:
+            parks.plot(ax=ax, color='#D3D3D3', edgecolor='#696969', linewidth=PX, alpha=0.6)
+
+    landmarks_file = f'landmarks_{safe_metro_name(metro_name)}.geojson'
+    if os.path.exists(landmarks_file):
+        landmarks = read_geojson(landmarks_file).to_crs(ALBERS)
+        if not landmarks.empty:
+            ax.scatter(landmarks.geometry.x, landmarks.geometry.y, s=(6 * PX) ** 2, color='#000',
+                       edgecolors='#fff', linewidths=PX, alpha=0.8, zorder=3)
+
+def card_stats(attributes):
+    """The averages a card shows under its map, over every tract of the year"""
+    def mean(column):
+        value = attributes[column].mean() if column in attributes else np.nan
+        return None if np.isnan(value) else round(float(value), 6)
+    return {'tracts': len(attributes), 'white_rate': mean('white_rate'),
+            'black_rate': mean('black_rate'), 'gap': mean('gap')}
+
+def render_metro_cards(code, metro_name, years, scale=1):
+    """{year: (RGBA array, stats)} of one metro's cards, drawing the figure only once
+
+    Like the SVG export, the tracts and context layers are drawn once and each
+    year only recolors the tract patches and rewrites the tract count.
+    """
+    available = [year for year in years if has_tract_year(code, year)]
+    if not available:
+        return {}
+
+    tracts = load_tract_geometry(code, available[0])
+    tracts = tracts[~(tracts.geometry.isna() | tracts.geometry.is_empty)].to_crs(ALBERS)
+    if tracts.empty:
+        return {}
+
+    fig = plt.figure(figsize=(CARD_WIDTH / 100, CARD_HEIGHT / 100), dpi=100 * scale)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    tracts.plot(ax=ax, edgecolor='white', linewidth=0.5 * PX)
+    patches = ax.collections[0]
+    add_context(ax, metro_name)
+    fit_extent(ax, tracts.total_bounds)
+    count = fig.text(0.5, 10 / CARD_HEIGHT, '', ha='center', fontsize=12 * PX, color='#333')
+
+    cards = {}
+    try:
+        for year in available:
+            attributes = load_tract_attributes(code, year)
+            joined = attributes.drop_duplicates('tract_geoid').set_index('tract_geoid') \
+                .reindex(tracts['tract_geoid'])
+            colors = gap_colors(joined['gap'], joined['white_total'], joined['black_total']).astype(object)
+            # Tracts without attributes this year are left out, as the live card leaves them out
+            colors[joined['gap'].isna().to_numpy() & joined['white_total'].isna().to_numpy()] = 'none'
+            patches.set_facecolor(list(colors))
+
+            drawn = attributes[attributes['tract_geoid'].isin(tracts['tract_geoid'])]
+            count.set_text(f'{len(drawn)} tracts')
+            fig.canvas.draw()
+            cards[year] = (np.asarray(fig.canvas.buffer_rgba()).copy(), card_stats(drawn))
+    finally:
+        plt.close(fig)
+    return cards
+
+def save_image(image, filename, quality):
+    """Write an atlas image as WebP (or PNG, by extension) and return a short content hash"""
+    if filename.endswith('.png'):
+        image.save(filename, optimize=True)
+    else:
+        image.save(filename, quality=quality, method=6, lossless=quality >= 100)
+    return file_hash(filename)[:12]
+
+def build_atlas(years=None, workers=1, scale=1, image_format='webp', quality=90):
+    """Render every card for every year into one sprite image per year plus a JSON index
+
+    The index holds each metro's offset in the images (the same for every
+    year) and the per-year numbers printed under each card, so index.html
+    paints the whole grid from one image and one small JSON file.
+    """
+    years = years or YEARS
+    if not workers or workers < 1:
+        workers = os.cpu_count() or 1
+    os.makedirs(ATLAS_DIR, exist_ok=True)
+
+    jobs = [(code, name) for code, name in metro_areas.items()
+            if any(has_tract_year(code, year) for year in years)]
+    if workers == 1:
+        rendered = [render_metro_cards(code, name, years, scale) for code, name in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_metro_cards, code, name, years, scale) for code, name in jobs]
+            rendered = [future.result() for future in futures]
+    placed = [(code, cards) for (code, _), cards in zip(jobs, rendered) if cards]
+
+    columns = min(ATLAS_COLUMNS, max(len(placed), 1))
+    rows = -(-len(placed) // columns)
+    offsets = {code: {'x': (i % columns) * CARD_WIDTH, 'y': (i // columns) * CARD_HEIGHT}
+               for i, (code, _) in enumerate(placed)}
+    index = {
+        'card_width': CARD_WIDTH,
+        'card_height': CARD_HEIGHT,
+        'width': columns * CARD_WIDTH,
+        'height': rows * CARD_HEIGHT,
+        'scale': scale,
+        'cards': offsets,
+        'years': {}
+    }
+
+    # Keep the years not rebuilt this time, as long as the cards sit where they did
+    if os.path.exists(INDEX_FILE):
+        with open(INDEX_FILE, 'r') as f:
+            previous = json.load(f)
+        if all(previous.get(key) == index[key] for key in ('cards', 'width', 'height', 'scale')):
+            index['years'] = {year: sheet for year, sheet in previous['years'].items()
+                              if int(year) not in years}
+
+    for year in years:
+        in_year = [(code, cards[year]) for code, cards in placed if year in cards]
+        if not in_year:
+            continue
+        sheet = np.zeros((rows * CARD_HEIGHT * scale, columns * CARD_WIDTH * scale, 4), dtype=np.uint8)
+        for code, (pixels, _) in in_year:
+            x, y = offsets[code]['x'] * scale, offsets[code]['y'] * scale
+            sheet[y:y + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+
+        name = f'cards_{year}.{image_format}'
+        version = save_image(Image.fromarray(sheet, 'RGBA'), os.path.join(ATLAS_DIR, name), quality)
+        index['years'][str(year)] = {
+            # The content hash in the URL lets browsers cache each image for good
+            'image': f'{name}?v={version}',
+            'cards': {code: stats for code, (_, stats) in in_year}
+        }
+        size = os.path.getsize(os.path.join(ATLAS_DIR, name))
+        print(f"Saved {ATLAS_DIR}/{name} ({len(in_year)} cards, {size / 1e3:.1f} KB)")
+
+    index['years'] = dict(sorted(index['years'].items()))
+    with open(INDEX_FILE, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    print(f"Saved {INDEX_FILE}")
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render the index.html metro cards into one sprite atlas per year")
+    parser.add_argument('--years', type=int, nargs='+', help="Years to render (default: 2018-2024)")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="Number of worker processes (0 = one per CPU core)")
+    parser.add_argument('--scale', type=int, default=1, help="Device pixels per CSS pixel, e.g. 2 for HiDPI screens")
+    parser.add_argument('--format', choices=['webp', 'png'], default='webp')
+    parser.add_argument('--quality', type=int, default=90, help="WebP quality (100 = lossless)")
+    args = parser.parse_args()
+    build_atlas(args.years, args.workers, args.scale, args.format, args.quality)
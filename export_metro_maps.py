@@ -1,113 +1,97 @@
 import os
 import json
+import time
+import argparse
+import warnings
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import geopandas as gpd
+import matplotlib
+matplotlib.use('Agg')  # Headless backend so every worker process owns its own renderer
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
+import shapely
+from build_cache import BuildManifest, value_hash
+from export_shards import ShardManifest, parse_shard, shard_jobs
+from geo_io import read_geojson
+from map_output import (RASTER_FORMATS, SIMPLIFY_PIXELS, draw_tract_fills, output_dpi, pixel_size,
+                        save_map, simplify_tracts)
+from gap_classes import MIN_APPLICATIONS, gap_classes_config, gap_colors, legend_classes
+from metro_boundaries import water_parks_filename
+from metros import metro_areas, safe_metro_name
+from profiling import NULL_PROFILER, StageProfiler, profile_call, traced_memory, write_report
+from tract_store import (has_tract_year, legacy_filename, load_tract_attributes,
+                         load_tract_geometry, load_tract_year, tract_sources)
 
-# Create metro-areas folder
-os.makedirs('metro-areas', exist_ok=True)
-
-# Metro areas with their codes and names
-metro_areas = {
-    "35620": "New York-Newark-Jersey City, NY-NJ-PA",
-    "31080": "Los Angeles-Long Beach-Anaheim, CA", 
-    "16980": "Chicago-Naperville-Elgin, IL-IN-WI",
-    "19100": "Dallas-Fort Worth-Arlington, TX",
-    "26420": "Houston-The Woodlands-Sugar Land, TX",
-    "47900": "Washington-Arlington-Alexandria, DC-VA-MD-WV",
-    "33100": "Miami-Fort Lauderdale-West Palm Beach, FL",
-    "37980": "Philadelphia-Camden-Wilmington, PA-NJ-DE-MD",
-    "12060": "Atlanta-Sandy Springs-Roswell, GA",
-    "38060": "Phoenix-Mesa-Chandler, AZ",
-    "14460": "Boston-Cambridge-Newton, MA-NH",
-    "41860": "San Francisco-Oakland-Fremont, CA",
-    "40140": "Riverside-San Bernardino-Ontario, CA",
-    "19820": "Detroit-Warren-Dearborn, MI",
-    "42660": "Seattle-Tacoma-Bellevue, WA",
-    "33460": "Minneapolis-St. Paul-Bloomington, MN-WI",
-    "45300": "Tampa-St. Petersburg-Clearwater, FL",
-    "41740": "San Diego-Chula Vista-Carlsbad, CA",
-    "19740": "Denver-Aurora-Centennial, CO",
-    "36740": "Orlando-Kissimmee-Sanford, FL",
-    "16740": "Charlotte-Concord-Gastonia, NC-SC",
-    "12580": "Baltimore-Columbia-Towson, MD",
-    "41180": "St. Louis, MO-IL",
-    "41700": "San Antonio-New Braunfels, TX",
-    "12420": "Austin-Round Rock-San Marcos, TX",
-    "29820": "Las Vegas-Henderson-North Las Vegas, NV",
-    "40900": "Sacramento-Roseville-Folsom, CA"
-}
+# Bump whenever a change to the drawing code should re-render every map
+RENDERER_VERSION = 2
+MANIFEST_FILE = 'metro-areas/manifest.json'
+# cProfile dumps of the slowest jobs, next to profile.json and profile.csv
+CPROFILE_DIR = 'metro-areas/profiles'
+
+class ContextLayerWarning(UserWarning):
+    """A water/park layer could not be drawn; the map is saved without it"""
 
 def get_gap_color(gap, white_total, black_total):
     """Get color based on gap and application count - Orange for gaps, Blue for no gap/positive"""
-    if white_total + black_total < 5:
-        return '#cccccc'  # Grey for insufficient data
-    
-    if gap < 0:
-        return '#4A90E2'  # Blue for positive (no gap)
-    elif gap < 0.05:
-        return '#FFE5CC'  # Light orange for low gap
-    elif gap < 0.10:
-        return '#FFB366'  # Medium orange for medium gap
-    elif gap < 0.15:
-        return '#FF8000'  # Dark orange for high gap
-    else:
-        return '#CC6600'  # Very dark orange for very high gap
+    return gap_colors([gap], [white_total], [black_total])[0]
 
-def create_metro_map(geojson_file, metro_name, year):
-    """Create and save a metro area map as SVG"""
-    
-    # Load the GeoJSON data
-    with open(geojson_file, 'r') as f:
-        geojson_data = json.load(f)
-    
-    if not geojson_data['features']:
-        print(f"No features found in {geojson_file}")
-        return
-    
-    # Convert to GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
-    
-    # Create figure
-    fig, ax = plt.subplots(1, 1, figsize=(12, 8))
-    
-    # Color the tracts based on gap and application count
-    colors = []
-    for idx, row in gdf.iterrows():
-        gap = row['gap']
-        white_total = row['white_total']
-        black_total = row['black_total']
-        colors.append(get_gap_color(gap, white_total, black_total))
+def tract_colors(gdf):
+    """Colors for every tract based on gap and application count"""
+    return list(gap_colors(gdf['gap'], gdf['white_total'], gdf['black_total']))
+
+def tract_stats_text(gdf):
+    """Statistics box text for one year of tracts, or None without enough data"""
+    valid_tracts = gdf[gdf['white_total'] + gdf['black_total'] >= MIN_APPLICATIONS]
+    if len(valid_tracts) == 0:
+        return None
     
-    # Plot the tracts
-    gdf.plot(color=colors, ax=ax, edgecolor='white', linewidth=0.5)
+    avg_gap = valid_tracts['gap'].mean()
+    avg_white_rate = valid_tracts['white_rate'].mean()
+    avg_black_rate = valid_tracts['black_rate'].mean()
     
+    stats_text = f'Average White Rate: {avg_white_rate:.1%}\n'
+    stats_text += f'Average Black Rate: {avg_black_rate:.1%}\n'
+    stats_text += f'Average Gap: {avg_gap:.1%}\n'
+    stats_text += f'Total Tracts: {len(gdf)}'
+    return stats_text
 
-
-    # Add water and park features if available
+def add_water_parks(ax, metro_name, profiler=NULL_PROFILER, year=None, tolerance=0):
+    """Add water and park features if available
+    
+    tolerance simplifies the features first, in degrees. A layer that cannot
+    be drawn is reported as a ContextLayerWarning, which the export jobs
+    collect into their results, and the map goes on without it.
+    """
     try:
-        water_parks_file = f'water_parks_{metro_name.replace("/", "-").replace(",", "").replace(" ", "_")}.geojson'
+        water_parks_file = water_parks_filename(metro_name)
         if os.path.exists(water_parks_file):
-            with open(water_parks_file, 'r') as f:
-                water_parks_data = json.load(f)
-            
-            # Convert water/parks to GeoDataFrame
-            water_parks_gdf = gpd.GeoDataFrame.from_features(water_parks_data['features'])
+            # Load water/parks as a GeoDataFrame
+            water_parks_gdf = read_geojson(water_parks_file)
+            if profiler.enabled:
+                profiler.count('water_parks_features', len(water_parks_gdf), year)
+            if 'type' not in water_parks_gdf:
+                # An empty FeatureCollection has no columns at all
+                return
+            if tolerance:
+                water_parks_gdf.geometry = water_parks_gdf.geometry.simplify(tolerance)
             
             # Plot water features (rivers, lakes, coastline)
             water_features = water_parks_gdf[water_parks_gdf['type'].isin(['water', 'coastline'])]
             if not water_features.empty:
-                water_features.plot(ax=ax, color='#808080', linewidth=2, alpha=0.7)
+                water_features.plot(ax=ax, color='#808080', linewidth=2, alpha=0.7, aspect='equal')
                 
                 # Add labels for major water features
                 major_water = water_features[water_features['name'].str.contains('River|Lake|Ocean|Bay', case=False)]
                 for idx, water in major_water.iterrows():
-                    if water.geometry.geom_type == 'LineString':
-                        coords = list(water.geometry.coords)[0]
+                    # Clipping can split a feature; label its first part
+                    geometry = water.geometry.geoms[0] if hasattr(water.geometry, 'geoms') else water.geometry
+                    if geometry.geom_type == 'LineString':
+                        coords = list(geometry.coords)[0]
                     else:
-                        coords = list(water.geometry.exterior.coords)[0]
+                        coords = list(geometry.exterior.coords)[0]
                     ax.annotate(water['name'], 
                                xy=coords,
                                xytext=(5, -5), textcoords='offset points',
@@ -117,71 +101,459 @@ def create_metro_map(geojson_file, metro_name, year):
             # Plot park features
             park_features = water_parks_gdf[water_parks_gdf['type'] == 'park']
             if not park_features.empty:
-                park_features.plot(ax=ax, color='#D3D3D3', edgecolor='#696969', linewidth=1, alpha=0.6)
+                park_features.plot(ax=ax, color='#D3D3D3', edgecolor='#696969', linewidth=1, alpha=0.6, aspect='equal')
                 
     except Exception as e:
-        print(f"  Could not add water/parks: {e}")
+        warnings.warn(f"Could not add water/parks for {metro_name}: {type(e).__name__}: {e}",
+                      ContextLayerWarning, stacklevel=2)
+
+def add_legend(ax):
+    """Add the gap category legend"""
+    legend_elements = [mpatches.Patch(color=gap_class['color'], label=gap_class['label'])
+                       for gap_class in legend_classes()]
+    
+    ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1, 1), 
+              fontsize=10, frameon=True, fancybox=True, shadow=True)
+
+def map_title(metro_name, year):
+    """Figure title for one metro and year"""
+    return f'{metro_name}\nBlack-White Mortgage Approval Rate Gaps ({year})'
+
+def map_filename(metro_name, year, image_format='svg'):
+    """Output SVG (or raster thumbnail) path for one metro and year"""
+    return f'metro-areas/{year}_{safe_metro_name(metro_name)}.{image_format}'
+
+def count_geometry(profiler, gdf, year=None):
+    """Record how many tracts and vertices a map draws"""
+    profiler.count('features', len(gdf), year)
+    profiler.count('vertices', int(shapely.get_num_coordinates(gdf.geometry.values).sum()), year)
+
+def save_output(fig, filename, profiler=NULL_PROFILER, year=None, image_format='svg', compact=True):
+    """Save a figure, timed as its own stage"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with profiler.stage(f'save_{image_format}', year):
+        save_map(fig, filename, image_format, compact)
+    if profiler.enabled:
+        profiler.count('output_bytes', os.path.getsize(filename), year)
+    print(f"Saved: {filename}")
+
+def simplified_tracts(ax, gdf, image_format, profiler=NULL_PROFILER, year=None):
+    """(tract geometries simplified to half an output pixel, tolerance in degrees)"""
+    with profiler.stage('simplify', year):
+        tolerance = SIMPLIFY_PIXELS * pixel_size(ax, gdf.total_bounds, output_dpi(image_format))
+        geometries = simplify_tracts(gdf.geometry.values, tolerance)
+    if profiler.enabled:
+        profiler.count('drawn_vertices', int(shapely.get_num_coordinates(geometries).sum()), year)
+    return geometries, tolerance
+
+def create_metro_map(code, metro_name, year, profiler=NULL_PROFILER, image_format='svg', compact=True):
+    """Create and save a metro area map as SVG or as a raster thumbnail
     
-    # Remove axes
-    ax.set_axis_off()
+    The compact writer simplifies the tracts to the output resolution, draws
+    one path per color and rounds the SVG coordinates to match; with compact
+    off every tract is its own patch at full precision.
+    """
     
-    # Add title
-    plt.suptitle(f'{metro_name}\nBlack-White Mortgage Approval Rate Gaps ({year})', 
-                 fontsize=16, fontweight='bold', y=0.95)
+    # Load the tracts with this year's attributes
+    with profiler.stage('load_tracts', year):
+        gdf = load_tract_year(code, year)
     
-    # Add legend
-    legend_elements = [
-        mpatches.Patch(color='#CC6600', label='Very High Gap (>15%)'),
-        mpatches.Patch(color='#FF8000', label='High Gap (10-15%)'),
-        mpatches.Patch(color='#FFB366', label='Medium Gap (5-10%)'),
-        mpatches.Patch(color='#FFE5CC', label='Low Gap (<5%)'),
-        mpatches.Patch(color='#4A90E2', label='No Gap/Positive'),
-        mpatches.Patch(color='#cccccc', label='Insufficient Data (<5 applications)')
-    ]
+    if gdf.empty:
+        print(f"No tracts found for {metro_name} ({year})")
+        return None
+    if profiler.enabled:
+        count_geometry(profiler, gdf, year)
     
-    ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1, 1), 
-              fontsize=10, frameon=True, fancybox=True, shadow=True)
+    # Create figure
+    fig, ax = plt.subplots(1, 1, figsize=(12, 8))
     
-    # Calculate and display statistics
-    valid_tracts = gdf[gdf['white_total'] + gdf['black_total'] >= 5]
-    if len(valid_tracts) > 0:
-        avg_gap = valid_tracts['gap'].mean()
-        avg_white_rate = valid_tracts['white_rate'].mean()
-        avg_black_rate = valid_tracts['black_rate'].mean()
+    # Plot the tracts colored by gap and application count; the loaders tag
+    # lon/lat data with its CRS, and aspect='equal' keeps the unprojected look
+    tolerance = 0
+    if compact:
+        drawn = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+        geometries, tolerance = simplified_tracts(ax, drawn, image_format, profiler, year)
+        with profiler.stage('plot_tracts', year):
+            draw_tract_fills(ax, geometries, tract_colors(drawn))
+    else:
+        with profiler.stage('plot_tracts', year):
+            gdf.plot(color=tract_colors(gdf), ax=ax, edgecolor='white', linewidth=0.5, aspect='equal')
+    
+    with profiler.stage('water_parks', year):
+        add_water_parks(ax, metro_name, profiler, year, tolerance)
+    
+    with profiler.stage('annotate', year):
+        # Remove axes
+        ax.set_axis_off()
+        
+        # Add title
+        fig.suptitle(map_title(metro_name, year), fontsize=16, fontweight='bold', y=0.95)
         
-        stats_text = f'Average White Rate: {avg_white_rate:.1%}\n'
-        stats_text += f'Average Black Rate: {avg_black_rate:.1%}\n'
-        stats_text += f'Average Gap: {avg_gap:.1%}\n'
-        stats_text += f'Total Tracts: {len(gdf)}'
+        add_legend(ax)
         
-        ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, 
-                verticalalignment='top', fontsize=12, 
-                bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
+        # Calculate and display statistics
+        stats_text = tract_stats_text(gdf)
+        if stats_text:
+            ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, 
+                    verticalalignment='top', fontsize=12, 
+                    bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
     
-    # Save as SVG
-    safe_name = metro_name.replace('/', '-').replace(',', '').replace(' ', '_')
-    filename = f'metro-areas/{year}_{safe_name}.svg'
-    plt.savefig(filename, format='svg', dpi=300, bbox_inches='tight')
-    plt.close()
+    filename = map_filename(metro_name, year, image_format)
+    save_output(fig, filename, profiler, year, image_format, compact)
+    plt.close(fig)
     
-    print(f"Saved: {filename}")
+    return filename
+
+def create_metro_maps(code, metro_name, years, profiler=NULL_PROFILER, image_format='svg', compact=True):
+    """Create one SVG per year for a metro, building the figure only once
+    
+    The tract geometry is identical across years, so the tract patches, water/park
+    layers, legend and labels are drawn once. Each year then only swaps the tract
+    facecolors (or, with the compact writer, redraws the simplified tracts as
+    one path per color), the title and the statistics text before saving. Years
+    whose tracts do not line up with the base geometry fall back to create_metro_map.
+    The drawing done once is profiled as shared stages, without a year.
+    """
+    available = [year for year in years if has_tract_year(code, year)]
+    saved = {}
+    if not available:
+        return saved
+    
+    # Build the base figure from the shared tract geometry
+    base_year = available[0]
+    with profiler.stage('load_geometry'):
+        base_gdf = load_tract_geometry(code, base_year)
+    
+    if base_gdf.empty:
+        print(f"No tracts found for {metro_name}")
+        return {year: None for year in available}
+    
+    base_ids = base_gdf['tract_geoid']
+    
+    # Only tracts with geometry become patches; collections would split into several
+    drawn = ~(base_gdf.geometry.isna() | base_gdf.geometry.is_empty)
+    if base_gdf.geometry[drawn].geom_type.str.startswith('Geom').any():
+        return {year: create_metro_map(code, metro_name, year, profiler, image_format, compact)
+                for year in available}
+    drawn_gdf = base_gdf[drawn]
+    drawn_ids = drawn_gdf['tract_geoid']
+    if profiler.enabled:
+        count_geometry(profiler, drawn_gdf)
+    
+    fig, ax = plt.subplots(1, 1, figsize=(12, 8))
+    tolerance = 0
+    if compact:
+        geometries, tolerance = simplified_tracts(ax, drawn_gdf, image_format, profiler)
+        with profiler.stage('plot_tracts'):
+            # Uncolored until the first year; this sets the axes limits for the context layers
+            tract_patches = draw_tract_fills(ax, geometries, ['none'] * len(geometries))
+    else:
+        with profiler.stage('plot_tracts'):
+            drawn_gdf.plot(ax=ax, edgecolor='white', linewidth=0.5, aspect='equal')
+        tract_patches = ax.collections[0]
+    
+    with profiler.stage('water_parks'):
+        add_water_parks(ax, metro_name, profiler, tolerance=tolerance)
+    with profiler.stage('annotate'):
+        ax.set_axis_off()
+        title = fig.suptitle(map_title(metro_name, base_year), fontsize=16, fontweight='bold', y=0.95)
+        add_legend(ax)
+        stats = ax.text(0.02, 0.98, '', transform=ax.transAxes, 
+                        verticalalignment='top', fontsize=12, 
+                        bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
+    
+    try:
+        for year in available:
+            with profiler.stage('load_attributes', year):
+                gdf = load_tract_attributes(code, year)
+            ids = gdf['tract_geoid']
+            if len(gdf) != len(base_gdf) or set(ids) != set(base_ids):
+                # Different tract set this year; the shared patches cannot be reused
+                saved[year] = create_metro_map(code, metro_name, year, profiler, image_format, compact)
+                continue
+            
+            # Line attributes up with the patch order of the base figure
+            with profiler.stage('recolor', year):
+                colors = tract_colors(gdf.set_index(ids).loc[drawn_ids])
+                if compact:
+                    tract_patches.remove()
+                    tract_patches = draw_tract_fills(ax, geometries, colors)
+                else:
+                    tract_patches.set_facecolor(colors)
+            with profiler.stage('annotate', year):
+                title.set_text(map_title(metro_name, year))
+                stats_text = tract_stats_text(gdf)
+                stats.set_text(stats_text or '')
+                stats.set_visible(stats_text is not None)
+            
+            filename = map_filename(metro_name, year, image_format)
+            save_output(fig, filename, profiler, year, image_format, compact)
+            saved[year] = filename
+    finally:
+        plt.close(fig)
+    
+    return saved
+
+def map_inputs(manifest, code, metro_name, year, output):
+    """Content hashes of everything a metro map for one year is drawn from"""
+    return {
+        'output': output,
+        'tracts': {filename: manifest.hash_file(filename) for filename in tract_sources(code, year)},
+        'water_parks': manifest.hash_file(water_parks_filename(metro_name)),
+        'style': value_hash(gap_classes_config()),
+        'renderer': RENDERER_VERSION
+    }
+
+def job_result(code, name, year):
+    """Empty status record for one (metro, year) job"""
+    return {'code': code, 'name': name, 'year': year, 'status': 'missing',
+            'output': None, 'error': None, 'seconds': 0.0, 'warnings': []}
+
+def export_job(code, name, year, profile=False, image_format='svg', compact=True):
+    """Render one (metro, year) map and return its status instead of raising
+    
+    With profile set, the result also carries the job's stage timings and counts.
+    """
+    result = job_result(code, name, year)
+    
+    if not has_tract_year(code, year):
+        result['error'] = f"File not found: {legacy_filename(code, year)}"
+        return result
+    
+    profiler = StageProfiler() if profile else NULL_PROFILER
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught, traced_memory(profile):
+        warnings.simplefilter('always', ContextLayerWarning)
+        try:
+            filename = create_metro_map(code, name, year, profiler, image_format, compact)
+            result['status'] = 'saved' if filename else 'empty'
+            result['output'] = filename
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            plt.close('all')  # Never leak figures into the next job run by this worker
+    result['seconds'] = time.perf_counter() - start
+    result['warnings'] = report_warnings(caught)
+    if profile:
+        result['profile'] = profiler.year_report(year)
+    
+    return result
+
+def report_warnings(caught):
+    """Print the warnings a job raised and return their messages"""
+    messages = [str(warning.message) for warning in caught]
+    for message in messages:
+        print(f"  Warning: {message}")
+    return messages
+
+def export_metro_job(code, name, years, profile=False, image_format='svg', compact=True):
+    """Render every year of one metro on a shared figure and return one status per year"""
+    results = [job_result(code, name, year) for year in years]
+    for result in results:
+        if not has_tract_year(code, result['year']):
+            result['error'] = f"File not found: {legacy_filename(code, result['year'])}"
+    
+    profiler = StageProfiler() if profile else NULL_PROFILER
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught, traced_memory(profile):
+        warnings.simplefilter('always', ContextLayerWarning)
+        try:
+            saved = create_metro_maps(code, name, years, profiler, image_format, compact)
+        except Exception as e:
+            # Retry year by year so one bad file only fails its own map
+            print(f"  Shared render failed for {name} ({type(e).__name__}: {e}), retrying per year")
+            plt.close('all')
+            return [export_job(code, name, year, profile, image_format, compact) for year in years]
+        finally:
+            plt.close('all')
+    messages = report_warnings(caught)
+    
+    # The shared figure's cost is spread evenly over the years it rendered
+    seconds = (time.perf_counter() - start) / max(len(saved), 1)
+    shared_year = next((year for year in years if year in saved), None)
+    for result in results:
+        if result['year'] in saved:
+            result['output'] = saved[result['year']]
+            result['status'] = 'saved' if result['output'] else 'empty'
+            result['seconds'] = seconds
+            result['warnings'] = messages
+            if profile:
+                # Shared stages are reported once, with the first year
+                result['profile'] = profiler.year_report(result['year'], shared=result['year'] == shared_year)
+    
+    return results
+
+def print_summary(results):
+    """Print a summary that does not depend on the order jobs finished in"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    
+    print(f"\nExport summary ({len(results)} jobs):")
+    for status in sorted(counts):
+        print(f"  {status}: {counts[status]}")
+    
+    failed = [r for r in results if r['status'] == 'failed']
+    for result in failed:
+        print(f"  FAILED {result['name']} ({result['year']}): {result['error']}")
+    
+    # A metro's shared figure reports the same warning for each of its years
+    warned = {}
+    for result in results:
+        for message in result.get('warnings', []):
+            warned.setdefault(message, []).append(result['year'])
+    for message, years in warned.items():
+        print(f"  WARNING {message} ({', '.join(str(year) for year in years)})")
 
-def main():
-    """Export all metro area maps for all years"""
-    years = [2018, 2019, 2020, 2021, 2022, 2023, 2024]
+def profile_slowest(jobs, results, count, output):
+    """Rerun the slowest jobs under cProfile and dump one .prof file per job"""
+    job_of = {}
+    for i, (func, (code, name, years)) in enumerate(jobs):
+        for year in years if isinstance(years, list) else [years]:
+            job_of[(code, year)] = i
+    seconds = {}
+    for result in results:
+        i = job_of.get((result['code'], result['year']))
+        if i is not None and result['status'] in ('saved', 'empty'):
+            seconds[i] = seconds.get(i, 0) + result['seconds']
+    
+    for i in sorted(seconds, key=seconds.get, reverse=True)[:count]:
+        func, (code, name, years) = jobs[i]
+        label = '-'.join(map(str, years)) if isinstance(years, list) else years
+        filename = os.path.join(CPROFILE_DIR, f'{safe_metro_name(name)}_{label}.prof')
+        print(f"Profiling {name} ({label}), {seconds[i]:.2f}s in the export...")
+        profile_call(filename, func, code, name, years, False, output['image_format'], output['compact'])
+        print(f"  Wrote {filename} (inspect with python -m pstats {filename})")
+
+def main(years=None, workers=1, reuse_figure=True, force=False, profile=False, cprofile_jobs=0,
+         image_format='svg', compact=True, shard=None):
+    """Export all metro area maps for all years, optionally across worker processes
+    
+    Maps whose tract, water/park, style and renderer inputs are unchanged since the
+    last build are skipped unless force is set. With profile set, every job
+    records per-stage timings and memory into metro-areas/profile.json and
+    profile.csv; cprofile_jobs reruns that many of the slowest jobs under cProfile.
+    image_format 'png' or 'webp' writes raster thumbnails instead of SVGs,
+    always with the compact writer.
     
+    shard (i, n) renders only the i-th of n cost-balanced parts of the maps and
+    records them, with checksums, in that shard's own manifest; run
+    export_shards.py merge once every shard has finished.
+    """
+    if years is None:
+        years = [2018, 2019, 2020, 2021, 2022, 2023, 2024]
+    if not workers or workers < 1:
+        workers = os.cpu_count() or 1
+    output = {'image_format': image_format, 'compact': compact or image_format in RASTER_FORMATS}
+    
+    # Work out which maps are stale before rendering anything
+    if shard:
+        manifest = ShardManifest(*shard, years, image_format, MANIFEST_FILE)
+        assigned = set(shard_jobs(years, *shard))
+        print(f"Shard {shard[0]}/{shard[1]}: {len(assigned)} maps")
+    else:
+        manifest = BuildManifest(MANIFEST_FILE)
+    inputs = {}
+    stale = {code: [] for code in metro_areas}
+    results = []
     for year in years:
-        print(f"\nProcessing year {year}...")
         for code, name in metro_areas.items():
-            geojson_file = f'metro_tracts_{code}_{year}.geojson'
-            
-            if os.path.exists(geojson_file):
-                print(f"Creating map for {name} ({year})...")
-                create_metro_map(geojson_file, name, year)
-            else:
-                print(f"File not found: {geojson_file}")
+            if shard and (code, year) not in assigned:
+                continue
+            if has_tract_year(code, year):
+                inputs[(code, year)] = map_inputs(manifest, code, name, year, output)
+                if not force and manifest.is_fresh(map_filename(name, year, image_format), inputs[(code, year)]):
+                    result = job_result(code, name, year)
+                    result['status'] = 'up-to-date'
+                    result['output'] = map_filename(name, year, image_format)
+                    results.append(result)
+                    if shard:
+                        manifest.record_result(result, inputs[(code, year)])
+                    continue
+            stale[code].append(year)
+    if shard:
+        manifest.save()
+    
+    # One job per metro renders all of its years on a shared figure;
+    # without figure reuse every (metro, year) pair is its own job
+    if reuse_figure:
+        jobs = [(export_metro_job, (code, name, stale[code]))
+                for code, name in metro_areas.items() if stale[code]]
+    else:
+        jobs = [(export_job, (code, name, year))
+                for year in years for code, name in metro_areas.items() if year in stale[code]]
+    
+    def finish(job_results):
+        """Keep a job's results and record its fresh outputs in the manifest"""
+        job_results = job_results if isinstance(job_results, list) else [job_results]
+        for result in job_results:
+            key = (result['code'], result['year'])
+            if shard and key in inputs:
+                manifest.record_result(result, inputs[key])
+            elif result['status'] == 'saved' and key in inputs:
+                manifest.record(result['output'], inputs[key])
+        manifest.save()
+        results.extend(job_results)
+    
+    if workers == 1:
+        for func, args in jobs:
+            print(f"Creating maps for {args[1]}...")
+            finish(func(*args, profile=profile, **output))
+    else:
+        print(f"Exporting {len(jobs)} jobs with {workers} workers...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(func, *args, profile=profile, **output): args for func, args in jobs}
+            for future in as_completed(futures):
+                code, name, job_years = futures[future]
+                try:
+                    job_results = future.result()
+                except Exception as e:
+                    # A worker process died outright; record it and keep the batch going
+                    job_years = job_years if isinstance(job_years, list) else [job_years]
+                    job_results = [job_result(code, name, year) for year in job_years]
+                    for result in job_results:
+                        result['status'] = 'failed'
+                        result['error'] = f"{type(e).__name__}: {e}"
+                finish(job_results)
+    
+    # Order results year by year, metro by metro, however the jobs finished
+    metro_order = {code: i for i, code in enumerate(metro_areas)}
+    results.sort(key=lambda r: (r['year'], metro_order[r['code']]))
+    for result in results:
+        if result['status'] == 'missing':
+            print(result['error'])
     
+    print_summary(results)
+    if profile:
+        write_report(results, 'metro-areas')
+    if cprofile_jobs:
+        profile_slowest(jobs, results, cprofile_jobs, output)
     print(f"\nAll maps exported to metro-areas/ folder!")
+    return results
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export metro area maps as SVG")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="Number of worker processes (0 = one per CPU core)")
+    parser.add_argument('--years', type=int, nargs='+',
+                        help="Years to export (default: 2018-2024)")
+    parser.add_argument('--per-year', action='store_true',
+                        help="Rebuild the whole figure for every year instead of recoloring it")
+    parser.add_argument('--force', action='store_true',
+                        help="Re-render every map even if its inputs are unchanged")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record per-stage time and memory into metro-areas/profile.json and profile.csv")
+    parser.add_argument('--cprofile', type=int, default=0, metavar='N',
+                        help="Rerun the N slowest jobs under cProfile into metro-areas/profiles/")
+    parser.add_argument('--format', choices=['svg'] + list(RASTER_FORMATS), default='svg',
+                        help="Write SVGs or raster thumbnails")
+    parser.add_argument('--plain-svg', action='store_true',
+                        help="Write every tract at full precision as its own path, without the compact writer")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="Render only shard I of N (by estimated cost); merge with export_shards.py")
+    args = parser.parse_args()
+    main(years=args.years, workers=args.workers, reuse_figure=not args.per_year, force=args.force,
+         profile=args.profile, cprofile_jobs=args.cprofile, image_format=args.format, compact=not args.plain_svg,
+         shard=args.shard) 
\ No newline at end of file
@@ -0,0 +1,234 @@
+import os
+import json
+import argparse
+from build_cache import BuildManifest, file_hash
+from metros import metro_areas
+from tract_store import has_tract_year, tract_sources
+
+# Per-shard manifests and the merge report, next to the maps in the shared output directory
+SHARD_DIR = 'metro-areas/shards'
+
+DEFAULT_YEARS = [2018, 2019, 2020, 2021, 2022, 2023, 2024]
+
+# Statuses of a job that needs no retry; 'empty' maps have no tracts and no output
+DONE_STATUSES = ('saved', 'up-to-date', 'empty')
+
+def parse_shard(text):
+    """(shard, count) from 'I/N', with shards numbered 1 to N"""
+    shard, _, count = text.partition('/')
+    shard, count = int(shard), int(count)
+    if not 1 <= shard <= count:
+        raise ValueError(f"shard {text} is not in 1/{count} to {count}/{count}")
+    return shard, count
+
+def shard_filename(shard, count):
+    return os.path.join(SHARD_DIR, f'shard-{shard}-of-{count}.json')
+
+def missing_filename(count):
+    return os.path.join(SHARD_DIR, f'missing-of-{count}.json')
+
+def map_cost(code, year):
+    """Estimated render cost of one map: the size of its tract geometry file
+
+    Bytes of geometry grow with the vertex count, which dominates simplifying,
+    drawing and writing a map, and a file size is the same on every node
+    without reading any geometry.
+    """
+    return os.path.getsize(tract_sources(code, year)[0])
+
+def all_jobs(years):
+    """Every (CBSA code, year) with tract data, in export order"""
+    return [(code, year) for year in years for code in metro_areas if has_tract_year(code, year)]
+
+def partition_jobs(jobs, count, cost=map_cost):
+    """Split jobs into count shards of about equal total cost
+
+    Jobs are handed out largest first, each to the shard with the least cost
+    so far (lowest number on ties), so every node that sees the same data
+    computes the same shards.
+    """
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    costs = {job: cost(*job) for job in jobs}
+    for job in sorted(jobs, key=lambda job: (-costs[job], job)):
+        i = min(range(count), key=lambda i: (loads[i], i))
+        shards[i].append(job)
+        loads[i] += costs[job]
+    return [sorted(shard, key=lambda job: (job[1], job[0])) for shard in shards]
+
+def shard_jobs(years, shard, count):
+    """The (CBSA code, year) jobs of one shard"""
+    return partition_jobs(all_jobs(years), count)[shard - 1]
+
+def shard_of_jobs(years, count):
+    """{(CBSA code, year): shard number} for every job"""
+    return {job: i + 1 for i, jobs in enumerate(partition_jobs(all_jobs(years), count)) for job in jobs}
+
+class ShardManifest(BuildManifest):
+    """Build manifest of one shard, plus the status and checksum of each of its maps
+
+    A shard without a manifest of its own yet treats maps recorded in the
+    merged manifest as fresh, so a nightly sharded run only redraws what
+    changed since the last merge.
+    """
+
+    def __init__(self, shard, count, years, image_format, base_filename=None):
+        self.shard = shard
+        self.count = count
+        self.years = list(years)
+        self.image_format = image_format
+        self.results = {}
+        super().__init__(shard_filename(shard, count))
+        self.base = BuildManifest(base_filename).outputs if base_filename else {}
+
+    def restore(self, data):
+        super().restore(data)
+        self.results = data.get('results', {})
+
+    def contents(self):
+        return dict(super().contents(), shard=self.shard, shards=self.count, years=self.years,
+                    image_format=self.image_format, results=self.results)
+
+    def is_fresh(self, output, inputs):
+        return os.path.exists(output) and inputs in (self.outputs.get(output), self.base.get(output))
+
+    def record_result(self, result, inputs=None):
+        """Remember a job's status and the checksum of the map it left behind"""
+        output = result['output']
+        if inputs is not None and result['status'] in ('saved', 'up-to-date'):
+            self.record(output, inputs)
+        self.results[f"{result['code']}/{result['year']}"] = {
+            'code': result['code'],
+            'name': result['name'],
+            'year': result['year'],
+            'status': result['status'],
+            'error': result['error'],
+            'output': output,
+            'sha256': file_hash(output) if output else None,
+            'bytes': os.path.getsize(output) if output and os.path.exists(output) else None
+        }
+
+    def forget(self, key):
+        """Drop a job's record, so the next run of the shard redraws it"""
+        result = self.results.pop(key, None)
+        if result and result['output']:
+            self.outputs.pop(result['output'], None)
+
+def load_shard_manifests(count):
+    """{shard number: ShardManifest} of every shard of count that has written a manifest"""
+    manifests = {}
+    for shard in range(1, count + 1):
+        filename = shard_filename(shard, count)
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                data = json.load(f)
+            manifests[shard] = ShardManifest(shard, count, data.get('years', []), data.get('image_format', 'svg'))
+    return manifests
+
+def check_job(result, image_format):
+    """Why a finished job has to be retried, or None when its map is complete and intact"""
+    from export_metro_maps import map_filename
+    if result is None:
+        return "not run"
+    if result['status'] not in DONE_STATUSES:
+        return f"{result['status']}: {result['error']}" if result['error'] else result['status']
+    if result['status'] == 'empty':
+        return None
+    if result['output'] != map_filename(result['name'], result['year'], image_format):
+        return f"output {result['output']} is not a {image_format} map"
+    if not os.path.exists(result['output']):
+        return "output missing"
+    if file_hash(result['output']) != result['sha256']:
+        return "checksum mismatch"
+    return None
+
+def merge_shards(count, years=None, image_format=None):
+    """Verify every shard's maps and fold their records into the merged build manifest
+
+    Checks that every (metro, year) with tract data was rendered by some shard
+    and that each map still matches the checksum its shard recorded. Failed,
+    missing or corrupt jobs are dropped from their shard manifest and the
+    merged one, so rerunning that shard redraws just those, and are written to
+    missing-of-<count>.json, which merge returns as a list.
+    """
+    # Imported here because the exporter imports this module
+    from export_metro_maps import MANIFEST_FILE, map_filename
+
+    manifests = load_shard_manifests(count)
+    recorded = next(iter(manifests.values()), None)
+    years = years or (recorded.years if recorded else DEFAULT_YEARS)
+    image_format = image_format or (recorded.image_format if recorded else 'svg')
+    print(f"Merging {len(manifests)} of {count} shard manifests ({image_format}, {min(years)}-{max(years)})")
+    for shard, manifest in manifests.items():
+        if sorted(manifest.years) != sorted(years) or manifest.image_format != image_format:
+            print(f"  Shard {shard} was run for {manifest.image_format} {manifest.years}; its maps are checked anyway")
+
+    results = {}
+    for shard, manifest in manifests.items():
+        for key, result in manifest.results.items():
+            results[key] = (shard, result)
+
+    merged = BuildManifest(MANIFEST_FILE)
+    shard_of = shard_of_jobs(years, count)
+    missing = []
+    for code, year in all_jobs(years):
+        key = f'{code}/{year}'
+        recorded_shard, result = results.get(key, (None, None))
+        reason = check_job(result, image_format)
+        if reason is None:
+            if result['output'] in manifests[recorded_shard].outputs:
+                merged.record(result['output'], manifests[recorded_shard].outputs[result['output']])
+            continue
+        # Neither the shard nor the merged manifest may call the map fresh any more
+        merged.outputs.pop(map_filename(metro_areas[code], year, image_format), None)
+        if recorded_shard is not None:
+            manifests[recorded_shard].forget(key)
+        elif shard_of[(code, year)] not in manifests:
+            reason = "shard never reported"
+        missing.append({'code': code, 'name': metro_areas[code], 'year': year,
+                        'shard': shard_of[(code, year)], 'reason': reason})
+
+    merged.save()
+    for manifest in manifests.values():
+        manifest.save()
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    with open(missing_filename(count), 'w') as f:
+        json.dump({'shards': count, 'years': years, 'image_format': image_format, 'missing': missing}, f, indent=2)
+
+    total = len(shard_of)
+    print(f"{total - len(missing)} of {total} maps complete; merged manifest saved to {MANIFEST_FILE}")
+    for job in missing:
+        print(f"  MISSING {job['name']} ({job['year']}), shard {job['shard']}: {job['reason']}")
+    for shard in sorted({job['shard'] for job in missing}):
+        print(f"  Retry: python ../export_metro_maps.py --shard {shard}/{count} "
+              f"--years {' '.join(map(str, years))} --format {image_format}")
+    return missing
+
+def print_plan(count, years):
+    """Show each shard's jobs and estimated cost without rendering anything"""
+    jobs = partition_jobs(all_jobs(years), count)
+    total = sum(map_cost(*job) for shard in jobs for job in shard) or 1
+    for i, shard in enumerate(jobs):
+        cost = sum(map_cost(*job) for job in shard)
+        print(f"Shard {i + 1}/{count}: {len(shard)} maps, {cost / total:.1%} of the estimated cost")
+        for code, year in shard:
+            print(f"  {year} {metro_areas[code]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan and merge sharded map exports")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help="Show which maps each shard renders")
+    plan.add_argument('count', type=int, help="Number of shards")
+    plan.add_argument('--years', type=int, nargs='+', default=DEFAULT_YEARS)
+
+    merge = commands.add_parser('merge', help="Verify all shards and list the maps to retry")
+    merge.add_argument('count', type=int, help="Number of shards the export was split into")
+    merge.add_argument('--years', type=int, nargs='+', help="Years exported (default: as the shards recorded)")
+    merge.add_argument('--format', choices=['svg', 'png', 'webp'], help="Map format (default: as recorded)")
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        print_plan(args.count, args.years)
+    else:
+        raise SystemExit(1 if merge_shards(args.count, args.years, args.format) else 0)
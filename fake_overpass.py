@@ -0,0 +1,216 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Selectors such as way["natural"="water"] or relation["waterway"="river"]
+SELECTOR = re.compile(r'(way|relation)\["([^"]+)"="([^"]+)"\]')
+BBOX = re.compile(r'\((-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)')
+
+# Tags drawn as lines; everything else is an area
+LINE_TAGS = {('waterway', 'river'), ('waterway', 'stream'), ('waterway', 'canal'), ('natural', 'coastline')}
+
+class FakeOverpass:
+    """Deterministic synthetic Overpass responses for offline runs and benchmarks
+
+    Every element selector in a query yields `features` made-up features inside
+    the query bbox, in the same shape as `out body; >; out skel qt;`: tagged ways
+    and relations first, then bare nodes. Lines are split into several ways that
+    share end nodes and areas get closed rings, so responses exercise the same
+    assembly code as real data. The same query always gets the same answer.
+    """
+
+    def __init__(self, features=20, latency=0.0, slots=2):
+        self.features = features
+        self.latency = latency
+        self.slots = slots
+        self.active = 0
+        self.lock = threading.Lock()
+        self.stats = {'queries': 0, 'rate_limited': 0}
+
+    def respond(self, query):
+        """Overpass JSON for one query"""
+        match = BBOX.search(query)
+        south, west, north, east = (float(v) for v in match.groups()) if match else (0.0, 0.0, 1.0, 1.0)
+        rng = random.Random(hashlib.sha256(query.encode()).digest())
+
+        nodes = []
+        elements = []
+        next_id = [1]
+
+        def new_id():
+            next_id[0] += 1
+            return next_id[0]
+
+        def node(lon, lat):
+            node_id = new_id()
+            nodes.append({'type': 'node', 'id': node_id, 'lat': round(lat, 7), 'lon': round(lon, 7)})
+            return node_id
+
+        def random_point(margin=0.0):
+            return (rng.uniform(west + margin, east - margin), rng.uniform(south + margin, north - margin))
+
+        def ring(size):
+            """Node ids of a closed ring around a random center, and the center"""
+            cx, cy = random_point(size)
+            count = rng.randint(5, 12)
+            ids = []
+            for i in range(count):
+                angle = 2 * math.pi * i / count
+                radius = size * rng.uniform(0.6, 1.0)
+                ids.append(node(cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+            return ids + [ids[0]], (cx, cy)
+
+        def line_ways(tags, pieces):
+            """Ways of one line split into pieces that share their end nodes"""
+            x, y = random_point()
+            dx, dy = (east - west) / 40, (north - south) / 40
+            ids = [node(x, y)]
+            ways = []
+            for _ in range(pieces):
+                piece = [ids[-1]]
+                for _ in range(rng.randint(2, 6)):
+                    x, y = x + rng.uniform(-dx, dx), y + rng.uniform(-dy, dy)
+                    piece.append(node(x, y))
+                ids.append(piece[-1])
+                ways.append({'type': 'way', 'id': new_id(), 'nodes': piece, 'tags': tags})
+            return ways
+
+        size = min(east - west, north - south) / 50
+        for element_type, key, value in SELECTOR.findall(query):
+            for i in range(self.features):
+                name = f"{value.replace('_', ' ').title()} {i + 1}"
+                tags = {key: value, 'name': name}
+                is_line = (key, value) in LINE_TAGS
+                if element_type == 'way':
+                    if is_line:
+                        elements.extend(line_ways(tags, rng.randint(1, 3)))
+                    else:
+                        elements.append({'type': 'way', 'id': new_id(), 'nodes': ring(size)[0], 'tags': tags})
+                    continue
+
+                if is_line:
+                    members = line_ways({}, rng.randint(2, 4))
+                    relation_tags = dict(tags, type='waterway')
+                    roles = [''] * len(members)
+                else:
+                    # An outer ring split in two halves, plus one hole
+                    outer, (cx, cy) = ring(size * 2)
+                    half = len(outer) // 2
+                    members = [{'type': 'way', 'id': new_id(), 'nodes': outer[:half + 1], 'tags': {}},
+                               {'type': 'way', 'id': new_id(), 'nodes': outer[half:], 'tags': {}}]
+                    hole = [node(cx + size * 0.2 * math.cos(a), cy + size * 0.2 * math.sin(a))
+                            for a in (0, 2.1, 4.2)]
+                    members.append({'type': 'way', 'id': new_id(), 'nodes': hole + [hole[0]], 'tags': {}})
+                    relation_tags = dict(tags, type='multipolygon')
+                    roles = ['outer', 'outer', 'inner']
+                elements.append({'type': 'relation', 'id': new_id(), 'tags': relation_tags,
+                                 'members': [{'type': 'way', 'ref': way['id'], 'role': role}
+                                             for way, role in zip(members, roles)]})
+                # Member ways come back untagged, like `>; out skel`
+                elements.extend({'type': 'way', 'id': way['id'], 'nodes': way['nodes']} for way in members)
+
+        return {
+            'version': 0.6,
+            'generator': 'fake_overpass',
+            'osm3s': {'timestamp_osm_base': '2025-01-01T00:00:00Z'},
+            'elements': elements + nodes
+        }
+
+    def status_text(self):
+        """Plain-text body of /api/status in the real server's format"""
+        now = datetime.now(timezone.utc)
+        free = max(self.slots - self.active, 0)
+        lines = ['Connected as: 0', f"Current time: {now:%Y-%m-%dT%H:%M:%SZ}", f'Rate limit: {self.slots}']
+        if free:
+            lines.append(f'{free} slots available now.')
+        else:
+            wait = max(int(math.ceil(self.latency)), 1)
+            lines.append(f"Slot available after: {now + timedelta(seconds=wait):%Y-%m-%dT%H:%M:%SZ}, in {wait} seconds.")
+        lines.append('Currently running queries (pid, space limit, time limit, start time):')
+        return '\n'.join(lines) + '\n'
+
+def make_handler(fake):
+    """Request handler class bound to one FakeOverpass"""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so pooled clients reuse their connections
+        protocol_version = 'HTTP/1.1'
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/api/status'):
+                self.send_body(200, fake.status_text().encode(), 'text/plain')
+            else:
+                self.send_body(404, b'not found', 'text/plain')
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/api/interpreter'):
+                self.send_body(404, b'not found', 'text/plain')
+                return
+
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            query = parse_qs(body).get('data', [body])[0]
+
+            with fake.lock:
+                if fake.active >= fake.slots:
+                    fake.stats['rate_limited'] += 1
+                    limited = True
+                else:
+                    fake.active += 1
+                    fake.stats['queries'] += 1
+                    limited = False
+            if limited:
+                self.send_body(429, b'rate_limited', 'text/plain')
+                return
+
+            try:
+                time.sleep(fake.latency)
+                data = json.dumps(fake.respond(query)).encode()
+            finally:
+                with fake.lock:
+                    fake.active -= 1
+            self.send_body(200, data, 'application/json')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_fake_overpass(port=0, **options):
+    """Serve a FakeOverpass from a background thread; returns (server, fake, interpreter url)"""
+    fake = FakeOverpass(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f'http://127.0.0.1:{server.server_address[1]}/api/interpreter'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic Overpass API responses on localhost")
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--features', type=int, default=20, help="Features per element selector")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds each query takes")
+    parser.add_argument('--slots', type=int, default=2, help="Concurrent queries before answering 429")
+    args = parser.parse_args()
+
+    fake = FakeOverpass(args.features, args.latency, args.slots)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(fake))
+    print(f"Fake Overpass API at http://127.0.0.1:{args.port}/api/interpreter")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {fake.stats['queries']} queries, rate limited {fake.stats['rate_limited']}")
@@ -1,37 +1,212 @@
-import geopandas as gpd
 import json
 import os
+import re
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-def fix_geojson_crs():
+# The crs member GDAL writes for EPSG:4326 output
+CRS84_MEMBER = '"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" } },\n'
+
+# CRS names that already mean WGS84 longitude/latitude
+WGS84_NAMES = {
+    'urn:ogc:def:crs:OGC:1.3:CRS84',
+    'urn:ogc:def:crs:OGC::CRS84',
+    'urn:ogc:def:crs:EPSG::4326',
+    'EPSG:4326'
+}
+
+# Bytes read from the start of a file to find the top-level members before "features"
+HEAD_BYTES = 1 << 16
+# Bytes read from the end of a file to find members written after "features"
+TAIL_BYTES = 1 << 12
+
+WHITESPACE = re.compile(r'\s*')
+decoder = json.JSONDecoder()
+
+def parse_header(head):
+    """Top-level members before "features" and the offset where the "features" key starts
+
+    Raises ValueError when the head ends before "features" is reached.
+    """
+    members = {}
+    position = WHITESPACE.match(head, 0).end()
+    if head[position:position + 1] != '{':
+        raise ValueError("not a JSON object")
+    position += 1
+
+    while True:
+        position = WHITESPACE.match(head, position).end()
+        if head[position:position + 1] == '}':
+            return members, None
+        key_start = position
+        key, position = decoder.raw_decode(head, position)
+        position = WHITESPACE.match(head, position).end()
+        if head[position:position + 1] != ':':
+            raise ValueError(f"expected ':' after {key!r}")
+        if key == 'features':
+            return members, key_start
+        position = WHITESPACE.match(head, position + 1).end()
+        members[key], position = decoder.raw_decode(head, position)
+        position = WHITESPACE.match(head, position).end()
+        if head[position:position + 1] == ',':
+            position += 1
+
+def trailing_crs(f, size):
+    """The crs member written after the features array, if any"""
+    f.seek(max(size - TAIL_BYTES, 0))
+    tail = f.read().decode('utf-8', errors='ignore')
+    # Everything after the array's closing bracket is top-level members
+    tail = tail[tail.rfind(']') + 1:]
+    match = re.search(r'"crs"\s*:\s*', tail)
+    if not match:
+        return None
+    return decoder.raw_decode(tail, match.end())[0]
+
+def crs_name(crs):
+    """The name of a GeoJSON crs member, or None"""
+    if isinstance(crs, dict):
+        return (crs.get('properties') or {}).get('name')
+    return None
+
+def read_head(f, size):
+    """Header members and the byte offset of the "features" key, reading as little as possible"""
+    head_bytes = HEAD_BYTES
+    while True:
+        f.seek(0)
+        head = f.read(head_bytes)
+        text = head.decode('utf-8', errors='ignore')
+        try:
+            members, features_at = parse_header(text)
+            if features_at is not None:
+                features_at = len(text[:features_at].encode('utf-8'))
+            return members, features_at, head
+        except (ValueError, IndexError):
+            if head_bytes >= size:
+                raise
+            head_bytes *= 4
+
+def write_patched(filename, head, insert_at):
+    """Insert the CRS84 member before "features", streaming the rest of the file unchanged"""
+    directory = os.path.dirname(filename) or '.'
+    fd, temp_filename = tempfile.mkstemp(prefix='.crs-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out, open(filename, 'rb') as f:
+            # Repeat the indentation of the "features" key so the header stays aligned
+            indent = head[head.rfind(b'\n', 0, insert_at) + 1:insert_at]
+            out.write(head[:insert_at])
+            out.write(CRS84_MEMBER.encode('utf-8'))
+            out.write(indent if not indent.strip() else b'')
+            f.seek(insert_at)
+            shutil.copyfileobj(f, out, 1 << 20)
+            out.flush()
+            os.fsync(out.fileno())
+        shutil.copymode(filename, temp_filename)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+def fix_file_crs(filename, check_only=False):
+    """Check one file's crs member and add CRS84 if it is missing; returns (status, message)
+
+    Only the start of the file is parsed (and the end, when "features" comes
+    before any crs member); coordinates are never decoded.
+    """
+    try:
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            members, features_at, head = read_head(f, size)
+            crs = members['crs'] if 'crs' in members else trailing_crs(f, size)
+
+        if crs is not None:
+            name = crs_name(crs)
+            if name in WGS84_NAMES:
+                return 'ok', name
+            # Geometry in another CRS needs reprojecting, not a new label
+            return 'other', f"CRS is {name or crs}, left unchanged"
+
+        if features_at is None:
+            return 'error', "no features member"
+        if check_only:
+            return 'missing', "no crs member"
+        write_patched(filename, head, features_at)
+        return 'fixed', "added CRS84"
+    except Exception as e:
+        return 'error', str(e)
+
+def rewrite_file_crs(filename, check_only=False):
+    """Decode a whole file and write it back with EPSG:4326 if it had no crs member
+
+    The decision comes from the raw crs member, as in fix_file_crs: GDAL reads
+    GeoJSON without one as EPSG:4326, so the decoded CRS cannot tell.
+    """
+    try:
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            members = read_head(f, size)[0]
+            crs = members['crs'] if 'crs' in members else trailing_crs(f, size)
+
+        if crs is not None:
+            name = crs_name(crs)
+            if name in WGS84_NAMES:
+                return 'ok', name
+            return 'other', f"CRS is {name or crs}, left unchanged"
+        if check_only:
+            return 'missing', "no crs member"
+
+        # GeoPandas is only needed here; patching headers runs without it
+        from geo_io import read_geojson
+        gdf = read_geojson(filename)
+        gdf.set_crs('EPSG:4326', inplace=True, allow_override=True)
+        directory = os.path.dirname(filename) or '.'
+        fd, temp_filename = tempfile.mkstemp(prefix='.crs-', suffix='.geojson', dir=directory)
+        os.close(fd)
+        try:
+            gdf.to_file(temp_filename, driver='GeoJSON')
+            shutil.copymode(filename, temp_filename)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        return 'fixed', "set CRS to EPSG:4326"
+    except Exception as e:
+        return 'error', str(e)
+
+def fix_geojson_crs(files=None, workers=1, check_only=False, full=False):
     """Fix CRS of existing GeoJSON files"""
-    
+
     # Find all metro tract GeoJSON files
-    geojson_files = [f for f in os.listdir('.') if f.startswith('metro_tracts_') and f.endswith('.geojson')]
-    
-    print(f"Found {len(geojson_files)} GeoJSON files to fix")
-    
-    for filename in geojson_files:
-        print(f"Processing {filename}...")
-        
-        try:
-            # Load the GeoJSON
-            gdf = gpd.read_file(filename)
-            
-            # Set CRS to WGS84 if not already set
-            if gdf.crs is None:
-                gdf.set_crs('EPSG:4326', inplace=True)
-                print(f"  Set CRS to EPSG:4326 for {filename}")
-            else:
-                print(f"  CRS already set: {gdf.crs} for {filename}")
-            
-            # Save back to file
-            gdf.to_file(filename, driver='GeoJSON')
-            print(f"  Saved {filename}")
-            
-        except Exception as e:
-            print(f"  Error processing {filename}: {e}")
-    
-    print("CRS fix complete!")
+    if files is None:
+        files = sorted(f for f in os.listdir('.') if f.startswith('metro_tracts_') and f.endswith('.geojson'))
+
+    print(f"Found {len(files)} GeoJSON files to {'check' if check_only else 'fix'}")
+
+    fix_file = rewrite_file_crs if full else fix_file_crs
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda filename: fix_file(filename, check_only), files))
+
+    counts = {}
+    for filename, (status, message) in zip(files, results):
+        counts[status] = counts.get(status, 0) + 1
+        if status != 'ok':
+            print(f"  {filename}: {message}")
+
+    print("CRS " + ("check" if check_only else "fix") + " complete: "
+          + ", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+    return counts
 
 if __name__ == "__main__":
-    fix_geojson_crs() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Check and fix the CRS of GeoJSON files")
+    parser.add_argument('files', nargs='*', help="Files to process (default: metro_tracts_*.geojson)")
+    parser.add_argument('-j', '--workers', type=int, default=0,
+                        help="Files processed at once (default 0: one per CPU core)")
+    parser.add_argument('--check', action='store_true', help="Report files without a CRS, change nothing")
+    parser.add_argument('--full', action='store_true',
+                        help="Decode and rewrite whole files instead of patching the header")
+    args = parser.parse_args()
+    fix_geojson_crs(args.files or None, args.workers, args.check, args.full)
@@ -0,0 +1,61 @@
+import json
+import numpy as np
+
+# Tracts with fewer combined White + Black applications than this are not classified
+MIN_APPLICATIONS = 5
+
+# Upper bounds of the gap classes: a gap below GAP_BREAKS[0] is "no gap", a gap
+# below GAP_BREAKS[1] is "low", and so on; anything at or above the last break
+# (or a missing gap) is "very high"
+GAP_BREAKS = [0.0, 0.05, 0.10, 0.15]
+
+# Category code -> color and legend label. Code 0 is insufficient data,
+# codes 1-5 follow GAP_BREAKS in order
+GAP_CLASSES = [
+    {'key': 'insufficient', 'color': '#cccccc', 'label': 'Insufficient Data (<5 applications)'},
+    {'key': 'no_gap', 'color': '#4A90E2', 'label': 'No Gap/Positive'},
+    {'key': 'low', 'color': '#FFE5CC', 'label': 'Low Gap (<5%)'},
+    {'key': 'medium', 'color': '#FFB366', 'label': 'Medium Gap (5-10%)'},
+    {'key': 'high', 'color': '#FF8000', 'label': 'High Gap (10-15%)'},
+    {'key': 'very_high', 'color': '#CC6600', 'label': 'Very High Gap (>15%)'}
+]
+
+PALETTE = np.array([gap_class['color'] for gap_class in GAP_CLASSES])
+
+def classify_gaps(gap, white_total, black_total):
+    """Category codes (indexes into GAP_CLASSES) for whole columns of tracts"""
+    gap = np.asarray(gap, dtype=float)
+    totals = np.asarray(white_total, dtype=float) + np.asarray(black_total, dtype=float)
+
+    # digitize counts the breaks each gap is not below; NaN lands past the last break
+    codes = (np.digitize(gap, GAP_BREAKS) + 1).astype(np.int8)
+    codes[totals < MIN_APPLICATIONS] = 0
+
+    return codes
+
+def gap_colors(gap, white_total, black_total):
+    """Hex colors for whole columns of tracts"""
+    return PALETTE[classify_gaps(gap, white_total, black_total)]
+
+def legend_classes():
+    """Gap classes in legend order: highest gap first, insufficient data last"""
+    return list(reversed(GAP_CLASSES[1:])) + [GAP_CLASSES[0]]
+
+def gap_classes_config():
+    """Breakpoints, palette and legend order as a plain JSON-ready dict"""
+    return {
+        'min_applications': MIN_APPLICATIONS,
+        'breaks': GAP_BREAKS,
+        'classes': GAP_CLASSES,
+        'legend_order': [GAP_CLASSES.index(gap_class) for gap_class in legend_classes()]
+    }
+
+def write_gap_classes_json(filename='gap_classes.json'):
+    """Write the breakpoints and palette for index.html"""
+    with open(filename, 'w') as f:
+        json.dump(gap_classes_config(), f, indent=2)
+
+    print(f"Saved gap classes to {filename}")
+
+if __name__ == "__main__":
+    write_gap_classes_json()
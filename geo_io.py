@@ -0,0 +1,58 @@
+import json
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+import shapely
+
+# GDAL can hand whole columns over as Arrow buffers when pyarrow is installed,
+# which skips building a Python object per feature and per value
+try:
+    import pyarrow  # noqa: F401
+    USE_ARROW = True
+except ImportError:
+    USE_ARROW = False
+
+def read_features(filename, columns=None, bbox=None):
+    """Read a GeoJSON file one feature at a time with json and shapely
+
+    Slower than read_geojson, but accepts what GDAL rejects, such as polygon
+    rings that are not closed.
+    """
+    with open(filename, 'r') as f:
+        features = json.load(f)['features']
+
+    if not features:
+        gdf = gpd.GeoDataFrame(columns=(columns or []) + ['geometry'], geometry='geometry')
+    else:
+        gdf = gpd.GeoDataFrame.from_features(features)
+        if columns is not None:
+            gdf = gdf[[column for column in columns if column in gdf] + ['geometry']]
+
+    if bbox is not None and not gdf.empty:
+        gdf = gdf[gdf.intersects(shapely.box(*bbox))]
+    return gdf.set_crs('EPSG:4326', allow_override=True)
+
+def read_geojson(filename, columns=None, bbox=None):
+    """Read a GeoJSON file into a GeoDataFrame with vectorized geometry
+
+    columns limits which attribute columns are read and bbox (minx, miny, maxx,
+    maxy) keeps only the features that intersect it; both are applied inside
+    GDAL, before any Python objects are built.
+    """
+    try:
+        return pyogrio.read_dataframe(filename, columns=columns, bbox=bbox, use_arrow=USE_ARROW)
+    except shapely.errors.GEOSException:
+        return read_features(filename, columns, bbox)
+
+def read_properties(filename, columns=None):
+    """Read only the feature properties of a GeoJSON file into a DataFrame
+
+    Skipping geometry entirely, plain json is faster here than going through GDAL.
+    """
+    with open(filename, 'r') as f:
+        features = json.load(f)['features']
+
+    properties = pd.DataFrame([feature['properties'] for feature in features])
+    if columns is not None:
+        properties = properties[[column for column in columns if column in properties]]
+    return properties
@@ -0,0 +1,223 @@
+import os
+import glob
+import shutil
+import argparse
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from geo_io import read_geojson
+from metros import metro_areas, safe_metro_name
+from tract_store import (ATTRIBUTE_COLUMNS, find_legacy_files, has_geometry_store, legacy_filename, load_tract_year,
+                         tract_codes)
+
+DEFAULT_DATASET = 'parquet'
+
+# GeoJSON exports go here rather than over the source files in the data directory
+DEFAULT_EXPORT_DIR = 'export'
+
+# Rows per row group. Each group carries min/max statistics for the bbox
+# covering column, so a reader can skip groups that miss its query window
+ROW_GROUP_SIZE = 128
+
+# Hive partition keys of each dataset and their types
+PARTITIONS = {
+    'tracts': pa.schema([('cbsa_code', pa.string()), ('year', pa.int16())]),
+    'landmarks': pa.schema([('cbsa_code', pa.string())]),
+    'water_parks': pa.schema([('cbsa_code', pa.string())]),
+    # A few hundred rows in all; one partition per year is plenty
+    'metro_race_summary': pa.schema([('year', pa.int16())])
+}
+
+# Property order of the original per-year tract files
+TRACT_COLUMNS = ['year', 'tract_geoid', 'cbsa_code', 'metro_name', 'tract_name'] + ATTRIBUTE_COLUMNS
+
+def partition_directory(dataset, layer, **keys):
+    """Hive-style directory of one partition, e.g. tracts/cbsa_code=45300/year=2018"""
+    parts = [f'{name}={keys[name]}' for name in PARTITIONS[layer].names]
+    return os.path.join(dataset, layer, *parts)
+
+def write_geo_partition(gdf, directory):
+    """Write one GeoParquet partition, sorted so nearby features share row groups"""
+    os.makedirs(directory, exist_ok=True)
+    gdf = gdf.set_crs('EPSG:4326', allow_override=True)
+    # Hilbert order keeps each row group spatially compact, which keeps its bbox statistics tight
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()]
+    gdf.to_parquet(os.path.join(directory, 'part-0.parquet'), index=False,
+                   write_covering_bbox=True, row_group_size=ROW_GROUP_SIZE)
+
+def tract_years(code):
+    """Years a CBSA has tract data for"""
+    years = set(find_legacy_files().get(code, []))
+    if has_geometry_store(code):
+        years.update(int(f[:-len('.json')].rsplit('_', 1)[1]) for f in glob.glob(f'tract_attrs_{code}_*.json'))
+    return sorted(years)
+
+def load_source_tracts(code, year):
+    """One year of tracts at full precision: the original file if present, else the tract store
+
+    The topology is quantized, so it is only used when nothing better is on disk.
+    """
+    filename = legacy_filename(code, year)
+    if os.path.exists(filename):
+        return read_geojson(filename)
+    return load_tract_year(code, year)
+
+def context_files(prefix):
+    """(cbsa_code, metro_name, filename) for every context layer file with a known metro"""
+    names = {safe_metro_name(name): (code, name) for code, name in metro_areas.items()}
+    found = []
+    for filename in sorted(glob.glob(f'{prefix}_*.geojson')):
+        safe_name = filename[len(prefix) + 1:-len('.geojson')]
+        if safe_name not in names:
+            print(f"  Skipping {filename}: unknown metro")
+            continue
+        found.append(names[safe_name] + (filename,))
+    return found
+
+def convert_to_geoparquet(dataset=DEFAULT_DATASET):
+    """Convert the tract, landmark, water/park and summary files into partitioned GeoParquet"""
+    for layer in PARTITIONS:
+        shutil.rmtree(os.path.join(dataset, layer), ignore_errors=True)
+
+    count = 0
+    for code in tract_codes():
+        for year in tract_years(code):
+            gdf = load_source_tracts(code, year)
+            # Partition keys live in the directory names, not in the files
+            gdf = gdf[[column for column in TRACT_COLUMNS if column in gdf and column not in ('cbsa_code', 'year')]
+                      + ['geometry']]
+            write_geo_partition(gdf, partition_directory(dataset, 'tracts', cbsa_code=code, year=year))
+            count += 1
+    print(f"  tracts: {count} partitions")
+
+    for layer in ['landmarks', 'water_parks']:
+        count = 0
+        for code, metro_name, filename in context_files(layer):
+            gdf = read_geojson(filename)
+            if gdf.empty:
+                continue
+            gdf['metro_name'] = metro_name
+            write_geo_partition(gdf, partition_directory(dataset, layer, cbsa_code=code))
+            count += 1
+        print(f"  {layer}: {count} partitions")
+
+    summary = pd.read_csv('metro_race_summary.csv', dtype={'metro_code': str})
+    for year, rows in summary.groupby('year'):
+        directory = partition_directory(dataset, 'metro_race_summary', year=year)
+        os.makedirs(directory, exist_ok=True)
+        rows.drop(columns='year').to_parquet(os.path.join(directory, 'part-0.parquet'), index=False)
+    print(f"  metro_race_summary: {summary['year'].nunique()} partitions")
+
+    print(f"GeoParquet dataset written to {dataset}/")
+
+def dataset_filters(cbsa_code=None, year=None):
+    """Partition filters for pyarrow, or None"""
+    filters = []
+    if cbsa_code is not None:
+        filters.append(('cbsa_code', '=', str(cbsa_code)))
+    if year is not None:
+        filters.append(('year', '=', int(year)))
+    return filters or None
+
+def read_layer(layer, dataset=DEFAULT_DATASET, cbsa_code=None, year=None, columns=None, bbox=None):
+    """Read a GeoParquet layer, pruning partitions by CBSA/year and row groups by bbox
+
+    Leave cbsa_code or year unset to read across all metros or all years, e.g.
+    read_layer('tracts', year=2020) opens one year of every metro.
+    """
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    partitioning = ds.partitioning(PARTITIONS[layer], flavor='hive')
+    return gpd.read_parquet(os.path.join(dataset, layer), columns=columns, bbox=bbox,
+                            filters=dataset_filters(cbsa_code, year), partitioning=partitioning)
+
+def read_summary(dataset=DEFAULT_DATASET, year=None):
+    """Read the metro race summary, optionally for one year"""
+    partitioning = ds.partitioning(PARTITIONS['metro_race_summary'], flavor='hive')
+    return pd.read_parquet(os.path.join(dataset, 'metro_race_summary'),
+                           filters=dataset_filters(year=year), partitioning=partitioning)
+
+def partition_keys(dataset, layer):
+    """Key dicts of every partition present in a layer"""
+    keys = []
+    for path in sorted(glob.glob(os.path.join(dataset, layer, '**', '*.parquet'), recursive=True)):
+        parts = os.path.relpath(os.path.dirname(path), os.path.join(dataset, layer)).split(os.sep)
+        keys.append(dict(part.split('=', 1) for part in parts))
+    return keys
+
+def to_browser_geojson(gdf, filename, columns):
+    """Write a GeoJSON file with its properties in a fixed order"""
+    gdf = gdf[[column for column in columns if column in gdf] + ['geometry']]
+    gdf.to_file(filename, driver='GeoJSON', engine='pyogrio')
+
+def export_geojson(dataset=DEFAULT_DATASET, output_dir=DEFAULT_EXPORT_DIR):
+    """Write GeoJSON files for the browser back out of the GeoParquet dataset"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    keys = partition_keys(dataset, 'tracts')
+    for key in keys:
+        gdf = read_layer('tracts', dataset, cbsa_code=key['cbsa_code'], year=key['year'])
+        gdf = gdf.sort_values('tract_geoid', kind='stable')
+        gdf['cbsa_code'] = gdf['cbsa_code'].astype(str)
+        gdf['year'] = gdf['year'].astype(int)
+        filename = os.path.join(output_dir, f"metro_tracts_{key['cbsa_code']}_{key['year']}.geojson")
+        to_browser_geojson(gdf, filename, TRACT_COLUMNS)
+    print(f"  tracts: {len(keys)} files")
+
+    for layer in ['landmarks', 'water_parks']:
+        keys = partition_keys(dataset, layer)
+        for key in keys:
+            gdf = read_layer(layer, dataset, cbsa_code=key['cbsa_code'])
+            filename = os.path.join(output_dir, f"{layer}_{safe_metro_name(gdf['metro_name'].iloc[0])}.geojson")
+            to_browser_geojson(gdf, filename, [column for column in gdf.columns
+                                               if column not in ('geometry', 'bbox', 'cbsa_code', 'metro_name')])
+        print(f"  {layer}: {len(keys)} files")
+
+    print(f"GeoJSON written to {output_dir}/")
+
+def check_round_trip(dataset=DEFAULT_DATASET):
+    """Compare every tract partition with the GeoJSON files it was converted from"""
+    problems = 0
+    keys = partition_keys(dataset, 'tracts')
+    for key in keys:
+        code, year = key['cbsa_code'], int(key['year'])
+        original = load_source_tracts(code, year).sort_values('tract_geoid').reset_index(drop=True)
+        converted = read_layer('tracts', dataset, cbsa_code=code, year=year)
+        converted = converted.sort_values('tract_geoid').reset_index(drop=True)
+
+        if list(original['tract_geoid']) != list(converted['tract_geoid']):
+            print(f"  {code} {year}: tract ids differ")
+            problems += 1
+            continue
+        for column in ATTRIBUTE_COLUMNS:
+            if not original[column].equals(converted[column].astype(original[column].dtype)):
+                print(f"  {code} {year}: column {column} differs")
+                problems += 1
+        if not original.geometry.geom_equals_exact(converted.geometry, tolerance=0).all():
+            print(f"  {code} {year}: geometry differs")
+            problems += 1
+
+    print(f"Round trip checked {len(keys)} tract partitions: "
+          + ("OK" if not problems else f"{problems} problems"))
+    return problems == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the data files to and from partitioned GeoParquet")
+    parser.add_argument('command', choices=['convert', 'export', 'check'],
+                        help="convert GeoJSON/CSV to GeoParquet, export GeoParquet back to GeoJSON, "
+                             "or check a conversion against its source files")
+    parser.add_argument('--dataset', default=DEFAULT_DATASET, help="GeoParquet dataset directory")
+    parser.add_argument('--output-dir', default=DEFAULT_EXPORT_DIR, help="Where 'export' writes GeoJSON files")
+    parser.add_argument('--force', action='store_true',
+                        help="Let 'export' write into the data directory, overwriting the source GeoJSON")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert_to_geoparquet(args.dataset)
+    elif args.command == 'export':
+        if os.path.abspath(args.output_dir) == os.path.abspath('.') and not args.force:
+            parser.error("--output-dir is the data directory; pass --force to overwrite the source GeoJSON")
+        export_geojson(args.dataset, args.output_dir)
+    else:
+        check_round_trip(args.dataset)
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import shapely
+from card_atlas import ALBERS
+from gap_classes import PALETTE, classify_gaps
+from geoparquet_store import tract_years
+from metros import metro_areas, safe_metro_name
+from tract_store import load_tract_attributes, load_tract_geometry, tract_codes, write_json
+
+# Edge length in meters (Albers equal-area) of the hexagons at each resolution.
+# Every level halves the edge; a cell's parent is the coarser cell holding its center
+RESOLUTIONS = [16000, 8000, 4000, 2000]
+
+# Counts are apportioned fractionally; this many decimals are kept in the layers
+COUNT_DECIMALS = 2
+
+SQRT3 = np.sqrt(3)
+
+def hex_filename(code, resolution):
+    return f'hex_{code}_r{resolution}.json'
+
+def hex_centers(q, r, size):
+    """Albers x, y of the centers of pointy-top hexagons at axial coordinates q, r"""
+    return size * SQRT3 * (q + r / 2), size * 1.5 * r
+
+def hex_cells(x, y, size):
+    """Axial (q, r) of the hexagons holding each point, by cube rounding"""
+    fq = (SQRT3 / 3 * x - y / 3) / size
+    fr = (2 / 3 * y) / size
+    fs = -fq - fr
+    q, r, s = np.round(fq), np.round(fr), np.round(fs)
+    dq, dr, ds = np.abs(q - fq), np.abs(r - fr), np.abs(s - fs)
+    q = np.where((dq > dr) & (dq > ds), -r - s, q)
+    r = np.where(~((dq > dr) & (dq > ds)) & (dr > ds), -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+def hex_polygons(q, r, size):
+    """Shapely hexagons of the cells, in Albers meters"""
+    x, y = hex_centers(np.asarray(q), np.asarray(r), size)
+    angles = np.radians(np.arange(7) * 60 + 30)
+    ring = np.stack([x[:, None] + size * np.cos(angles), y[:, None] + size * np.sin(angles)], axis=-1)
+    return shapely.polygons(ring)
+
+def covering_cells(bounds, size):
+    """Axial coordinates of every cell that can touch the bounds"""
+    minx, miny, maxx, maxy = bounds
+    rows = np.arange(np.floor(miny / (1.5 * size)) - 1, np.ceil(maxy / (1.5 * size)) + 2)
+    q, r = [], []
+    for row in rows:
+        first = np.floor((minx / (SQRT3 * size)) - row / 2) - 1
+        last = np.ceil((maxx / (SQRT3 * size)) - row / 2) + 1
+        columns = np.arange(first, last + 1)
+        q.append(columns)
+        r.append(np.full(len(columns), row))
+    return np.concatenate(q).astype(np.int64), np.concatenate(r).astype(np.int64)
+
+def apportion_weights(geometries, size):
+    """Area-weighted tract-to-cell shares at one resolution
+
+    Returns (q, r) of the cells that overlap any tract and, as three parallel
+    arrays, the tract index, cell index and share of the tract's area that
+    falls into the cell; each tract's shares add up to 1.
+    """
+    q, r = covering_cells(shapely.total_bounds(geometries), size)
+    cells = hex_polygons(q, r, size)
+    tract_index, cell_index = shapely.STRtree(geometries).query(cells, predicate='intersects')[::-1]
+    areas = shapely.area(shapely.intersection(geometries[tract_index], cells[cell_index]))
+    tract_areas = shapely.area(geometries)
+    keep = areas > 0
+    tract_index, cell_index, areas = tract_index[keep], cell_index[keep], areas[keep]
+
+    used, cell_index = np.unique(cell_index, return_inverse=True)
+    return q[used], r[used], (tract_index, cell_index, areas / tract_areas[tract_index])
+
+def add_parent_cells(q, r, size, parent_q, parent_r):
+    """The coarser cells plus any parent of the cells that is not among them yet
+
+    A cell's center can fall in a coarser cell that overlaps no tract, since
+    hexagons do not nest exactly; appending those parents (with zero counts)
+    lets every cell roll up.
+    """
+    pq, pr = hex_cells(*hex_centers(q, r, size), size * 2)
+    known = set(zip(parent_q.tolist(), parent_r.tolist()))
+    missing = sorted(set(zip(pq.tolist(), pr.tolist())) - known)
+    if not missing:
+        return parent_q, parent_r
+    missing_q, missing_r = np.array(missing, dtype=np.int64).T
+    return np.r_[parent_q, missing_q], np.r_[parent_r, missing_r]
+
+def parent_cells(q, r, size, parent_q, parent_r):
+    """Index of each cell's parent among the coarser cells, which must include every parent"""
+    pq, pr = hex_cells(*hex_centers(q, r, size), size * 2)
+    lookup = {cell: i for i, cell in enumerate(zip(parent_q.tolist(), parent_r.tolist()))}
+    return np.array([lookup[cell] for cell in zip(pq.tolist(), pr.tolist())], dtype=np.int64)
+
+def tract_counts(attributes, geoids):
+    """Applications and approvals of each race per tract, in the geometry's tract order"""
+    attributes = attributes.drop_duplicates('tract_geoid').set_index('tract_geoid').reindex(geoids)
+    counts = {}
+    for race in ('white', 'black'):
+        total = attributes[f'{race}_total'].fillna(0).to_numpy(dtype=float)
+        rate = attributes[f'{race}_rate'].fillna(0).to_numpy(dtype=float)
+        counts[f'{race}_total'] = total
+        counts[f'{race}_approvals'] = total * rate
+    return counts
+
+def aggregate(counts, weights, cell_count):
+    """Cell totals, rates, gap and gap class from tract counts and apportioning weights"""
+    tract_index, cell_index, share = weights
+    cells = {name: np.bincount(cell_index, weights=values[tract_index] * share, minlength=cell_count)
+             for name, values in counts.items()}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        white_rate = cells['white_approvals'] / cells['white_total']
+        black_rate = cells['black_approvals'] / cells['black_total']
+    gap = white_rate - black_rate
+    return {
+        'white_total': np.round(cells['white_total'], COUNT_DECIMALS),
+        'black_total': np.round(cells['black_total'], COUNT_DECIMALS),
+        'white_approvals': np.round(cells['white_approvals'], COUNT_DECIMALS),
+        'black_approvals': np.round(cells['black_approvals'], COUNT_DECIMALS),
+        'gap': np.round(gap, 4),
+        'class': classify_gaps(gap, cells['white_total'], cells['black_total'])
+    }
+
+def column(values):
+    """JSON list of a column, with None for missing values"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    return values.tolist()
+
+def build_hex_layers(code, years=None, resolutions=RESOLUTIONS):
+    """Write one hexagon layer per resolution for a CBSA, with every year's cell counts
+
+    The tract-to-cell weights depend on geometry alone, so they are computed
+    once per resolution and applied to each year's counts. Cells add up
+    applications across tracts before classifying, so a cell of several thin
+    tracts gets a gap where each tract alone would be insufficient data.
+    Every cell below the coarsest level has a parent; parents that overlap no
+    tract are kept with zero counts.
+    """
+    years = years or tract_years(code)
+    geometry = load_tract_geometry(code, years[0], columns=['tract_geoid'])
+    geometry = geometry[~(geometry.geometry.isna() | geometry.geometry.is_empty)]
+    geometries = geometry.to_crs(ALBERS).geometry.values
+    geoids = geometry['tract_geoid'].to_numpy()
+    counts = {year: tract_counts(load_tract_attributes(code, year), geoids) for year in years}
+
+    start = time.perf_counter()
+    levels = [list(apportion_weights(geometries, size)) for size in resolutions]
+    # Finest first, so parents added to a level get parents of their own
+    for resolution in range(len(resolutions) - 1, 0, -1):
+        q, r, _ = levels[resolution]
+        coarser = levels[resolution - 1]
+        coarser[0], coarser[1] = add_parent_cells(q, r, resolutions[resolution], coarser[0], coarser[1])
+    print(f"  {code}: apportioned {len(geoids)} tracts at {len(resolutions)} resolutions, "
+          f"{time.perf_counter() - start:.2f}s")
+
+    for resolution, size in enumerate(resolutions):
+        q, r, weights = levels[resolution]
+        cells = {'q': q.tolist(), 'r': r.tolist()}
+        if resolution > 0:
+            cells['parent'] = parent_cells(q, r, size, *levels[resolution - 1][:2]).tolist()
+        layer = {
+            'cbsa_code': code,
+            'resolution': resolution,
+            'size': size,
+            'projection': ALBERS,
+            'cells': cells,
+            'years': {str(year): {name: column(values) for name, values in aggregate(counts[year], weights, len(q)).items()}
+                      for year in years}
+        }
+        write_json(hex_filename(code, resolution), layer)
+        print(f"  {code} r{resolution} ({size / 1000:g} km): {len(q)} cells")
+
+def load_hex_layer(code, resolution):
+    with open(hex_filename(code, resolution), 'r') as f:
+        return json.load(f)
+
+def draw_hex_layer(ax, layer, year):
+    """Draw one year of a hexagon layer, colored by gap class, in Albers meters"""
+    from map_output import draw_tract_fills
+    values = layer['years'][str(year)]
+    polygons = hex_polygons(layer['cells']['q'], layer['cells']['r'], layer['size'])
+    return draw_tract_fills(ax, polygons, list(PALETTE[np.asarray(values['class'])]))
+
+def render_overview(code, metro_name, year, resolution, image_format='png'):
+    """Save a hexagon overview map of one metro and year; returns the filename"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from export_metro_maps import add_legend, map_title
+    from map_output import save_map
+
+    layer = load_hex_layer(code, resolution)
+    fig, ax = plt.subplots(1, 1, figsize=(12, 8))
+    try:
+        draw_hex_layer(ax, layer, year)
+        ax.set_axis_off()
+        fig.suptitle(map_title(metro_name, year), fontsize=16, fontweight='bold', y=0.95)
+        add_legend(ax)
+        filename = f'metro-areas/hex/{year}_{safe_metro_name(metro_name)}_r{resolution}.{image_format}'
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        save_map(fig, filename, image_format)
+    finally:
+        plt.close(fig)
+    return filename
+
+def build_all(codes=None, resolutions=RESOLUTIONS):
+    codes = codes or [code for code in tract_codes() if code in metro_areas]
+    print(f"Building hexagon layers for {len(codes)} metros at {len(resolutions)} resolutions")
+    for code in codes:
+        build_hex_layers(code, resolutions=resolutions)
+
+def render_all(year, resolution, codes=None, image_format='png'):
+    codes = codes or [code for code in tract_codes() if code in metro_areas]
+    for code in codes:
+        if not os.path.exists(hex_filename(code, resolution)):
+            print(f"  No {hex_filename(code, resolution)}; run build first")
+            continue
+        start = time.perf_counter()
+        filename = render_overview(code, metro_areas[code], year, resolution, image_format)
+        print(f"Saved: {filename} ({time.perf_counter() - start:.2f}s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate tract counts onto hexagon grids for overview maps")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Write hex_<cbsa>_r<resolution>.json layers")
+    build.add_argument('--codes', nargs='+', help="CBSA codes (default: every metro with tract data)")
+
+    render = commands.add_parser('render', help="Draw overview maps from the layers into metro-areas/hex/")
+    render.add_argument('--year', type=int, default=2023)
+    render.add_argument('--resolution', type=int, default=1, choices=range(len(RESOLUTIONS)))
+    render.add_argument('--codes', nargs='+')
+    render.add_argument('--format', choices=['svg', 'png', 'webp'], default='png')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_all(args.codes)
+    else:
+        render_all(args.year, args.resolution, args.codes, args.format)
@@ -0,0 +1,222 @@
+import os
+import argparse
+import pandas as pd
+from geo_io import read_geojson
+from geoparquet_store import TRACT_COLUMNS, to_browser_geojson
+from metros import metro_areas
+from tract_store import (ATTRIBUTE_COLUMNS, attributes_filename, find_legacy_files, geometry_filename,
+                         has_geometry_store, legacy_filename, load_tract_geometry, tract_codes, write_json)
+
+SUMMARY_FILE = 'metro_race_summary.csv'
+
+# LAR columns the counts need; nothing else is parsed
+LAR_COLUMNS = ['activity_year', 'census_tract', 'county_code', 'derived_msa-md', 'derived_race', 'action_taken']
+
+# derived_race values that are counted, and their column prefixes in the tract files
+RACES = {'White': 'white', 'Black or African American': 'black'}
+
+# action_taken codes: 1 originated, 2 approved but not accepted, 3 denied. Withdrawn,
+# incomplete, purchased and preapproval-only records never got a decision and are left out
+APPLICATION_ACTIONS = ['1', '2', '3']
+APPROVAL_ACTIONS = ['1', '2']
+
+# Tracts are kept only where both races have at least this many applications
+MIN_APPLICATIONS = 5
+
+# Rows per chunk; memory is bounded by this and the number of distinct tracts, not the input size
+CHUNK_ROWS = 250_000
+
+GROUP_KEYS = ['year', 'cbsa_code', 'tract_geoid', 'race']
+
+def county_metros(crosswalk=None):
+    """{county FIPS: CBSA code} from the counties of each metro's tract geometry
+
+    crosswalk is an optional CSV with county_code and cbsa_code columns for
+    metros without tract geometry. derived_msa-md alone is not enough for
+    metros split into divisions (New York, Chicago, ...), where it holds the
+    division code instead of the CBSA code.
+    """
+    counties = {}
+    for code in tract_codes():
+        if code not in metro_areas:
+            continue
+        geoids = load_tract_geometry(code, find_legacy_files().get(code, [None])[0],
+                                     columns=['tract_geoid'])['tract_geoid']
+        counties.update(dict.fromkeys(geoids.str[:5].unique(), code))
+    if crosswalk:
+        table = pd.read_csv(crosswalk, dtype=str, usecols=['county_code', 'cbsa_code'])
+        table = table[table['cbsa_code'].isin(metro_areas)]
+        counties.update(zip(table['county_code'].str.zfill(5), table['cbsa_code']))
+    return counties
+
+def count_chunk(chunk, counties, filters):
+    """Applications and approvals per (year, CBSA, tract, race) in one chunk of LAR rows"""
+    race = chunk['derived_race'].map(RACES)
+    keep = race.notna() & chunk['action_taken'].isin(APPLICATION_ACTIONS)
+    for column, values in filters.items():
+        keep &= chunk[column].isin(values)
+    chunk, race = chunk[keep], race[keep]
+
+    tract = chunk['census_tract'].where(chunk['census_tract'].str.len() == 11, '')
+    county = chunk['county_code'].where(chunk['county_code'].str.len() == 5, tract.str[:5])
+    msa = chunk['derived_msa-md']
+    cbsa = county.map(counties).fillna(msa.where(msa.isin(metro_areas)))
+
+    counts = pd.DataFrame({
+        'year': chunk['activity_year'],
+        'cbsa_code': cbsa,
+        'tract_geoid': tract,
+        'race': race,
+        'applications': 1,
+        'approvals': chunk['action_taken'].isin(APPROVAL_ACTIONS).astype(int)
+    })
+    return counts[cbsa.notna()].groupby(GROUP_KEYS, sort=False).sum()
+
+def count_applications(filenames, counties, chunk_rows=CHUNK_ROWS, sep=',', filters=None):
+    """Stream LAR files chunk by chunk into one table of counts per (year, CBSA, tract, race)
+
+    Each chunk is reduced with a groupby and added to the running totals, so
+    only one chunk of raw rows is ever in memory.
+    """
+    filters = filters or {}
+    totals = None
+    rows = 0
+    for filename in filenames:
+        reader = pd.read_csv(filename, sep=sep, usecols=LAR_COLUMNS + list(filters), dtype=str,
+                             na_filter=False, chunksize=chunk_rows)
+        for chunk in reader:
+            counts = count_chunk(chunk, counties, filters)
+            totals = counts if totals is None else totals.add(counts, fill_value=0)
+            rows += len(chunk)
+        print(f"  {filename}: {rows:,} rows read, {0 if totals is None else len(totals):,} groups so far")
+
+    if totals is None:
+        return pd.DataFrame(columns=GROUP_KEYS + ['applications', 'approvals'])
+    totals = totals.astype('int64').reset_index()
+    totals['year'] = totals['year'].astype(int)
+    return totals
+
+def race_summary(counts):
+    """Applications, approvals and approval rate per metro, race and year, as in metro_race_summary.csv"""
+    summary = counts.groupby(['year', 'cbsa_code', 'race'], as_index=False)[['applications', 'approvals']].sum()
+    labels = {prefix: label for label, prefix in RACES.items()}
+    summary = pd.DataFrame({
+        'metro_code': summary['cbsa_code'].astype(int),
+        'race': summary['race'].map(labels),
+        'total_applications': summary['applications'],
+        'approvals': summary['approvals'],
+        'approval_rate': summary['approvals'] / summary['applications'],
+        'year': summary['year'],
+        'metro_name': summary['cbsa_code'].map(metro_areas)
+    })
+    return summary.sort_values(['year', 'metro_code', 'race'], ignore_index=True)
+
+def tract_rates(counts, min_applications=MIN_APPLICATIONS):
+    """Per-tract approval rates of each race and their gap, one row per CBSA, year and tract"""
+    counts = counts[counts['tract_geoid'] != '']
+    wide = counts.set_index(['cbsa_code', 'year', 'tract_geoid', 'race'])[['applications', 'approvals']] \
+        .unstack('race', fill_value=0)
+    rates = pd.DataFrame(index=wide.index)
+    for prefix in RACES.values():
+        applications = wide['applications'].get(prefix, pd.Series(0, index=wide.index))
+        approvals = wide['approvals'].get(prefix, pd.Series(0, index=wide.index))
+        rates[f'{prefix}_rate'] = approvals / applications.where(applications > 0)
+        rates[f'{prefix}_total'] = applications
+    rates['gap'] = rates['white_rate'] - rates['black_rate']
+
+    enough = (rates['white_total'] >= min_applications) & (rates['black_total'] >= min_applications)
+    return rates[enough].reset_index()
+
+def source_geometry(code, years):
+    """A metro's tract geometry at full precision; the quantized topology is the last resort"""
+    for filename in [geometry_filename(code)] + [legacy_filename(code, year) for year in years]:
+        if os.path.exists(filename):
+            tracts = read_geojson(filename, columns=['tract_geoid', 'tract_name'])
+            tracts['tract_geoid'] = tracts['tract_geoid'].astype(str)
+            return tracts
+    return load_tract_geometry(code, columns=['tract_geoid', 'tract_name'])
+
+def write_tract_files(rates):
+    """Join each metro's rates to its tract geometry and write every year's tract files
+
+    Writes the per-year metro_tracts files and, for metros in the geometry
+    store, the matching attribute tables, so both layouts stay in step.
+    Returns the CBSA codes that were skipped for lack of tract geometry.
+    """
+    available = set(tract_codes())
+    legacy = find_legacy_files()
+    skipped = []
+    for code, metro_rates in rates.groupby('cbsa_code'):
+        if code not in available:
+            skipped.append(code)
+            continue
+        geometry = source_geometry(code, legacy.get(code, []))
+        geometry = geometry[['tract_geoid', 'tract_name', 'geometry']].drop_duplicates('tract_geoid')
+
+        for year, year_rates in metro_rates.groupby('year'):
+            # Inner join: tracts outside the stored geometry (e.g. newer tract
+            # vintages) are dropped, in the geometry file's order
+            gdf = geometry.merge(year_rates.drop(columns='cbsa_code'), on='tract_geoid', how='inner')
+            gdf['cbsa_code'] = code
+            gdf['metro_name'] = metro_areas[code]
+            gdf['year'] = int(year)
+            to_browser_geojson(gdf, legacy_filename(code, year), TRACT_COLUMNS)
+
+            if has_geometry_store(code):
+                columns = {'tract_geoid': gdf['tract_geoid'].tolist()}
+                for column in ATTRIBUTE_COLUMNS:
+                    values = gdf[column].astype(object)
+                    columns[column] = values.where(gdf[column].notna(), None).tolist()
+                write_json(attributes_filename(code, year), {'cbsa_code': code, 'year': int(year), 'columns': columns})
+
+            print(f"  {code} {year}: {len(gdf)} of {len(year_rates)} tracts matched geometry")
+    return skipped
+
+def write_summary(summary, filename=SUMMARY_FILE):
+    """Write the summary CSV, keeping rows of years that were not ingested this time"""
+    if os.path.exists(filename):
+        previous = pd.read_csv(filename)
+        previous = previous[~previous['year'].isin(summary['year'].unique())]
+        summary = pd.concat([previous, summary], ignore_index=True) \
+            .sort_values(['year', 'metro_code', 'race'], ignore_index=True)
+    summary.to_csv(filename, index=False)
+    print(f"Saved {filename} ({len(summary)} rows)")
+
+def ingest(filenames, crosswalk=None, chunk_rows=CHUNK_ROWS, sep=',', filters=None,
+           min_applications=MIN_APPLICATIONS, summary_file=SUMMARY_FILE):
+    """Build the tract files and the metro race summary from raw LAR files in one pass"""
+    counties = county_metros(crosswalk)
+    print(f"Counting applications in {len(filenames)} LAR files ({len(counties)} counties mapped to metros)")
+    counts = count_applications(filenames, counties, chunk_rows, sep, filters)
+    if counts.empty:
+        print("No White or Black applications in the 27 metros were found")
+        return
+
+    print(f"Writing tract files for {counts['year'].nunique()} years")
+    skipped = write_tract_files(tract_rates(counts, min_applications))
+    if skipped:
+        print(f"  No tract geometry for {len(skipped)} metros; they are in the summary only: {', '.join(skipped)}")
+    write_summary(race_summary(counts), summary_file)
+
+def parse_filters(items):
+    """{column: [values]} from 'column=value[,value...]' arguments"""
+    filters = {}
+    for item in items or []:
+        column, _, values = item.partition('=')
+        filters[column] = values.split(',')
+    return filters
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build tract approval files and the metro race summary from HMDA LAR files")
+    parser.add_argument('files', nargs='+', help="LAR CSV files, any years (.gz/.zip are read as is)")
+    parser.add_argument('--counties', help="CSV of county_code,cbsa_code for metros without tract geometry")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="LAR rows read at a time")
+    parser.add_argument('--sep', default=',', help="Field separator ('|' for pipe-delimited LAR files)")
+    parser.add_argument('--where', action='append', metavar='COLUMN=VALUES',
+                        help="Only count rows whose column has one of the values, e.g. loan_purpose=1 (repeatable)")
+    parser.add_argument('--min-applications', type=int, default=MIN_APPLICATIONS,
+                        help="Applications each race needs for a tract to be kept")
+    parser.add_argument('--summary', default=SUMMARY_FILE, help="Summary CSV to write")
+    args = parser.parse_args()
+    ingest(args.files, args.counties, args.chunk_rows, args.sep, parse_filters(args.where),
+           args.min_applications, args.summary)
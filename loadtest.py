@@ -0,0 +1,129 @@
+import time
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from metros import metro_areas, safe_metro_name
+
+# Browsers open at most six HTTP/1.1 connections per host
+CONNECTIONS_PER_CLIENT = 6
+
+class PageLoad:
+    """One simulated browser loading index.html and the data behind all 27 cards
+
+    Requests follow the page's own path: one sprite image when the card atlas
+    covers the year, otherwise every card's files with the page's fallbacks
+    (screen buffer, then topology, then plain tract geometry; attribute
+    table, then the legacy per-year file). ETags of an earlier load are reused, as the browser
+    cache would.
+    """
+
+    def __init__(self, base_url, year, accept_encoding, live=False):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.year = year
+        self.live = live
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = accept_encoding
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTIONS_PER_CLIENT)
+        self.session.mount('http://', adapter)
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Fetch one file; returns the response when it exists, else None"""
+        headers = {}
+        cached = self.cache.get(path)
+        if cached:
+            headers['If-None-Match'] = cached
+        response = self.session.get(self.base_url + path, headers=headers)
+        wire_bytes = int(response.headers.get('Content-Length', len(response.content)))
+        with self.lock:
+            self.requests += 1
+            self.bytes += wire_bytes
+            if response.status_code == 304:
+                self.not_modified += 1
+        if response.status_code == 200 and 'ETag' in response.headers:
+            self.cache[path] = response.headers['ETag']
+        return response if response.status_code in (200, 304) else None
+
+    def load_card(self, code, metro_name):
+        """The requests index.html makes to draw one metro's card"""
+        screen = self.get(f'data/screen_{code}.bin')
+        table = self.get(f'data/tract_attrs_{code}_{self.year}.json')
+        if not (screen and table):
+            if not self.get(f'data/tracts_{code}.topo.json'):
+                self.get(f'data/tracts_{code}.geojson')
+            if not table:
+                self.get(f'data/metro_tracts_{code}_{self.year}.geojson')
+        self.get(f'data/landmarks_{safe_metro_name(metro_name)}.geojson')
+        self.get(f'data/water_parks_{safe_metro_name(metro_name)}.geojson')
+
+    def run(self):
+        """Seconds to load the page and every card"""
+        self.requests = self.bytes = self.not_modified = 0
+        start = time.perf_counter()
+        self.get('index.html')
+        self.get('data/gap_classes.json')
+        atlas = self.get('data/atlas/cards.json')
+        if atlas is not None and not self.live:
+            if atlas.status_code == 304:
+                atlas = self.atlas
+            else:
+                self.atlas = atlas = atlas.json()
+            sheet = atlas['years'].get(str(self.year))
+            if sheet:
+                self.get(f"data/atlas/{sheet['image']}")
+                return time.perf_counter() - start
+        with ThreadPoolExecutor(CONNECTIONS_PER_CLIENT) as pool:
+            list(pool.map(lambda item: self.load_card(*item), metro_areas.items()))
+        return time.perf_counter() - start
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)]
+
+def load_test(base_url, clients=20, rounds=1, year=2018, accept_encoding='gzip, br', live=False):
+    """Load the page from many simulated browsers at once and report timings
+
+    Every client loads the page `rounds` times; loads after the first
+    revalidate by ETag, like a reload with a warm cache.
+    """
+    loads = [PageLoad(base_url, year, accept_encoding, live) for _ in range(clients)]
+    results = {round_number: [] for round_number in range(rounds)}
+
+    def client(load):
+        for round_number in range(rounds):
+            seconds = load.run()
+            results[round_number].append((seconds, load.requests, load.bytes, load.not_modified))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, loads))
+    elapsed = time.perf_counter() - start
+
+    print(f"{clients} clients x {rounds} page loads against {base_url} ({elapsed:.2f}s total)")
+    total_requests = 0
+    for round_number, rows in results.items():
+        times = [row[0] for row in rows]
+        requests_made = sum(row[1] for row in rows)
+        total_requests += requests_made
+        label = 'cold' if round_number == 0 else f'reload {round_number}'
+        print(f"  {label:>9}: p50 {statistics.median(times):.3f}s  p95 {percentile(times, 95):.3f}s  "
+              f"max {max(times):.3f}s  {sum(row[2] for row in rows) / clients / 1e6:.2f} MB/page  "
+              f"{requests_made // clients} requests/page, {sum(row[3] for row in rows)} not modified")
+    print(f"  throughput: {total_requests / elapsed:.0f} requests/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long all 27 metro cards take to load under concurrency")
+    parser.add_argument('--url', default='http://127.0.0.1:8000/', help="Server root serving index.html and data/")
+    parser.add_argument('--clients', type=int, default=20, help="Simulated browsers loading at the same time")
+    parser.add_argument('--rounds', type=int, default=2, help="Page loads per client; later ones revalidate")
+    parser.add_argument('--year', type=int, default=2018)
+    parser.add_argument('--accept-encoding', default='gzip, br',
+                        help="Accept-Encoding to send ('identity' to disable compression)")
+    parser.add_argument('--live', action='store_true',
+                        help="Load every card's vector data, as the page does without a card atlas")
+    args = parser.parse_args()
+    load_test(args.url, args.clients, args.rounds, args.year, args.accept_encoding, args.live)
@@ -0,0 +1,131 @@
+import io
+import re
+import math
+import numpy as np
+import shapely
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+
+# Resolution the vector maps are meant to be viewed at; coordinates are
+# simplified and rounded to what this resolution can show
+SVG_DPI = 300
+# Resolution of raster thumbnails
+RASTER_DPI = 60
+RASTER_FORMATS = ('png', 'webp')
+WEBP_QUALITY = 85
+
+# Vertices closer than this to the simplified outline are dropped
+SIMPLIFY_PIXELS = 0.5
+
+# Declarations equal to the SVG defaults, which matplotlib still writes out
+DEFAULT_DECLARATIONS = {'stroke-linejoin:miter', 'stroke-linecap:butt', 'opacity:1', 'fill-opacity:1',
+                        'stroke-opacity:1'}
+STYLE = re.compile(r' style="([^"]*)"')
+PATH_DATA = re.compile(r' d="([^"]*)"')
+NUMBER = re.compile(r'-?\d+\.\d+')
+
+def output_dpi(image_format):
+    """Resolution a map is simplified for: the raster's own, or the viewing resolution of an SVG"""
+    return RASTER_DPI if image_format in RASTER_FORMATS else SVG_DPI
+
+def pixel_size(ax, bounds, dpi):
+    """Data units per output pixel once the axes shows bounds at equal aspect"""
+    fig = ax.figure
+    box = ax.get_position()
+    width = box.width * fig.get_figwidth() * dpi
+    height = box.height * fig.get_figheight() * dpi
+    minx, miny, maxx, maxy = bounds
+    return max((maxx - minx) / width, (maxy - miny) / height)
+
+def coordinate_decimals(dpi):
+    """Decimals of an SVG coordinate (in points) that still resolve half a pixel at dpi"""
+    return max(0, math.ceil(-math.log10(72 / dpi / 2)))
+
+def simplify_tracts(geometries, tolerance):
+    """Simplify tract polygons as a coverage, so neighbors keep sharing their borders
+
+    Simplifying each tract on its own would open slivers between neighbors;
+    the coverage version moves every shared edge once. Falls back to plain
+    topology-preserving simplification where shapely or GEOS is too old.
+    """
+    if tolerance <= 0:
+        return geometries
+    if hasattr(shapely, 'coverage_simplify'):
+        try:
+            return shapely.coverage_simplify(geometries, tolerance)
+        except shapely.errors.GEOSException:
+            pass
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+def color_paths(geometries, colors):
+    """(colors, compound Paths) with one path holding every ring of each distinct color
+
+    Exteriors and holes are wound in opposite directions, so the nonzero fill
+    leaves the holes empty.
+    """
+    polygons = shapely.orient_polygons(geometries)
+    parts, tract_of_part = shapely.get_parts(polygons, return_index=True)
+    rings, part_of_ring = shapely.get_rings(parts, return_index=True)
+    coords, ring_of_point = shapely.get_coordinates(rings, return_index=True)
+
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    starts = np.r_[True, ring_of_point[1:] != ring_of_point[:-1]][:len(coords)]
+    codes[starts] = Path.MOVETO
+    codes[np.r_[starts[1:], True][:len(coords)]] = Path.CLOSEPOLY
+
+    point_colors = np.asarray(colors, dtype=object)[tract_of_part[part_of_ring]][ring_of_point]
+    unique = list(dict.fromkeys(point_colors))
+    return unique, [Path(coords[point_colors == color], codes[point_colors == color]) for color in unique]
+
+def draw_tract_fills(ax, geometries, colors, zorder=0.9):
+    """Draw tracts as one filled, white-edged path per color and return the collection
+
+    Every tract keeps its own outline, so the map looks the same as one patch
+    per tract, but the SVG gets a handful of elements instead of thousands.
+    The zorder keeps it under context layers drawn earlier when it is redrawn.
+    """
+    unique, paths = color_paths(geometries, colors)
+    collection = PathCollection(paths, facecolors=unique, edgecolors='white', linewidths=0.5, zorder=zorder)
+    # Tracts set the axes limits, so clipping them to the axes only adds a clip-path to the SVG
+    collection.set_clip_on(False)
+    ax.add_collection(collection, autolim=True)
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    return collection
+
+def compact_path_data(match, decimals):
+    """Path data with rounded coordinates and no whitespace around the commands"""
+    def rounded(number):
+        text = f'{float(number.group()):.{decimals}f}'
+        text = text.rstrip('0').rstrip('.') if '.' in text else text
+        return '0' if text == '-0' else text
+    data = NUMBER.sub(rounded, match.group(1))
+    data = re.sub(r'\s*([MLCQZz])\s*', r'\1', data)
+    return ' d="' + re.sub(r'\s+', ' ', data).strip() + '"'
+
+def compact_style(match):
+    """Style attribute without spaces or declarations that restate SVG defaults"""
+    declarations = [re.sub(r'\s*:\s*', ':', declaration.strip()) for declaration in match.group(1).split(';')]
+    declarations = [declaration for declaration in declarations
+                    if declaration and declaration not in DEFAULT_DECLARATIONS]
+    return f' style="{";".join(declarations)}"' if declarations else ''
+
+def compact_svg(svg, dpi=SVG_DPI):
+    """Round path coordinates to dpi and drop style declarations that restate SVG defaults"""
+    decimals = coordinate_decimals(dpi)
+    svg = PATH_DATA.sub(lambda match: compact_path_data(match, decimals), svg)
+    return STYLE.sub(compact_style, svg)
+
+def save_map(fig, filename, image_format='svg', compact=True):
+    """Save a map figure as SVG (compacted unless compact is False) or as a raster thumbnail"""
+    if image_format in RASTER_FORMATS:
+        options = {'pil_kwargs': {'quality': WEBP_QUALITY, 'method': 6}} if image_format == 'webp' else {}
+        fig.savefig(filename, format=image_format, dpi=RASTER_DPI, bbox_inches='tight', **options)
+    elif compact:
+        buffer = io.StringIO()
+        # No date in the metadata, so unchanged maps produce identical files
+        fig.savefig(buffer, format='svg', dpi=SVG_DPI, bbox_inches='tight', metadata={'Date': None})
+        with open(filename, 'w') as f:
+            f.write(compact_svg(buffer.getvalue()))
+    else:
+        fig.savefig(filename, format='svg', dpi=SVG_DPI, bbox_inches='tight')
@@ -0,0 +1,178 @@
+import os
+import argparse
+import functools
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+from geo_io import read_geojson
+from metros import approximate_bboxes, metro_areas, metro_code, safe_metro_name
+from tract_store import find_legacy_files, has_geometry_store, load_tract_geometry
+
+SHAPEFILE = os.path.join('metro_area_shapefile', 'tl_2023_us_cbsa.shp')
+CONTEXT_DIR = 'context'
+
+# Pixels across the widest side of a map: the exporter's 12 inch figure at
+# 300 dpi, less the margins. Detail finer than one pixel is simplified away.
+OUTPUT_PIXELS = 3000
+
+def tract_boundary(code):
+    """Union of a metro's tracts, which tile its CBSA, or None without tract data"""
+    legacy = find_legacy_files()
+    if not (has_geometry_store(code) or os.path.exists(f'tracts_{code}.topo.json') or code in legacy):
+        return None
+    tracts = load_tract_geometry(code, legacy.get(code, [None])[0])
+    geometries = tracts.geometry.values[~tracts.geometry.is_empty.values]
+    try:
+        # Tracts share their borders exactly, so the cheaper coverage union applies
+        return shapely.coverage_union_all(geometries)
+    except shapely.errors.GEOSException:
+        return shapely.union_all(geometries)
+
+def approximate_boundary(metro_name):
+    """The hand-typed box of a metro as a polygon, or None"""
+    bbox = approximate_bboxes.get(metro_name)
+    if bbox is None:
+        return None
+    south, west, north, east = (float(v) for v in bbox.split(','))
+    return shapely.box(west, south, east, north)
+
+@functools.lru_cache(maxsize=1)
+def load_metro_boundaries():
+    """CBSA polygons of every mapped metro, indexed by cbsa_code, with where each came from
+
+    The TIGER/Line CBSA shapefile is used when it is present. Otherwise a
+    metro's boundary is the union of its tracts, and failing that its
+    hand-typed bounding box.
+    """
+    records = {}
+    if os.path.exists(SHAPEFILE):
+        codes = ', '.join(f"'{code}'" for code in metro_areas)
+        cbsa = pyogrio.read_dataframe(SHAPEFILE, columns=['CBSAFP'], where=f"CBSAFP IN ({codes})")
+        cbsa = cbsa.to_crs('EPSG:4326')
+        for code, geometry in zip(cbsa['CBSAFP'], cbsa.geometry):
+            records[code] = (geometry, 'shapefile')
+
+    for code, metro_name in metro_areas.items():
+        if code in records:
+            continue
+        geometry = tract_boundary(code)
+        if geometry is not None:
+            records[code] = (geometry, 'tracts')
+            continue
+        geometry = approximate_boundary(metro_name)
+        if geometry is not None:
+            records[code] = (geometry, 'bbox')
+
+    codes = list(records)
+    return gpd.GeoDataFrame({'cbsa_code': codes, 'source': [records[c][1] for c in codes]},
+                            geometry=[records[c][0] for c in codes], crs='EPSG:4326').set_index('cbsa_code')
+
+def metro_boundary(metro_name):
+    """(boundary polygon, source) of a metro, or (None, None)"""
+    boundaries = load_metro_boundaries()
+    code = metro_code(metro_name)
+    if code not in boundaries.index:
+        return None, None
+    return boundaries.geometry[code], boundaries['source'][code]
+
+def metro_bounds(metro_name):
+    """(minx, miny, maxx, maxy) of a metro's boundary, or None"""
+    boundary, _ = metro_boundary(metro_name)
+    return None if boundary is None else boundary.bounds
+
+def overpass_bbox(bounds):
+    """Overpass south,west,north,east string for (minx, miny, maxx, maxy)"""
+    minx, miny, maxx, maxy = bounds
+    return f"{miny:.4f},{minx:.4f},{maxy:.4f},{maxx:.4f}"
+
+def simplify_tolerance(bounds, pixels=OUTPUT_PIXELS):
+    """Size of one output pixel, in degrees, for a map of these bounds"""
+    minx, miny, maxx, maxy = bounds
+    return max(maxx - minx, maxy - miny) / pixels
+
+def same_dimension_parts(geometry, dimension):
+    """Drop the points and slivers a clip leaves behind, keeping parts of the original dimension"""
+    if geometry.geom_type != 'GeometryCollection':
+        return geometry
+    parts = [part for part in shapely.get_parts(geometry) if shapely.get_dimensions(part) == dimension]
+    if not parts:
+        return shapely.GeometryCollection()
+    if dimension == 2:
+        return shapely.union_all(parts)
+    if dimension == 1:
+        return shapely.line_merge(shapely.multilinestrings(parts))
+    return shapely.multipoints(parts)
+
+def clip_layer(gdf, boundary, tolerance):
+    """Features of a layer clipped to a boundary and simplified to the given tolerance
+
+    An STRtree over the features finds the ones whose envelopes touch the
+    boundary; only those are tested exactly, and only features that cross the
+    boundary are cut. Features wholly inside keep their geometry as is.
+    """
+    if gdf.empty:
+        return gdf
+    gdf = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+
+    tree = shapely.STRtree(gdf.geometry.values)
+    hits = np.sort(tree.query(boundary, predicate='intersects'))
+    gdf = gdf.iloc[hits].copy()
+
+    shapely.prepare(boundary)
+    geometries = np.asarray(gdf.geometry.values, dtype=object)
+    crossing = ~shapely.contains_properly(boundary, geometries)
+    if crossing.any():
+        # Layers written before ways were repaired can hold invalid polygons, on which intersection fails
+        invalid = crossing & ~shapely.is_valid(geometries)
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+        dimensions = shapely.get_dimensions(geometries[crossing])
+        clipped = shapely.intersection(geometries[crossing], boundary)
+        geometries[crossing] = [same_dimension_parts(g, d) for g, d in zip(clipped, dimensions)]
+
+    gdf['geometry'] = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    return gdf[~gdf.geometry.is_empty]
+
+def clipped_filename(metro_name):
+    """Clipped water/parks layer of a metro"""
+    return os.path.join(CONTEXT_DIR, f'water_parks_{safe_metro_name(metro_name)}.geojson')
+
+def water_parks_filename(metro_name):
+    """Water and park features drawn under a metro's tracts, clipped to the CBSA when available"""
+    clipped = clipped_filename(metro_name)
+    if os.path.exists(clipped):
+        return clipped
+    return f'water_parks_{safe_metro_name(metro_name)}.geojson'
+
+def clip_context_layers(codes=None, pixels=OUTPUT_PIXELS):
+    """Clip every water_parks_* layer to its CBSA boundary and simplify it for the maps"""
+    os.makedirs(CONTEXT_DIR, exist_ok=True)
+    boundaries = load_metro_boundaries()
+
+    for code, metro_name in metro_areas.items():
+        if codes and code not in codes:
+            continue
+        source_file = f'water_parks_{safe_metro_name(metro_name)}.geojson'
+        if not os.path.exists(source_file) or code not in boundaries.index:
+            continue
+
+        boundary = boundaries.geometry[code]
+        gdf = read_geojson(source_file)
+        clipped = clip_layer(gdf, boundary, simplify_tolerance(boundary.bounds, pixels))
+
+        filename = clipped_filename(metro_name)
+        with open(filename, 'w') as f:
+            f.write(clipped.to_json(drop_id=True) if not clipped.empty
+                    else '{"type": "FeatureCollection", "features": []}')
+        print(f"  {metro_name}: kept {len(clipped)} of {len(gdf)} features "
+              f"(boundary from {boundaries['source'][code]})")
+
+    print(f"Clipped layers written to {CONTEXT_DIR}/")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clip and simplify water/park layers to each metro's CBSA boundary")
+    parser.add_argument('codes', nargs='*', help="CBSA codes to clip (default: all)")
+    parser.add_argument('--pixels', type=int, default=OUTPUT_PIXELS,
+                        help="Output resolution across the widest side of a map")
+    args = parser.parse_args()
+    clip_context_layers(args.codes or None, args.pixels)
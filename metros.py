@@ -0,0 +1,73 @@
+# Metro areas with their codes and names
+metro_areas = {
+    "35620": "New York-Newark-Jersey City, NY-NJ-PA",
+    "31080": "Los Angeles-Long Beach-Anaheim, CA", 
+    "16980": "Chicago-Naperville-Elgin, IL-IN-WI",
+    "19100": "Dallas-Fort Worth-Arlington, TX",
+    "26420": "Houston-The Woodlands-Sugar Land, TX",
+    "47900": "Washington-Arlington-Alexandria, DC-VA-MD-WV",
+    "33100": "Miami-Fort Lauderdale-West Palm Beach, FL",
+    "37980": "Philadelphia-Camden-Wilmington, PA-NJ-DE-MD",
+    "12060": "Atlanta-Sandy Springs-Roswell, GA",
+    "38060": "Phoenix-Mesa-Chandler, AZ",
+    "14460": "Boston-Cambridge-Newton, MA-NH",
+    "41860": "San Francisco-Oakland-Fremont, CA",
+    "40140": "Riverside-San Bernardino-Ontario, CA",
+    "19820": "Detroit-Warren-Dearborn, MI",
+    "42660": "Seattle-Tacoma-Bellevue, WA",
+    "33460": "Minneapolis-St. Paul-Bloomington, MN-WI",
+    "45300": "Tampa-St. Petersburg-Clearwater, FL",
+    "41740": "San Diego-Chula Vista-Carlsbad, CA",
+    "19740": "Denver-Aurora-Centennial, CO",
+    "36740": "Orlando-Kissimmee-Sanford, FL",
+    "16740": "Charlotte-Concord-Gastonia, NC-SC",
+    "12580": "Baltimore-Columbia-Towson, MD",
+    "41180": "St. Louis, MO-IL",
+    "41700": "San Antonio-New Braunfels, TX",
+    "12420": "Austin-Round Rock-San Marcos, TX",
+    "29820": "Las Vegas-Henderson-North Las Vegas, NV",
+    "40900": "Sacramento-Roseville-Folsom, CA"
+}
+
+# Hand-typed south,west,north,east boxes, used only when neither the CBSA
+# shapefile nor tract geometry is available for a metro
+approximate_bboxes = {
+    "New York-Newark-Jersey City, NY-NJ-PA": "40.4,-74.3,40.9,-73.6",
+    "Los Angeles-Long Beach-Anaheim, CA": "33.6,-118.7,34.3,-117.9",
+    "Chicago-Naperville-Elgin, IL-IN-WI": "41.6,-88.2,42.2,-87.4",
+    "Dallas-Fort Worth-Arlington, TX": "32.5,-97.4,33.2,-96.6",
+    "Houston-The Woodlands-Sugar Land, TX": "29.4,-95.8,30.2,-94.9",
+    "Washington-Arlington-Alexandria, DC-VA-MD-WV": "38.7,-77.3,39.1,-76.8",
+    "Miami-Fort Lauderdale-West Palm Beach, FL": "25.4,-80.8,26.4,-80.0",
+    "Philadelphia-Camden-Wilmington, PA-NJ-DE-MD": "39.8,-75.4,40.2,-74.9",
+    "Atlanta-Sandy Springs-Roswell, GA": "33.5,-84.8,34.2,-84.2",
+    "Phoenix-Mesa-Chandler, AZ": "33.2,-112.4,33.8,-111.6",
+    "Boston-Cambridge-Newton, MA-NH": "42.2,-71.3,42.5,-70.9",
+    "San Francisco-Oakland-Fremont, CA": "37.6,-122.6,38.1,-122.0",
+    "Riverside-San Bernardino-Ontario, CA": "33.7,-117.8,34.3,-117.0",
+    "Detroit-Warren-Dearborn, MI": "42.1,-83.5,42.6,-82.8",
+    "Seattle-Tacoma-Bellevue, WA": "47.4,-122.6,47.8,-122.0",
+    "Minneapolis-St. Paul-Bloomington, MN-WI": "44.8,-93.6,45.2,-92.9",
+    "Tampa-St. Petersburg-Clearwater, FL": "27.7,-82.8,28.2,-82.3",
+    "San Diego-Chula Vista-Carlsbad, CA": "32.5,-117.4,33.2,-116.8",
+    "Denver-Aurora-Centennial, CO": "39.5,-105.2,40.0,-104.6",
+    "Orlando-Kissimmee-Sanford, FL": "28.2,-81.6,28.8,-80.9",
+    "Charlotte-Concord-Gastonia, NC-SC": "35.0,-81.2,35.5,-80.5",
+    "Baltimore-Columbia-Towson, MD": "39.1,-76.9,39.4,-76.4",
+    "St. Louis, MO-IL": "38.4,-90.6,38.9,-89.9",
+    "San Antonio-New Braunfels, TX": "29.2,-98.8,29.8,-98.1",
+    "Austin-Round Rock-San Marcos, TX": "30.0,-98.0,30.6,-97.3",
+    "Las Vegas-Henderson-North Las Vegas, NV": "36.0,-115.5,36.4,-114.8",
+    "Sacramento-Roseville-Folsom, CA": "38.3,-121.8,38.8,-121.0"
+}
+
+def safe_metro_name(metro_name):
+    """File-name friendly version of a metro name"""
+    return metro_name.replace('/', '-').replace(',', '').replace(' ', '_')
+
+def metro_code(metro_name):
+    """CBSA code of a metro name, or None if it is not one of the mapped metros"""
+    for code, name in metro_areas.items():
+        if name == metro_name:
+            return code
+    return None
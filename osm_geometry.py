@@ -0,0 +1,167 @@
+import numpy as np
+import shapely
+
+# Tags whose ways are lines even when closed, e.g. a river loop or an island's coastline
+LINE_KEYS = {'waterway', 'barrier', 'highway', 'railway'}
+LINE_TAGS = {('natural', 'coastline')}
+
+class NodeIndex:
+    """Node id -> coordinate lookup backed by two sorted arrays
+
+    Far smaller than a dict of tuples (16 bytes of coordinates and 8 of id per
+    node) and looked up in bulk with one searchsorted call.
+    """
+
+    def __init__(self, ids, coords):
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.coords = coords[order]
+
+    @classmethod
+    def from_elements(cls, elements):
+        """Index the node elements of an Overpass response"""
+        count = sum(1 for element in elements if element['type'] == 'node')
+        ids = np.empty(count, dtype=np.int64)
+        coords = np.empty((count, 2), dtype=np.float64)
+        i = 0
+        for element in elements:
+            if element['type'] == 'node':
+                ids[i] = element['id']
+                coords[i, 0] = element['lon']
+                coords[i, 1] = element['lat']
+                i += 1
+        return cls(ids, coords)
+
+    def lookup(self, node_ids):
+        """Coordinates of many node ids at once, and a mask of the ids that were found"""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full((len(node_ids), 2), np.nan), np.zeros(len(node_ids), dtype=bool)
+        positions = np.searchsorted(self.ids, node_ids).clip(0, len(self.ids) - 1)
+        found = self.ids[positions] == node_ids
+        coords = self.coords[positions]
+        coords[~found] = np.nan
+        return coords, found
+
+def is_line(tags):
+    """Whether a way with these tags is a line rather than an area"""
+    return any(key in tags for key in LINE_KEYS) or any(tags.get(key) == value for key, value in LINE_TAGS)
+
+def way_geometries(ways, index):
+    """{way id: LineString or Polygon} for every way whose nodes are all known
+
+    All node lists are joined to coordinates in one lookup and all geometries
+    are built in one vectorized shapely call per geometry type.
+    """
+    if not ways:
+        return {}
+
+    counts = np.fromiter((len(way['nodes']) for way in ways), dtype=np.int64, count=len(ways))
+    refs = np.fromiter((ref for way in ways for ref in way['nodes']), dtype=np.int64, count=int(counts.sum()))
+    coords, found = index.lookup(refs)
+    way_of_ref = np.repeat(np.arange(len(ways)), counts)
+
+    # Drop ways with a missing node or too few nodes to draw
+    complete = np.ones(len(ways), dtype=bool)
+    complete[np.unique(way_of_ref[~found])] = False
+    complete &= counts >= 2
+
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    closed = np.zeros(len(ways), dtype=bool)
+    nonempty = counts > 0
+    closed[nonempty] = refs[offsets[1:][nonempty] - 1] == refs[offsets[:-1][nonempty]]
+    area = complete & closed & (counts >= 4)
+    for i in np.flatnonzero(area):
+        if is_line(ways[i].get('tags', {})):
+            area[i] = False
+    line = complete & ~area
+
+    geometries = {}
+    for mask, build in [(line, lambda c, i: shapely.linestrings(c, indices=i)),
+                        (area, lambda c, i: shapely.polygons(shapely.linearrings(c, indices=i)))]:
+        selected = np.flatnonzero(mask)
+        if len(selected) == 0:
+            continue
+        keep = mask[way_of_ref]
+        # Renumber so the indices of the selected ways run 0..n-1
+        indices = np.searchsorted(selected, way_of_ref[keep])
+        for i, geometry in zip(selected, build(coords[keep], indices)):
+            geometries[ways[i]['id']] = geometry
+    return geometries
+
+def as_lines(geometry):
+    """Closed ways that became polygons go back to their boundary for ring stitching"""
+    return geometry.exterior if geometry.geom_type == 'Polygon' else geometry
+
+def multipolygon_geometry(relation, geometries):
+    """Stitch a multipolygon relation's member ways into one valid (Multi)Polygon, or None"""
+    outer, inner = [], []
+    for member in relation.get('members', []):
+        if member['type'] != 'way' or member['ref'] not in geometries:
+            continue
+        (inner if member.get('role') == 'inner' else outer).append(as_lines(geometries[member['ref']]))
+    if not outer:
+        return None
+
+    # polygonize joins member ways end to end into rings, whatever their order and direction
+    outer_area = shapely.union_all(shapely.get_parts(shapely.polygonize(outer)))
+    if outer_area.is_empty:
+        return None
+    if inner:
+        outer_area = outer_area.difference(shapely.union_all(shapely.get_parts(shapely.polygonize(inner))))
+    return shapely.make_valid(outer_area)
+
+def line_relation_geometry(relation, geometries):
+    """Merge a waterway (or other linear) relation's member ways into as few lines as possible"""
+    lines = [as_lines(geometries[member['ref']]) for member in relation.get('members', [])
+             if member['type'] == 'way' and member['ref'] in geometries]
+    if not lines:
+        return None
+    return shapely.line_merge(shapely.multilinestrings(lines))
+
+def assemble_features(data):
+    """(tags, geometry) for every tagged way and relation in an Overpass response
+
+    Untagged ways are relation members (from `>; out skel`) and only appear as
+    part of their relation. Named line features with the same tags, such as the
+    segments of one river, are merged into single lines.
+    """
+    elements = (data or {}).get('elements', [])
+    index = NodeIndex.from_elements(elements)
+    ways = [element for element in elements if element['type'] == 'way']
+    relations = [element for element in elements if element['type'] == 'relation']
+    geometries = way_geometries(ways, index)
+
+    features = []
+    lines_by_tags = {}
+    for way in ways:
+        tags = way.get('tags')
+        geometry = geometries.get(way['id'])
+        if not tags or geometry is None:
+            continue
+        if geometry.geom_type == 'LineString' and 'name' in tags:
+            lines_by_tags.setdefault(tuple(sorted(tags.items())), []).append(geometry)
+        else:
+            features.append((tags, geometry))
+
+    for relation in relations:
+        tags = relation.get('tags', {})
+        if tags.get('type') in ('multipolygon', 'boundary'):
+            geometry = multipolygon_geometry(relation, geometries)
+        else:
+            geometry = line_relation_geometry(relation, geometries)
+        if geometry is not None and not geometry.is_empty:
+            features.append((tags, geometry))
+
+    # Closed ways are polygons of their raw node order, and self-intersecting
+    # "bowtie" ways are common in OSM; repair them as relations are repaired
+    geometries = np.array([geometry for _, geometry in features], dtype=object)
+    invalid = np.flatnonzero(~shapely.is_valid(geometries)) if len(geometries) else []
+    for i, geometry in zip(invalid, shapely.make_valid(geometries[invalid])):
+        features[i] = (features[i][0], geometry)
+
+    for key, lines in lines_by_tags.items():
+        merged = shapely.line_merge(shapely.multilinestrings(lines)) if len(lines) > 1 else lines[0]
+        features.append((dict(key), merged))
+
+    return features
@@ -0,0 +1,231 @@
+import os
+import re
+import gzip
+import json
+import time
+import random
+import tempfile
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from build_cache import value_hash
+
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# overpass-api.de gives each client IP two query slots
+DEFAULT_CONCURRENCY = 2
+# Seconds between the starts of two requests, across all threads
+DEFAULT_MIN_INTERVAL = 1.0
+# (connect, read) timeout; queries themselves ask the server for 25 seconds
+DEFAULT_TIMEOUT = (10, 90)
+DEFAULT_RETRIES = 4
+
+DEFAULT_CACHE_DIR = 'osm_cache'
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Status codes worth retrying: rate limited, or the server is overloaded
+RETRY_STATUS = {429, 502, 503, 504}
+
+class OverpassCache:
+    """Gzipped Overpass responses on disk, keyed by query text and bbox
+
+    Entries older than ttl seconds are treated as missing. When the cache grows
+    past max_bytes, the least recently used entries are removed first.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_CACHE_TTL, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, query, bbox):
+        """Cache file of one query"""
+        return os.path.join(self.directory, value_hash({'query': query.strip(), 'bbox': bbox}) + '.json.gz')
+
+    def get(self, query, bbox):
+        """Cached response data, or None when missing or expired"""
+        path = self.path(query, bbox)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with gzip.open(path, 'rb') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Reading counts as use for eviction
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return data
+
+    def put(self, query, bbox, content):
+        """Store raw response bytes atomically, then evict if over budget"""
+        fd, temp_filename = tempfile.mkstemp(prefix='.osm-', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(content, mtime=0))
+            os.replace(temp_filename, self.path(query, bbox))
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until under max_bytes"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json.gz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                    continue
+            except OSError:
+                # Another thread got to it first
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+class OverpassClient:
+    """Overpass API client with a pooled session, bounded concurrency and a disk cache
+
+    At most `concurrency` requests are in flight at once and request starts are
+    spaced at least `min_interval` seconds apart. Rate-limit and overload
+    responses are retried with exponential backoff, honoring Retry-After and the
+    server's /api/status slot times.
+    """
+
+    def __init__(self, url=OVERPASS_URL, concurrency=DEFAULT_CONCURRENCY, min_interval=DEFAULT_MIN_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, cache=None):
+        self.url = url
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+
+        # One pooled connection per worker, reused across every query
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = 'tractmap/1.0'
+
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._pace_lock = threading.Lock()
+        self._next_start = 0.0
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'cache_hits': 0, 'retries': 0}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _pace(self):
+        """Block until this thread may start a request"""
+        with self._pace_lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def status_wait(self):
+        """Seconds until the server reports a free slot, or None if unknown"""
+        status_url = self.url.rsplit('/', 1)[0] + '/status'
+        try:
+            text = self.session.get(status_url, timeout=self.timeout).text
+        except requests.RequestException:
+            return None
+        if re.search(r'^\d+ slots? available now', text, re.M):
+            return 0
+        waits = [int(s) for s in re.findall(r'in (\d+) seconds', text)]
+        return min(waits) if waits else None
+
+    def retry_delay(self, attempt, response=None):
+        """Backoff before the next attempt, preferring what the server asks for"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return int(retry_after)
+            if response.status_code == 429:
+                wait = self.status_wait()
+                if wait is not None:
+                    return wait + 1
+        return min(2 ** attempt, 60) * (0.5 + random.random())
+
+    def fetch(self, query, bbox):
+        """Response data of one Overpass query, from the cache when fresh"""
+        if self.cache is not None:
+            data = self.cache.get(query, bbox)
+            if data is not None:
+                self._count('cache_hits')
+                return data
+
+        for attempt in range(self.retries + 1):
+            response = None
+            with self._slots:
+                self._pace()
+                self._count('requests')
+                try:
+                    response = self.session.post(self.url, data={'data': query}, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                else:
+                    if response.status_code == 200:
+                        content = response.content
+                        data = json.loads(content)
+                        # Timeouts and out-of-memory come back as 200 with a remark and
+                        # truncated elements: retry them and never cache them
+                        remark = data.get('remark') or ''
+                        if 'runtime error' not in remark:
+                            if self.cache is not None:
+                                self.cache.put(query, bbox, content)
+                            return data
+                        error = requests.HTTPError(f"Overpass {remark}", response=response)
+                    else:
+                        error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                        if response.status_code not in RETRY_STATUS:
+                            raise error
+
+            if attempt == self.retries:
+                raise error
+            self._count('retries')
+            # Sleep outside the slot so other threads keep using it
+            time.sleep(self.retry_delay(attempt, response))
+
+    def fetch_many(self, jobs):
+        """Fetch {key: (query, bbox)} concurrently; returns {key: data or the exception raised}"""
+        def run(item):
+            key, (query, bbox) = item
+            try:
+                return key, self.fetch(query, bbox)
+            except Exception as e:
+                return key, e
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return dict(pool.map(run, jobs.items()))
@@ -0,0 +1,148 @@
+import os
+import csv
+import argparse
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Columns of the per-stage CSV report
+STAGE_COLUMNS = ['code', 'name', 'year', 'shared', 'stage', 'wall_seconds', 'cpu_seconds', 'peak_mb']
+
+class NullProfiler:
+    """Stand-in used when profiling is off: every stage is the same no-op context"""
+    enabled = False
+    _stage = nullcontext()
+
+    def stage(self, name, year=None):
+        return self._stage
+
+    def count(self, name, value, year=None):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+class StageProfiler:
+    """Wall time, CPU time and peak memory of the named stages of one export job
+
+    Peak memory is the largest amount traced by tracemalloc during the stage,
+    which covers Python objects and NumPy buffers but not GDAL or GEOS
+    internals. Tracing slows allocation-heavy stages somewhat, so compare
+    profiled runs with each other rather than with unprofiled ones.
+
+    A stage recorded without a year is shared by every year of the job, such
+    as loading the geometry once for a metro's recolored maps.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages = []
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name, year=None):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                'stage': name,
+                'year': year,
+                'wall_seconds': time.perf_counter() - wall,
+                'cpu_seconds': time.process_time() - cpu,
+                'peak_mb': tracemalloc.get_traced_memory()[1] / 1e6 if tracing else None
+            })
+
+    def count(self, name, value, year=None):
+        """Record a size or count, such as features drawn or bytes written"""
+        self.counts.setdefault(year, {})[name] = value
+
+    def year_report(self, year, shared=False):
+        """Stages and counts of one year; shared ones too when shared is set"""
+        years = (year, None) if shared else (year,)
+        stages = [dict(stage, year=year, shared=stage['year'] is None)
+                  for stage in self.stages if stage['year'] in years]
+        counts = {}
+        for key in reversed(years):
+            counts.update(self.counts.get(key, {}))
+        return {'stages': stages, 'counts': counts}
+
+@contextmanager
+def traced_memory(enabled=True):
+    """Trace Python allocations for the duration, unless tracing is already on or not wanted"""
+    if not enabled or tracemalloc.is_tracing():
+        yield
+        return
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        tracemalloc.stop()
+
+def write_report(results, directory):
+    """Write profile.json (every job with its stages and counts) and profile.csv (one row per stage)"""
+    os.makedirs(directory, exist_ok=True)
+    jobs = [result for result in results if result.get('profile')]
+
+    with open(os.path.join(directory, 'profile.json'), 'w') as f:
+        json.dump([{key: value for key, value in result.items() if key != 'profile'} | result['profile']
+                   for result in jobs], f, indent=1)
+
+    with open(os.path.join(directory, 'profile.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=STAGE_COLUMNS)
+        writer.writeheader()
+        for result in jobs:
+            for stage in result['profile']['stages']:
+                writer.writerow({'code': result['code'], 'name': result['name'], **stage})
+
+    print(f"Profile of {len(jobs)} jobs written to {directory}/profile.json and profile.csv")
+
+def profile_call(filename, func, *args):
+    """Run func under cProfile and dump its statistics to filename for pstats or snakeviz"""
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(filename)
+
+def job_totals(job):
+    """(output bytes, seconds in all stages, seconds saving) of one job in a profile report"""
+    stages = job['stages']
+    return (job['counts'].get('output_bytes', 0),
+            sum(stage['wall_seconds'] for stage in stages),
+            sum(stage['wall_seconds'] for stage in stages if stage['stage'].startswith('save_')))
+
+def compare_reports(before_file, after_file):
+    """Print output size and time of every job in two profile reports, e.g. plain and compact SVGs
+
+    Shared stages are reported with a metro's first year, so compare runs
+    made with the same --per-year setting.
+    """
+    with open(before_file, 'r') as f:
+        before = {(job['code'], job['year']): job for job in json.load(f)}
+    with open(after_file, 'r') as f:
+        after = {(job['code'], job['year']): job for job in json.load(f)}
+
+    print(f"{'map':<48} {'size before':>12} {'after':>10} {'ratio':>6} {'time before':>12} {'after':>8} {'save':>14}")
+    totals = [0, 0, 0, 0]
+    for key in sorted(before.keys() & after.keys(), key=lambda key: (key[1], key[0])):
+        old_bytes, old_seconds, old_save = job_totals(before[key])
+        new_bytes, new_seconds, new_save = job_totals(after[key])
+        totals = [a + b for a, b in zip(totals, [old_bytes, new_bytes, old_seconds, new_seconds])]
+        label = f"{before[key]['name'][:42]} {key[1]}"
+        print(f"{label:<48} {old_bytes / 1e6:>10.2f}MB {new_bytes / 1e6:>8.2f}MB {new_bytes / max(old_bytes, 1):>6.2f} "
+              f"{old_seconds:>11.2f}s {new_seconds:>7.2f}s {old_save:>6.2f}s->{new_save:.2f}s")
+    print(f"{'total':<48} {totals[0] / 1e6:>10.2f}MB {totals[1] / 1e6:>8.2f}MB "
+          f"{totals[1] / max(totals[0], 1):>6.2f} {totals[2]:>11.2f}s {totals[3]:>7.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the export profile reports of two runs")
+    parser.add_argument('before', help="profile.json of the baseline run")
+    parser.add_argument('after', help="profile.json of the run to compare")
+    args = parser.parse_args()
+    compare_reports(args.before, args.after)
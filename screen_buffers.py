@@ -0,0 +1,202 @@
+import os
+import struct
+import argparse
+import numpy as np
+import shapely
+from tract_index import GEOID_LENGTH
+from tract_store import find_legacy_files, load_tract_geometry, tract_codes
+
+# Size of a card's canvas in index.html, in CSS pixels
+CARD_WIDTH = 380
+CARD_HEIGHT = 250
+
+# Sub-pixel steps per pixel; a 380 px card is 6080 steps across, well inside int16
+QUANTIZATION = 16
+# Widest or tallest canvas whose quantized coordinates (first points of rings are absolute) fit int16
+MAX_CANVAS = np.iinfo(np.int16).max // QUANTIZATION
+
+# d3.geoAlbers(): conic equal-area with standard parallels 29.5 and 45.5,
+# rotated to -96 and centered on (-0.6, 38.7) in rotated coordinates
+ALBERS_PARALLELS = (29.5, 45.5)
+ALBERS_ROTATE = 96.0
+ALBERS_CENTER = (-0.6, 38.7)
+
+# Header: magic, version, quantization, canvas width and height, tract, ring
+# and point counts, then the fitted projection's scale and translate. It is
+# followed by the ring offsets (uint32, into the points), the tract offsets
+# (uint32, into the rings), the delta-encoded points (int16 x, y pairs) and
+# the 11-character GEOID of each tract.
+SCREEN_MAGIC = b'TMSB'
+SCREEN_VERSION = 1
+HEADER = struct.Struct('<4sHHHHIIIddd')
+
+def buffer_filename(code):
+    """Pre-projected tract rings of a metro, for drawing cards without d3 projection"""
+    return f'screen_{code}.bin'
+
+def albers_raw(lam, phi):
+    """d3's conicEqualAreaRaw for geoAlbers' parallels, on radians"""
+    phi0, phi1 = np.radians(ALBERS_PARALLELS)
+    sy0 = np.sin(phi0)
+    n = (sy0 + np.sin(phi1)) / 2
+    c = 1 + sy0 * (2 * n - sy0)
+    r0 = np.sqrt(c) / n
+    r = np.sqrt(c - 2 * n * np.sin(phi)) / n
+    return r * np.sin(lam * n), r0 - r * np.cos(lam * n)
+
+def albers_unit(lon, lat):
+    """d3.geoAlbers() coordinates at scale 1 and translate (0, 0), y pointing down"""
+    lam = np.radians(np.asarray(lon, dtype=float) + ALBERS_ROTATE)
+    lam = np.where(lam > np.pi, lam - 2 * np.pi, np.where(lam < -np.pi, lam + 2 * np.pi, lam))
+    x, y = albers_raw(lam, np.radians(np.asarray(lat, dtype=float)))
+    cx, cy = albers_raw(*np.radians(ALBERS_CENTER))
+    return x - cx, cy - y
+
+def fit_size(x, y, width=CARD_WIDTH, height=CARD_HEIGHT):
+    """(scale, translate x, translate y) of d3's projection.fitSize for unit coordinates"""
+    x0, x1, y0, y1 = x.min(), x.max(), y.min(), y.max()
+    scale = min(width / (x1 - x0), height / (y1 - y0))
+    return scale, (width - scale * (x1 + x0)) / 2, (height - scale * (y1 + y0)) / 2
+
+def tract_rings(geometries):
+    """(tract of each ring, ring of each point, lon/lat of each point) with every ring left open
+
+    Exteriors and holes are wound in opposite directions, so the default
+    nonzero fill of a canvas or matplotlib path leaves the holes empty.
+    """
+    polygons = shapely.orient_polygons(geometries)
+    parts, tract_of_part = shapely.get_parts(polygons, return_index=True)
+    rings, part_of_ring = shapely.get_rings(parts, return_index=True)
+    coords, ring_of_point = shapely.get_coordinates(rings, return_index=True)
+
+    # Drop each ring's closing point; a closed path gets it back
+    last = np.r_[ring_of_point[1:] != ring_of_point[:-1], True]
+    return tract_of_part[part_of_ring], ring_of_point[~last], coords[~last]
+
+def encode_rings(ring_of_point, points):
+    """(ring offsets, int16 deltas) of quantized points, without repeated points
+
+    The first point of each ring is stored as a delta from (0, 0), so every
+    ring decodes on its own.
+    """
+    quantized = np.round(points * QUANTIZATION).astype(np.int32)
+    same_ring = np.r_[False, ring_of_point[1:] == ring_of_point[:-1]]
+    repeated = same_ring & np.r_[False, (quantized[1:] == quantized[:-1]).all(axis=1)]
+    quantized, ring_of_point = quantized[~repeated], ring_of_point[~repeated]
+    same_ring = same_ring[~repeated]
+
+    deltas = quantized.copy()
+    deltas[1:][same_ring[1:]] -= quantized[:-1][same_ring[1:]]
+    limits = np.iinfo(np.int16)
+    if len(deltas) and (deltas.min() < limits.min or deltas.max() > limits.max):
+        raise ValueError(f"quantized coordinates exceed int16; use a canvas of at most {MAX_CANVAS} px")
+    counts = np.bincount(ring_of_point, minlength=ring_of_point.max() + 1 if len(ring_of_point) else 0)
+    return np.r_[0, np.cumsum(counts)].astype(np.uint32), deltas.astype(np.int16)
+
+def write_screen_buffer(code, filename=None, width=CARD_WIDTH, height=CARD_HEIGHT):
+    """Project a metro's tracts to card pixels once and write them as a binary buffer"""
+    legacy = find_legacy_files()
+    tracts = load_tract_geometry(code, legacy.get(code, [None])[0], columns=['tract_geoid'])
+    tracts = tracts[~(tracts.geometry.isna() | tracts.geometry.is_empty)].reset_index(drop=True)
+    geoids = tracts['tract_geoid'].astype(str)
+    if (geoids.str.len() != GEOID_LENGTH).any():
+        raise ValueError(f"{code}: tract_geoid values must be {GEOID_LENGTH} characters")
+
+    tract_of_ring, ring_of_point, lonlat = tract_rings(tracts.geometry.values)
+    x, y = albers_unit(lonlat[:, 0], lonlat[:, 1])
+    scale, tx, ty = fit_size(x, y, width, height)
+    ring_offsets, deltas = encode_rings(ring_of_point, np.column_stack([tx + scale * x, ty + scale * y]))
+    tract_offsets = np.r_[0, np.cumsum(np.bincount(tract_of_ring, minlength=len(tracts)))].astype(np.uint32)
+
+    filename = filename or buffer_filename(code)
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(SCREEN_MAGIC, SCREEN_VERSION, QUANTIZATION, width, height,
+                            len(tracts), len(ring_offsets) - 1, len(deltas), scale, tx, ty))
+        f.write(ring_offsets.astype('<u4').tobytes())
+        f.write(tract_offsets.astype('<u4').tobytes())
+        f.write(deltas.astype('<i2').tobytes())
+        f.write(''.join(geoids).encode('ascii'))
+
+    print(f"Saved {filename} ({len(tracts)} tracts, {len(deltas)} points, "
+          f"{os.path.getsize(filename) / 1e3:.1f} KB)")
+
+class ScreenBuffer:
+    """A screen buffer file mapped into memory, with its arrays as zero-copy views"""
+
+    def __init__(self, filename):
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+        (magic, version, self.quantization, self.width, self.height, tracts, rings, points,
+         self.scale, tx, ty) = HEADER.unpack_from(data)
+        if magic != SCREEN_MAGIC or version != SCREEN_VERSION:
+            raise ValueError(f"{filename} is not a version {SCREEN_VERSION} screen buffer")
+        self.translate = (tx, ty)
+
+        offset = HEADER.size
+        self.ring_offsets = data[offset:offset + (rings + 1) * 4].view('<u4')
+        offset += (rings + 1) * 4
+        self.tract_offsets = data[offset:offset + (tracts + 1) * 4].view('<u4')
+        offset += (tracts + 1) * 4
+        self.deltas = data[offset:offset + points * 4].view('<i2').reshape(-1, 2)
+        offset += points * 4
+        self.geoids = data[offset:offset + tracts * GEOID_LENGTH].view(f'S{GEOID_LENGTH}').astype(str)
+
+    def __len__(self):
+        return len(self.geoids)
+
+    def points(self):
+        """Absolute pixel coordinates of every point, decoded in one pass"""
+        total = np.cumsum(self.deltas, axis=0, dtype=np.int64)
+        # Undo the running sum at each ring start, where the deltas restart from (0, 0)
+        starts = self.ring_offsets[:-1].astype(np.int64)
+        before = np.vstack([[0, 0], total])[starts]
+        return (total - np.repeat(before, np.diff(self.ring_offsets), axis=0)) / self.quantization
+
+    def tract_paths(self):
+        """One matplotlib Path per tract in pixel coordinates, holes included"""
+        from matplotlib.path import Path
+
+        points = self.points()
+        codes = np.full(len(points), Path.LINETO, dtype=Path.code_type)
+        codes[self.ring_offsets[:-1]] = Path.MOVETO
+        paths = []
+        for t in range(len(self)):
+            vertices, path_codes = [], []
+            for r in range(self.tract_offsets[t], self.tract_offsets[t + 1]):
+                start, end = self.ring_offsets[r], self.ring_offsets[r + 1]
+                vertices.extend([points[start:end], points[start:start + 1]])
+                path_codes.extend([codes[start:end], [Path.CLOSEPOLY]])
+            paths.append(Path(np.concatenate(vertices), np.concatenate(path_codes)) if vertices
+                         else Path(np.empty((0, 2))))
+        return paths
+
+def rasterize(buffer, colors, scale=1):
+    """RGBA array of a card drawn from a screen buffer: tracts filled with colors, white borders"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import PathCollection
+
+    fig = plt.figure(figsize=(buffer.width / 100, buffer.height / 100), dpi=100 * scale)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.set_xlim(0, buffer.width)
+    ax.set_ylim(buffer.height, 0)
+    ax.add_collection(PathCollection(buffer.tract_paths(), facecolors=colors, edgecolors='white',
+                                     linewidths=0.5 * 72 / 100))
+    try:
+        fig.canvas.draw()
+        return np.asarray(fig.canvas.buffer_rgba()).copy()
+    finally:
+        plt.close(fig)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-project tract geometry into card-sized binary buffers")
+    parser.add_argument('codes', nargs='*', help="CBSA codes (default: all with tract data)")
+    parser.add_argument('--width', type=int, default=CARD_WIDTH)
+    parser.add_argument('--height', type=int, default=CARD_HEIGHT)
+    args = parser.parse_args()
+    if max(args.width, args.height) > MAX_CANVAS:
+        parser.error(f"--width and --height can be at most {MAX_CANVAS} px at quantization {QUANTIZATION}")
+
+    for code in args.codes or tract_codes():
+        write_screen_buffer(code, width=args.width, height=args.height)
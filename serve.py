@@ -0,0 +1,266 @@
+import os
+import gzip
+import asyncio
+import argparse
+import mimetypes
+from email.utils import formatdate
+from urllib.parse import unquote
+
+# Brotli variants are written and served only when the brotli package is installed
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# Text assets worth compressing ahead of time; everything else is served as is
+COMPRESSIBLE = ('.json', '.geojson', '.html', '.csv', '.svg', '.js', '.css', '.bin')
+# Files smaller than this gain nothing from compression
+MIN_COMPRESS_BYTES = 1024
+# (brotli quality, gzip level) for small and large files: brotli 11 takes about 3 s per megabyte
+# and gzip 9 four times as long as gzip 6 for a fraction of a percent, so large files get faster settings
+COMPRESSION_LEVELS = (11, 9)
+LARGE_COMPRESSION_LEVELS = (9, 6)
+LARGE_FILE_BYTES = 256 * 1024
+# Caches and build outputs under the data directory that the page never fetches
+SKIP_DIRS = {'.git', '__pycache__', 'osm_cache', 'parquet', 'context', 'bench', 'metro-areas', 'export', 'arrays',
+             'metro_area_shapefile'}
+
+# Precompressed variants, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+mimetypes.add_type('application/geo+json', '.geojson')
+mimetypes.add_type('application/json', '.json')
+mimetypes.add_type('application/octet-stream', '.bin')
+mimetypes.add_type('application/octet-stream', '.pmtiles')
+
+MAX_HEADER_BYTES = 64 * 1024
+KEEP_ALIVE_SECONDS = 15
+
+def precompress(root, force=False):
+    """Write .gz (and .br) variants next to every compressible asset under root, skipping SKIP_DIRS"""
+    written = 0
+    for directory, directories, files in os.walk(root):
+        directories[:] = [name for name in directories if name not in SKIP_DIRS]
+        for name in files:
+            path = os.path.join(directory, name)
+            if not name.endswith(COMPRESSIBLE) or os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            with open(path, 'rb') as f:
+                data = None
+                for encoding, suffix in ENCODINGS:
+                    if encoding == 'br' and not HAS_BROTLI:
+                        continue
+                    variant = path + suffix
+                    if not force and os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+                        continue
+                    if data is None:
+                        data = f.read()
+                        large = len(data) > LARGE_FILE_BYTES
+                        quality, level = LARGE_COMPRESSION_LEVELS if large else COMPRESSION_LEVELS
+                    compressed = brotli.compress(data, quality=quality) if encoding == 'br' \
+                        else gzip.compress(data, compresslevel=level, mtime=0)
+                    with open(variant, 'wb') as out:
+                        out.write(compressed)
+                    written += 1
+    print(f"Wrote {written} precompressed files under {root}" + ("" if HAS_BROTLI else " (brotli not installed)"))
+
+class StaticFiles:
+    """Resolve request paths to files, pick encodings and compute ETags"""
+
+    def __init__(self, root, max_age=0):
+        self.root = os.path.realpath(root)
+        self.cache_control = f'public, max-age={max_age}' if max_age else 'no-cache'
+
+    def resolve(self, url_path):
+        """Absolute file path for a URL path, or None if missing or outside the root"""
+        path = unquote(url_path.split('?', 1)[0].split('#', 1)[0]).lstrip('/')
+        full = os.path.realpath(os.path.join(self.root, path))
+        if not (full == self.root or full.startswith(self.root + os.sep)):
+            return None
+        if os.path.isdir(full):
+            full = os.path.join(full, 'index.html')
+        return full if os.path.isfile(full) else None
+
+    def variant(self, path, accept_encoding, ranged):
+        """(file to send, Content-Encoding or None) for the client's Accept-Encoding
+
+        Byte ranges always address the identity encoding, so ranged requests
+        never get a compressed variant.
+        """
+        if ranged:
+            return path, None
+        qualities = encoding_qualities(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            candidate = path + suffix
+            if qualities.get(encoding, qualities.get('*', 0)) > 0 and os.path.exists(candidate) \
+                    and os.path.getmtime(candidate) >= os.path.getmtime(path):
+                return candidate, encoding
+        return path, None
+
+    def etag(self, path):
+        """Strong ETag from a file's modification time and size
+
+        Taken from a stat rather than a hash of the contents, so answering a
+        request never reads a whole file on the event loop.
+        """
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def encoding_qualities(header):
+    """{content coding: q-value} of an Accept-Encoding header; q=0 means the coding is refused"""
+    qualities = {}
+    for token in header.split(','):
+        coding, *params = [part.strip() for part in token.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to ignore it, or 'invalid'"""
+    if not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length == 0:
+                return 'invalid'
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return 'invalid'
+    return start, min(end, size - 1)
+
+async def read_request(reader):
+    """(method, path, version, headers) of the next request, or None at end of stream"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_SECONDS)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, version = lines[0].split(' ', 2)
+    except ValueError:
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, path, version, headers
+
+async def send_file(writer, path, start, length):
+    """Send part of a file, with sendfile where the platform allows it"""
+    loop = asyncio.get_running_loop()
+    with open(path, 'rb') as f:
+        await loop.sendfile(writer.transport, f, start, length, fallback=True)
+
+async def handle_connection(reader, writer, files):
+    """Serve requests on one keep-alive connection until the client closes it"""
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method, url_path, version, headers = request
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+            status, response_headers, body, file_part = respond(files, method, url_path, headers)
+            response_headers['Date'] = formatdate(usegmt=True)
+            response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+            head = f'HTTP/1.1 {status}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in response_headers.items())
+            writer.write(head.encode('latin-1') + b'\r\n' + body)
+            await writer.drain()
+            if file_part and method != 'HEAD':
+                await send_file(writer, *file_part)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+def respond(files, method, url_path, headers):
+    """(status line, headers, small body, (path, start, length) or None) for one request"""
+    if method not in ('GET', 'HEAD'):
+        return '405 Method Not Allowed', {'Allow': 'GET, HEAD', 'Content-Length': '0'}, b'', None
+
+    path = files.resolve(url_path)
+    if path is None:
+        body = b'Not Found'
+        return '404 Not Found', {'Content-Type': 'text/plain', 'Content-Length': str(len(body))}, body, None
+
+    range_header = headers.get('range', '')
+    send_path, encoding = files.variant(path, headers.get('accept-encoding', ''), bool(range_header))
+    size = os.path.getsize(send_path)
+    etag = files.etag(send_path)
+
+    response_headers = {
+        'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        'ETag': etag,
+        'Cache-Control': files.cache_control,
+        'Accept-Ranges': 'bytes',
+        'Vary': 'Accept-Encoding'
+    }
+    if encoding:
+        response_headers['Content-Encoding'] = encoding
+
+    if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+        response_headers['Content-Length'] = '0'
+        return '304 Not Modified', response_headers, b'', None
+
+    byte_range = parse_range(range_header, size) if range_header else None
+    # A stale If-Range means the client's partial copy is out of date: send it all
+    if byte_range and headers.get('if-range', etag) != etag:
+        byte_range = None
+    if byte_range == 'invalid':
+        response_headers.update({'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+        return '416 Range Not Satisfiable', response_headers, b'', None
+    if byte_range:
+        start, end = byte_range
+        response_headers.update({'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': str(end - start + 1)})
+        return '206 Partial Content', response_headers, b'', (send_path, start, end - start + 1)
+
+    response_headers['Content-Length'] = str(size)
+    return '200 OK', response_headers, b'', (send_path, 0, size)
+
+async def serve(root='.', host='127.0.0.1', port=8000, max_age=0):
+    """Serve root over HTTP/1.1 until cancelled"""
+    files = StaticFiles(root, max_age)
+    server = await asyncio.start_server(lambda r, w: handle_connection(r, w, files), host, port,
+                                        limit=MAX_HEADER_BYTES, backlog=1024)
+    print(f"Serving {files.root} at http://{host}:{port}/")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the map and its data files with compression, ETags and ranges")
+    parser.add_argument('--root', default='.', help="Directory to serve (default: current directory)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-age', type=int, default=0,
+                        help="Cache-Control max-age in seconds (default 0: always revalidate by ETag)")
+    parser.add_argument('--precompress', action='store_true',
+                        help="Write .gz/.br variants of the data files under --root before serving")
+    parser.add_argument('--precompress-only', action='store_true', help="Write the variants and exit")
+    args = parser.parse_args()
+
+    if args.precompress or args.precompress_only:
+        precompress(args.root)
+    if not args.precompress_only:
+        try:
+            asyncio.run(serve(args.root, args.host, args.port, args.max_age))
+        except KeyboardInterrupt:
+            pass
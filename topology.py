@@ -0,0 +1,282 @@
+import os
+import json
+import argparse
+import numpy as np
+import geopandas as gpd
+import pandas as pd
+import shapely
+from tract_store import (find_legacy_files, geometry_filename, legacy_filename, topology_filename,
+                         write_json)
+
+# Grid size used to quantize coordinates: the metro bbox is split into this many
+# steps per axis, which keeps tract borders well under a meter apart at metro scale
+DEFAULT_QUANTIZATION = 100000
+
+def polygon_rings(geometry):
+    """Rings of a GeoJSON Polygon/MultiPolygon as a list of polygons of rings"""
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def quantize_ring(ring, translate, scale):
+    """Snap a ring to the integer grid, dropping the points that collapse together"""
+    points = np.rint((np.asarray(ring, dtype=float)[:, :2] - translate) / scale).astype(np.int64)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = [tuple(point) for point in points[keep].tolist()]
+
+    # Work on open rings; the closing point is implied
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+def find_junctions(rings):
+    """Points where rings stop sharing the same neighbors on both sides
+
+    A point that two tracts share keeps the same pair of neighbors (in either
+    direction) along a common border. Where the borders part ways, the pairs
+    differ and the point becomes a junction at which arcs are cut.
+    """
+    neighbors = {}
+    junctions = set()
+
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = (ring[i - 1], ring[(i + 1) % n])
+            seen = neighbors.get(point)
+            if seen is None:
+                neighbors[point] = pair
+            elif seen != pair and seen != (pair[1], pair[0]):
+                junctions.add(point)
+
+        # A point visited twice by one ring touches itself there
+        if len(set(ring)) != n:
+            counts = {}
+            for point in ring:
+                counts[point] = counts.get(point, 0) + 1
+            junctions.update(point for point, count in counts.items() if count > 1)
+
+    return junctions
+
+def canonical_closed_arc(ring):
+    """Rotate a junction-free ring to start at its smallest point so shared rings match"""
+    start = ring.index(min(ring))
+    rotated = ring[start:] + ring[:start]
+    return rotated + [rotated[0]]
+
+class ArcTable:
+    """Deduplicated arcs, looked up in both directions"""
+
+    def __init__(self):
+        self.arcs = []
+        self.index = {}
+
+    def add(self, points):
+        """Index of an arc, or ~index when it is an existing arc walked backwards"""
+        key = tuple(points)
+        if key in self.index:
+            return self.index[key]
+
+        # Reversing a canonical closed arc keeps its smallest point first, so one
+        # reversed lookup also matches rings walked in the opposite direction
+        reverse_key = key[::-1]
+        if reverse_key in self.index:
+            return ~self.index[reverse_key]
+
+        self.index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return self.index[key]
+
+def cut_ring(ring, junctions, arc_table):
+    """Split one open ring into shared arcs and return their indexes"""
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        return [arc_table.add(canonical_closed_arc(ring))]
+
+    # Start the ring at a junction so every arc runs junction to junction
+    ring = ring[cuts[0]:] + ring[:cuts[0]]
+    cuts = [i - cuts[0] for i in cuts] + [len(ring)]
+    ring = ring + [ring[0]]
+
+    return [arc_table.add(ring[start:end + 1]) for start, end in zip(cuts[:-1], cuts[1:])]
+
+def delta_encode(arc):
+    """First point absolute, every following point relative to the previous one"""
+    points = np.asarray(arc, dtype=np.int64)
+    deltas = np.empty_like(points)
+    deltas[0] = points[0]
+    deltas[1:] = points[1:] - points[:-1]
+    return deltas.tolist()
+
+def build_topology(features, quantization=DEFAULT_QUANTIZATION, object_name='tracts'):
+    """Build a TopoJSON topology with shared, quantized, delta-encoded arcs"""
+    polygons = [polygon_rings(feature['geometry']) for feature in features]
+
+    all_points = np.concatenate([np.asarray(ring, dtype=float)[:, :2]
+                                 for rings in polygons for polygon in rings for ring in polygon])
+    x0, y0 = all_points.min(axis=0)
+    x1, y1 = all_points.max(axis=0)
+    translate = np.array([x0, y0])
+    scale = np.array([(x1 - x0) / (quantization - 1) or 1.0,
+                      (y1 - y0) / (quantization - 1) or 1.0])
+
+    # Quantize everything first so junctions are found on the grid the arcs use
+    quantized = []
+    for rings in polygons:
+        quantized_polygons = []
+        for polygon in rings:
+            quantized_rings = [quantize_ring(ring, translate, scale) for ring in polygon]
+            # Rings that collapse below a triangle cannot be drawn at this precision
+            if quantized_rings and len(quantized_rings[0]) >= 3:
+                quantized_polygons.append([ring for ring in quantized_rings if len(ring) >= 3])
+        quantized.append(quantized_polygons)
+
+    junctions = find_junctions([ring for rings in quantized for polygon in rings for ring in polygon])
+    arc_table = ArcTable()
+
+    geometries = []
+    for feature, rings in zip(features, quantized):
+        arcs = [[cut_ring(ring, junctions, arc_table) for ring in polygon] for polygon in rings]
+        geometry = {'properties': feature['properties']}
+        if 'tract_geoid' in feature['properties']:
+            geometry['id'] = feature['properties']['tract_geoid']
+        if not arcs:
+            geometry['type'] = None
+        elif len(arcs) == 1:
+            geometry['type'] = 'Polygon'
+            geometry['arcs'] = arcs[0]
+        else:
+            geometry['type'] = 'MultiPolygon'
+            geometry['arcs'] = arcs
+        geometries.append(geometry)
+
+    return {
+        'type': 'Topology',
+        'bbox': [float(x0), float(y0), float(x1), float(y1)],
+        'transform': {'scale': scale.tolist(), 'translate': translate.tolist()},
+        'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': [delta_encode(arc) for arc in arc_table.arcs]
+    }
+
+def decode_arcs(topology):
+    """Absolute coordinates of every arc, undoing the delta encoding and quantization"""
+    scale = np.asarray(topology['transform']['scale'])
+    translate = np.asarray(topology['transform']['translate'])
+    if not topology['arcs']:
+        return []
+
+    # Decode every arc in one pass: a running sum over all arcs, minus the
+    # running total each arc starts from
+    lengths = np.array([len(arc) for arc in topology['arcs']])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    points = np.cumsum(np.concatenate([np.asarray(arc, dtype=np.int64) for arc in topology['arcs']]), axis=0)
+    before = np.zeros((len(lengths), 2), dtype=np.int64)
+    before[1:] = points[starts[1:] - 1]
+    points = (points - np.repeat(before, lengths, axis=0)) * scale + translate
+
+    return np.split(points, starts[1:])
+
+def stitch_ring(arc_indexes, arcs):
+    """Join a ring's arcs end to end, walking ~index arcs backwards"""
+    parts = []
+    for i, index in enumerate(arc_indexes):
+        arc = arcs[index] if index >= 0 else arcs[~index][::-1]
+        # Consecutive arcs share their junction point
+        parts.append(arc if i == 0 else arc[1:])
+    return np.concatenate(parts)
+
+def decode_topology(topology, object_name='tracts'):
+    """Decode a topology object back into GeoJSON features"""
+    arcs = decode_arcs(topology)
+    features = []
+
+    for geometry in topology['objects'][object_name]['geometries']:
+        if geometry.get('type') == 'Polygon':
+            decoded = {'type': 'Polygon',
+                       'coordinates': [stitch_ring(ring, arcs).tolist() for ring in geometry['arcs']]}
+        elif geometry.get('type') == 'MultiPolygon':
+            decoded = {'type': 'MultiPolygon',
+                       'coordinates': [[stitch_ring(ring, arcs).tolist() for ring in polygon]
+                                       for polygon in geometry['arcs']]}
+        else:
+            decoded = None
+        features.append({'type': 'Feature', 'properties': geometry.get('properties', {}),
+                         'geometry': decoded})
+
+    return features
+
+def decode_polygons(topology, object_name='tracts'):
+    """Decode a topology object straight into shapely polygons, skipping GeoJSON"""
+    arcs = decode_arcs(topology)
+    polygons = []
+
+    for geometry in topology['objects'][object_name]['geometries']:
+        if geometry.get('type') == 'Polygon':
+            rings = [stitch_ring(ring, arcs) for ring in geometry['arcs']]
+            polygons.append(shapely.Polygon(rings[0], rings[1:]))
+        elif geometry.get('type') == 'MultiPolygon':
+            parts = []
+            for polygon in geometry['arcs']:
+                rings = [stitch_ring(ring, arcs) for ring in polygon]
+                parts.append(shapely.Polygon(rings[0], rings[1:]))
+            polygons.append(shapely.MultiPolygon(parts))
+        else:
+            polygons.append(None)
+
+    return polygons
+
+def load_topology_geometry(code, object_name='tracts'):
+    """Load a CBSA's tract topology as a GeoDataFrame keyed by tract_geoid"""
+    with open(topology_filename(code), 'r') as f:
+        topology = json.load(f)
+
+    geometries = topology['objects'][object_name]['geometries']
+    if not geometries:
+        return gpd.GeoDataFrame(columns=['tract_geoid', 'geometry'], geometry='geometry', crs='EPSG:4326')
+
+    properties = pd.DataFrame([geometry.get('properties', {}) for geometry in geometries])
+    gdf = gpd.GeoDataFrame(properties, geometry=decode_polygons(topology, object_name), crs='EPSG:4326')
+    gdf['tract_geoid'] = gdf['tract_geoid'].astype(str)
+    return gdf
+
+def write_topology(code, quantization=DEFAULT_QUANTIZATION):
+    """Encode one CBSA's tract geometry as TopoJSON"""
+    source = geometry_filename(code)
+    if not os.path.exists(source):
+        # No geometry store yet: take the tracts from the first per-year file
+        source = legacy_filename(code, find_legacy_files()[code][0])
+    with open(source, 'r') as f:
+        features = json.load(f)['features']
+
+    topology = build_topology(features, quantization)
+    filename = topology_filename(code)
+    write_json(filename, topology)
+
+    print(f"  {code}: {len(features)} tracts -> {len(topology['arcs'])} arcs, "
+          f"{os.path.getsize(source) / 1e6:.2f} MB -> {os.path.getsize(filename) / 1e6:.2f} MB")
+
+def write_topologies(codes=None, quantization=DEFAULT_QUANTIZATION):
+    """Write a topology for every CBSA with tract data in the current directory"""
+    found = sorted(set(find_legacy_files()) |
+                   {f[len('tracts_'):-len('.geojson')] for f in os.listdir('.')
+                    if f.startswith('tracts_') and f.endswith('.geojson')})
+    if codes:
+        found = [code for code in found if code in codes]
+
+    print(f"Building tract topologies for {len(found)} CBSAs")
+    for code in found:
+        write_topology(code, quantization)
+    print("Topology export complete!")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode tract geometry as TopoJSON with shared arcs")
+    parser.add_argument('codes', nargs='*', help="CBSA codes to encode (default: all)")
+    parser.add_argument('-q', '--quantization', type=int, default=DEFAULT_QUANTIZATION,
+                        help="Grid steps per axis used to quantize coordinates")
+    args = parser.parse_args()
+    write_topologies(args.codes, args.quantization)
@@ -0,0 +1,266 @@
+import os
+import json
+import argparse
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from geo_io import read_geojson
+from tract_store import find_legacy_files, has_tract_year, load_tract_geometry, load_tract_year, tract_codes
+
+ARRAYS_DIR = 'arrays'
+OFFSET_NAMES = ['ring_offsets', 'part_offsets', 'geometry_offsets']
+
+def arrays_dirname(code, year=None):
+    """Directory of a metro's persisted tract arrays"""
+    return os.path.join(ARRAYS_DIR, f'tracts_{code}' + (f'_{year}' if year else ''))
+
+def column_array(values):
+    """A column as a plain NumPy array that can be saved and memory-mapped
+
+    Text becomes fixed-width unicode, so no column needs pickling.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float if values.isna().any() else None)
+    return values.fillna('').astype(str).to_numpy(dtype=str)
+
+class Tract:
+    """Lightweight view of one tract inside a TractArrays; holds no data of its own"""
+    __slots__ = ('arrays', 'index')
+
+    def __init__(self, arrays, index):
+        self.arrays = arrays
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.arrays.columns[column][self.index]
+
+    def __repr__(self):
+        geoid = self['tract_geoid'] if 'tract_geoid' in self.arrays.columns else self.index
+        return f'<Tract {geoid}>'
+
+    @property
+    def coords(self):
+        """(n, 2) view of this tract's coordinates, every ring closed"""
+        start, end = self.arrays.coordinate_range(self.index)
+        return self.arrays.coords[start:end]
+
+    @property
+    def geometry(self):
+        return self.arrays.geometries(self.index, self.index + 1)[0]
+
+class TractArrays:
+    """Tracts as flat arrays: one coordinate buffer, offset arrays and NumPy columns
+
+    The layout is shapely's ragged-array MultiPolygon encoding: coords holds
+    every ring's points (each ring closed), ring_offsets says where each ring
+    starts in coords, part_offsets where each polygon starts in the rings and
+    geometry_offsets where each tract starts in the polygons. A tract costs
+    16 bytes per point plus a few offsets instead of a GEOS object and a dict.
+    """
+
+    def __init__(self, coords, ring_offsets, part_offsets, geometry_offsets, columns=None, crs='EPSG:4326'):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.part_offsets = part_offsets
+        self.geometry_offsets = geometry_offsets
+        self.columns = dict(columns or {})
+        self.crs = crs
+
+    @classmethod
+    def from_geometries(cls, geometries, columns=None, crs='EPSG:4326'):
+        """Encode an array of (Multi)Polygons in one shapely call; missing geometries become empty"""
+        geometries = np.asarray(geometries, dtype=object)
+        columns = {name: column_array(values) for name, values in (columns or {}).items()}
+        if len(geometries) == 0:
+            empty = np.zeros(1, dtype=np.int64)
+            return cls(np.empty((0, 2)), empty, empty.copy(), empty.copy(), columns, crs)
+
+        geometry_type, coords, offsets = shapely.to_ragged_array(geometries)
+        if geometry_type == shapely.GeometryType.POLYGON:
+            # One part per tract, except missing or empty tracts, which get none:
+            # a part without rings is not a valid polygon
+            ring_offsets, part_offsets = offsets
+            has_part = np.diff(part_offsets) > 0
+            geometry_offsets = np.r_[0, np.cumsum(has_part)].astype(part_offsets.dtype)
+            part_offsets = np.r_[part_offsets[:-1][has_part], part_offsets[-1]].astype(part_offsets.dtype)
+            offsets = (ring_offsets, part_offsets, geometry_offsets)
+        elif geometry_type != shapely.GeometryType.MULTIPOLYGON:
+            raise ValueError(f"expected polygons, got {shapely.GeometryType(geometry_type).name}")
+        return cls(coords, *offsets, columns, crs)
+
+    @classmethod
+    def from_geodataframe(cls, gdf):
+        columns = {name: gdf[name] for name in gdf.columns if name != gdf.geometry.name}
+        crs = gdf.crs.to_string() if gdf.crs is not None else None
+        return cls.from_geometries(gdf.geometry.values, columns, crs)
+
+    @classmethod
+    def from_tracts(cls, code, year=None):
+        """A metro's tract geometry, with one year's attributes when year is given"""
+        if year is not None:
+            return cls.from_geodataframe(load_tract_year(code, year))
+        legacy = find_legacy_files()
+        return cls.from_geodataframe(load_tract_geometry(code, legacy.get(code, [None])[0]))
+
+    def __len__(self):
+        return len(self.geometry_offsets) - 1
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return Tract(self, index % len(self))
+
+    def __iter__(self):
+        return (Tract(self, i) for i in range(len(self)))
+
+    @property
+    def nbytes(self):
+        """Bytes held by the coordinate, offset and column arrays"""
+        arrays = [self.coords, self.ring_offsets, self.part_offsets, self.geometry_offsets]
+        return sum(array.nbytes for array in arrays + list(self.columns.values()))
+
+    def coordinate_range(self, index):
+        """(start, end) of one tract's points in coords"""
+        rings = self.part_offsets[self.geometry_offsets[[index, index + 1]]]
+        start, end = self.ring_offsets[rings]
+        return int(start), int(end)
+
+    def geometries(self, start=0, end=None):
+        """MultiPolygons of tracts start..end, built in one shapely call"""
+        end = len(self) if end is None else end
+        parts = self.geometry_offsets[start:end + 1]
+        rings = self.part_offsets[parts[0]:parts[-1] + 1]
+        points = self.ring_offsets[rings[0]:rings[-1] + 1]
+        return shapely.from_ragged_array(
+            shapely.GeometryType.MULTIPOLYGON, self.coords[points[0]:points[-1]],
+            (points - points[0], rings - rings[0], parts - parts[0]))
+
+    def to_geodataframe(self):
+        return gpd.GeoDataFrame(dict(self.columns), geometry=self.geometries(), crs=self.crs)
+
+    def _ring_ids(self):
+        """Ring of every point, and tract and exterior flag of every ring"""
+        ring_of_point = np.repeat(np.arange(len(self.ring_offsets) - 1), np.diff(self.ring_offsets))
+        part_of_ring = np.repeat(np.arange(len(self.part_offsets) - 1), np.diff(self.part_offsets))
+        tract_of_part = np.repeat(np.arange(len(self)), np.diff(self.geometry_offsets))
+        exterior = np.zeros(len(self.ring_offsets) - 1, dtype=bool)
+        exterior[self.part_offsets[:-1][np.diff(self.part_offsets) > 0]] = True
+        return ring_of_point, tract_of_part[part_of_ring], exterior
+
+    def _ring_moments(self):
+        """Signed area and first moments (about an origin) of every ring, over the whole buffer"""
+        ring_of_point, tract_of_ring, exterior = self._ring_ids()
+        # Coordinates relative to a nearby origin keep the cross products precise
+        origin = self.coords[0] if len(self.coords) else np.zeros(2)
+        x, y = self.coords[:-1, 0] - origin[0], self.coords[:-1, 1] - origin[1]
+        x1, y1 = self.coords[1:, 0] - origin[0], self.coords[1:, 1] - origin[1]
+        cross = x * y1 - x1 * y
+        # Only consecutive points of the same ring form an edge
+        cross[ring_of_point[:-1] != ring_of_point[1:]] = 0
+        rings = len(self.ring_offsets) - 1
+        edge_ring = ring_of_point[:-1]
+        area = np.bincount(edge_ring, cross, minlength=rings) / 2
+        mx = np.bincount(edge_ring, (x + x1) * cross, minlength=rings) / 6
+        my = np.bincount(edge_ring, (y + y1) * cross, minlength=rings) / 6
+        # Exteriors count positive and holes negative, whichever way they wind
+        sign = np.where(exterior, 1.0, -1.0) * np.sign(area)
+        return tract_of_ring, sign * area, sign * mx, sign * my, origin
+
+    def area(self):
+        """Planar area of every tract in coordinate units, holes subtracted"""
+        tract_of_ring, area, _, _, _ = self._ring_moments()
+        return np.bincount(tract_of_ring, area, minlength=len(self))
+
+    def centroid(self):
+        """(n, 2) area-weighted centroid of every tract, NaN for empty tracts"""
+        tract_of_ring, area, mx, my, origin = self._ring_moments()
+        total = np.bincount(tract_of_ring, area, minlength=len(self))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.column_stack([np.bincount(tract_of_ring, mx, minlength=len(self)) / total,
+                                    np.bincount(tract_of_ring, my, minlength=len(self)) / total]) + origin
+
+    def bounds(self):
+        """(n, 4) minx, miny, maxx, maxy of every tract, NaN for empty tracts"""
+        starts = self.ring_offsets[self.part_offsets[self.geometry_offsets]]
+        counts = np.diff(starts)
+        result = np.full((len(self), 4), np.nan)
+        nonempty = counts > 0
+        if nonempty.any() and len(self.coords):
+            lows = np.minimum.reduceat(self.coords, starts[:-1][nonempty], axis=0)
+            highs = np.maximum.reduceat(self.coords, starts[:-1][nonempty], axis=0)
+            result[nonempty] = np.hstack([lows, highs])
+        return result
+
+    def total_bounds(self):
+        if len(self.coords) == 0:
+            return np.full(4, np.nan)
+        return np.r_[self.coords.min(axis=0), self.coords.max(axis=0)]
+
+    def save(self, dirname):
+        """Write every array as .npy in a directory, plus the column names and CRS"""
+        os.makedirs(dirname, exist_ok=True)
+        np.save(os.path.join(dirname, 'coords.npy'), self.coords)
+        for name in OFFSET_NAMES:
+            np.save(os.path.join(dirname, f'{name}.npy'), getattr(self, name))
+        for i, values in enumerate(self.columns.values()):
+            np.save(os.path.join(dirname, f'column_{i}.npy'), values)
+        with open(os.path.join(dirname, 'meta.json'), 'w') as f:
+            json.dump({'columns': list(self.columns), 'crs': self.crs, 'tracts': len(self)}, f, indent=2)
+
+    @classmethod
+    def load(cls, dirname, mmap=True):
+        """Open saved arrays, memory-mapped by default so nothing is read until used"""
+        mode = 'r' if mmap else None
+        with open(os.path.join(dirname, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(dirname, f'{name}.npy'), mmap_mode=mode)
+                  for name in ['coords'] + OFFSET_NAMES]
+        columns = {name: np.load(os.path.join(dirname, f'column_{i}.npy'), mmap_mode=mode)
+                   for i, name in enumerate(meta['columns'])}
+        return cls(*arrays, columns, meta['crs'])
+
+def build_arrays(codes=None, year=None):
+    """Persist the tract arrays of every metro with tract geometry"""
+    for code in codes or tract_codes():
+        if year is not None and not has_tract_year(code, year):
+            continue
+        arrays = TractArrays.from_tracts(code, year)
+        dirname = arrays_dirname(code, year)
+        arrays.save(dirname)
+        print(f"Saved {dirname}/ ({len(arrays)} tracts, {len(arrays.coords)} points, "
+              f"{arrays.nbytes / 1e6:.1f} MB)")
+
+def convert_file(filename, dirname):
+    """Persist the polygons of any vector file (e.g. the CBSA shapefile) as arrays"""
+    gdf = read_geojson(filename)
+    arrays = TractArrays.from_geodataframe(gdf)
+    arrays.save(dirname)
+    print(f"Saved {dirname}/ ({len(arrays)} features, {arrays.nbytes / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store tracts as flat, memory-mappable coordinate and column arrays")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Write arrays/tracts_<cbsa>[_<year>]/ for every metro")
+    build.add_argument('codes', nargs='*', help="CBSA codes (default: all with tract data)")
+    build.add_argument('--year', type=int, help="Include this year's attributes")
+
+    convert = subparsers.add_parser('convert', help="Store the polygons of any vector file")
+    convert.add_argument('input', help="GeoJSON, shapefile or any other file GDAL reads")
+    convert.add_argument('output', help="Directory to write")
+
+    info = subparsers.add_parser('info', help="Summarize saved arrays")
+    info.add_argument('dirname')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_arrays(args.codes or None, args.year)
+    elif args.command == 'convert':
+        convert_file(args.input, args.output)
+    else:
+        arrays = TractArrays.load(args.dirname)
+        print(f"{len(arrays)} tracts, {len(arrays.coords)} points, {arrays.nbytes / 1e6:.1f} MB")
+        print(f"Columns: {', '.join(arrays.columns) or 'none'}")
+        print(f"Bounds: {arrays.total_bounds().round(4).tolist()}")
@@ -0,0 +1,193 @@
+import os
+import struct
+import argparse
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from geo_io import read_properties
+from tract_store import (find_legacy_files, has_geometry_store, legacy_filename,
+                         load_tract_attributes, load_tract_geometry, tract_codes)
+
+# Children per R-tree node in the packed index
+NODE_SIZE = 16
+# Tract GEOIDs are state (2) + county (3) + tract (6) digits
+GEOID_LENGTH = 11
+
+# Packed index header: flatbush's layout (magic byte, version 3 and array type
+# Float32Array, node size, item count), so the file also opens with Flatbush.from
+PACKED_MAGIC = 0xfb
+PACKED_VERSION_AND_TYPE = (3 << 4) | 7
+
+def index_filename(code):
+    """Packed R-tree of a metro's tracts, for hit-testing in the browser"""
+    return f'tract_index_{code}.bin'
+
+class TractIndex:
+    """STRtree over the tracts of one or more metros, for batch point-in-tract lookups"""
+
+    def __init__(self, codes=None):
+        legacy = find_legacy_files()
+        frames = []
+        for code in codes or tract_codes():
+            gdf = load_tract_geometry(code, legacy.get(code, [None])[0], columns=['tract_geoid'])
+            gdf['cbsa_code'] = code
+            frames.append(gdf[['tract_geoid', 'cbsa_code', 'geometry']])
+
+        tracts = pd.concat(frames, ignore_index=True)
+        tracts = tracts[~(tracts.geometry.isna() | tracts.geometry.is_empty)].reset_index(drop=True)
+        self.tracts = gpd.GeoDataFrame(tracts, geometry='geometry', crs='EPSG:4326')
+        self.tree = shapely.STRtree(self.tracts.geometry.values)
+        self._attributes = {}
+
+    def locate(self, lon, lat):
+        """Row positions in self.tracts of the tract containing each point, -1 where none does
+
+        A point on a shared border goes to the lowest-numbered tract it touches.
+        """
+        points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        if len(points) < len(self.tracts):
+            # Few points: look each one up in the tract tree
+            point_index, tract_index = self.tree.query(points, predicate='intersects')
+        else:
+            # Many points: index the points instead and query with every tract,
+            # which lets GEOS prepare each polygon once for all of its points
+            tract_index, point_index = shapely.STRtree(points).query(self.tracts.geometry.values,
+                                                                    predicate='intersects')
+        rows = np.full(len(points), -1, dtype=np.int64)
+        order = np.lexsort((tract_index, point_index))
+        point_index, tract_index = point_index[order], tract_index[order]
+        first = np.unique(point_index, return_index=True)[1]
+        rows[point_index[first]] = tract_index[first]
+        return rows
+
+    def tract_geoids(self, lon, lat):
+        """tract_geoid of the tract containing each point, None where no tract does"""
+        rows = self.locate(lon, lat)
+        geoids = self.tracts['tract_geoid'].to_numpy(dtype=object)[rows.clip(0)]
+        geoids[rows < 0] = None
+        return geoids
+
+    def year_attributes(self, code, year):
+        """One year's attribute table of a metro, indexed by tract_geoid"""
+        key = (code, year)
+        if key not in self._attributes:
+            if has_geometry_store(code):
+                attributes = load_tract_attributes(code, year)
+            else:
+                attributes = read_properties(legacy_filename(code, year))
+            self._attributes[key] = attributes.drop(columns=['cbsa_code', 'year'], errors='ignore') \
+                .set_index('tract_geoid')
+        return self._attributes[key]
+
+    def lookup(self, lon, lat, year, columns=None):
+        """DataFrame of lon, lat, tract_geoid, cbsa_code and the tract's attributes for one year"""
+        rows = self.locate(lon, lat)
+        found = rows >= 0
+        result = pd.DataFrame({'lon': np.asarray(lon, dtype=float), 'lat': np.asarray(lat, dtype=float)})
+        result['tract_geoid'] = None
+        result['cbsa_code'] = None
+        result.loc[found, 'tract_geoid'] = self.tracts['tract_geoid'].to_numpy()[rows[found]]
+        result.loc[found, 'cbsa_code'] = self.tracts['cbsa_code'].to_numpy()[rows[found]]
+
+        frames = []
+        for code, matches in result[found].groupby('cbsa_code'):
+            attributes = self.year_attributes(code, year)
+            if columns is not None:
+                attributes = attributes[[column for column in columns if column in attributes]]
+            frames.append(attributes.reindex(matches['tract_geoid']).set_axis(matches.index))
+        if frames:
+            result = result.join(pd.concat(frames))
+        return result
+
+def float32_bounds(bounds):
+    """Bounds rounded outward to float32, so no point inside a box falls outside it"""
+    low = bounds[:, :2].astype(np.float32)
+    high = bounds[:, 2:].astype(np.float32)
+    low = np.where(low > bounds[:, :2], np.nextafter(low, np.float32(-np.inf)), low)
+    high = np.where(high < bounds[:, 2:], np.nextafter(high, np.float32(np.inf)), high)
+    return np.hstack([low, high])
+
+def pack_hilbert_rtree(bounds, node_size=NODE_SIZE):
+    """Packed Hilbert R-tree of (minx, miny, maxx, maxy) rows: (boxes, indices)
+
+    Items are sorted along a Hilbert curve and grouped node_size at a time,
+    level by level up to one root. boxes holds every node's box, leaves first;
+    indices holds an item number for each leaf and, for each parent, the
+    position (in floats) of its first child in boxes, as flatbush lays it out.
+    """
+    count = len(bounds)
+    order = gpd.GeoSeries(shapely.box(*bounds.T)).hilbert_distance(level=16).argsort().to_numpy()
+
+    level_sizes = [count]
+    while level_sizes[-1] > 1 or len(level_sizes) == 1:
+        level_sizes.append(-(-level_sizes[-1] // node_size))
+    num_nodes = sum(level_sizes)
+
+    boxes = np.empty((num_nodes, 4), dtype=np.float32)
+    indices = np.empty(num_nodes, dtype=np.uint32)
+    boxes[:count] = float32_bounds(bounds[order])
+    indices[:count] = order
+
+    start = 0
+    for size, parents in zip(level_sizes, level_sizes[1:]):
+        children = boxes[start:start + size]
+        first_child = np.arange(0, size, node_size)
+        parent_at = start + size
+        boxes[parent_at:parent_at + parents, :2] = np.minimum.reduceat(children[:, :2], first_child)
+        boxes[parent_at:parent_at + parents, 2:] = np.maximum.reduceat(children[:, 2:], first_child)
+        indices[parent_at:parent_at + parents] = (start + first_child) * 4
+        start = parent_at
+
+    if num_nodes < 16384:
+        indices = indices.astype(np.uint16)
+    return boxes, indices
+
+def write_packed_index(code, filename=None):
+    """Write a metro's packed tract R-tree followed by the GEOID of each item"""
+    legacy = find_legacy_files()
+    tracts = load_tract_geometry(code, legacy.get(code, [None])[0], columns=['tract_geoid'])
+    tracts = tracts[~(tracts.geometry.isna() | tracts.geometry.is_empty)]
+    geoids = tracts['tract_geoid'].astype(str)
+    if (geoids.str.len() != GEOID_LENGTH).any():
+        raise ValueError(f"{code}: tract_geoid values must be {GEOID_LENGTH} characters")
+
+    boxes, indices = pack_hilbert_rtree(tracts.geometry.bounds.to_numpy())
+    filename = filename or index_filename(code)
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<BBHI', PACKED_MAGIC, PACKED_VERSION_AND_TYPE, NODE_SIZE, len(tracts)))
+        f.write(boxes.astype('<f4').tobytes())
+        f.write(indices.astype(indices.dtype.newbyteorder('<')).tobytes())
+        f.write(''.join(geoids).encode('ascii'))
+
+    print(f"Saved {filename} ({len(tracts)} tracts, {os.path.getsize(filename) / 1e3:.1f} KB)")
+
+def locate_csv(input_file, output_file, year, lon_column='lon', lat_column='lat'):
+    """Add the tract and its attributes for one year to every row of a CSV of points"""
+    points = pd.read_csv(input_file)
+    index = TractIndex()
+    found = index.lookup(points[lon_column], points[lat_column], year)
+    result = points.join(found.drop(columns=['lon', 'lat']))
+    result.to_csv(output_file, index=False)
+    print(f"Located {result['tract_geoid'].notna().sum()} of {len(result)} points, saved to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build packed tract indexes or locate points in tracts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Write tract_index_<cbsa>.bin for the browser")
+    build.add_argument('codes', nargs='*', help="CBSA codes (default: all with tract data)")
+
+    locate = subparsers.add_parser('locate', help="Find the tract of every point in a CSV")
+    locate.add_argument('input', help="CSV with lon and lat columns")
+    locate.add_argument('output', help="CSV to write")
+    locate.add_argument('--year', type=int, required=True, help="Year of the tract attributes")
+    locate.add_argument('--lon-column', default='lon')
+    locate.add_argument('--lat-column', default='lat')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for code in args.codes or tract_codes():
+            write_packed_index(code)
+    else:
+        locate_csv(args.input, args.output, args.year, args.lon_column, args.lat_column)
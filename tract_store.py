@@ -0,0 +1,206 @@
+import os
+import re
+import glob
+import json
+import argparse
+import pandas as pd
+import shapely
+from geo_io import read_geojson, read_properties
+
+# Properties that change from year to year; everything else (besides 'year')
+# describes the tract itself and is stored once with its geometry
+ATTRIBUTE_COLUMNS = ['white_rate', 'black_rate', 'gap', 'white_total', 'black_total']
+
+LEGACY_PATTERN = re.compile(r'^metro_tracts_(\d+)_(\d{4})\.geojson$')
+
+def legacy_filename(code, year):
+    """Original per-year tract file holding geometry and attributes together"""
+    return f'metro_tracts_{code}_{year}.geojson'
+
+def geometry_filename(code):
+    """Tract geometry for one CBSA, shared by every year"""
+    return f'tracts_{code}.geojson'
+
+def attributes_filename(code, year):
+    """Compact column table of one year's tract attributes"""
+    return f'tract_attrs_{code}_{year}.json'
+
+def topology_filename(code):
+    """TopoJSON encoding of a CBSA's tract geometry, written by topology.py"""
+    return f'tracts_{code}.topo.json'
+
+def has_geometry_store(code):
+    """Whether a CBSA's geometry is stored once for all years"""
+    return os.path.exists(topology_filename(code)) or os.path.exists(geometry_filename(code))
+
+def has_tract_year(code, year):
+    """Whether tract data exists for a CBSA and year in either layout"""
+    if has_geometry_store(code) and os.path.exists(attributes_filename(code, year)):
+        return True
+    return os.path.exists(legacy_filename(code, year))
+
+def tract_sources(code, year):
+    """Files load_tract_year reads for a CBSA and year"""
+    if has_geometry_store(code) and os.path.exists(attributes_filename(code, year)):
+        geometry = topology_filename(code)
+        if not os.path.exists(geometry):
+            geometry = geometry_filename(code)
+        return [geometry, attributes_filename(code, year)]
+    return [legacy_filename(code, year)]
+
+def select_columns(frame, columns):
+    """Keep tract_geoid, the requested columns that exist, and any geometry"""
+    keep = ['tract_geoid'] + [column for column in columns if column not in ('tract_geoid', 'geometry')]
+    keep = [column for column in keep if column in frame]
+    if 'geometry' in frame:
+        keep.append('geometry')
+    return frame[keep]
+
+def load_tract_geometry(code, year=None, columns=None, bbox=None):
+    """Load the tract geometry of a CBSA as a GeoDataFrame keyed by tract_geoid
+
+    Prefers the shared-border topology, then the geometry store. Falls back to
+    the per-year file for `year` when neither exists, in which case the year's
+    attribute columns come along too. columns limits the attribute columns
+    (tract_geoid is always kept) and bbox keeps only tracts that intersect it.
+    """
+    if columns is not None and 'tract_geoid' not in columns:
+        columns = ['tract_geoid'] + list(columns)
+
+    if os.path.exists(topology_filename(code)):
+        # Imported here because topology.py builds on this module's loaders
+        from topology import load_topology_geometry
+        gdf = load_topology_geometry(code)
+        if bbox is not None:
+            gdf = gdf[gdf.intersects(shapely.box(*bbox))]
+        if columns is not None:
+            gdf = select_columns(gdf, columns)
+        return gdf
+
+    filename = geometry_filename(code)
+    if not os.path.exists(filename):
+        filename = legacy_filename(code, year)
+
+    gdf = read_geojson(filename, columns=columns, bbox=bbox)
+    if 'tract_geoid' not in gdf:
+        gdf['tract_geoid'] = pd.Series(dtype=str)
+    gdf['tract_geoid'] = gdf['tract_geoid'].astype(str)
+    return gdf
+
+def load_tract_attributes(code, year, columns=None):
+    """Load one year's tract attributes as a DataFrame without building any geometry"""
+    filename = attributes_filename(code, year)
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            table = json.load(f)
+        attributes = pd.DataFrame(table['columns'])
+        attributes['year'] = table['year']
+    else:
+        # Per-year layout: only the properties are needed, so skip geometry entirely
+        attributes = read_properties(legacy_filename(code, year))
+
+    if 'tract_geoid' in attributes:
+        attributes['tract_geoid'] = attributes['tract_geoid'].astype(str)
+    if columns is not None:
+        attributes = select_columns(attributes, columns)
+    return attributes
+
+def load_tract_year(code, year, columns=None, bbox=None):
+    """Load one year of tracts with geometry and attributes joined on tract_geoid"""
+    if not has_geometry_store(code):
+        return load_tract_geometry(code, year, columns=columns, bbox=bbox)
+
+    geometry = load_tract_geometry(code, bbox=bbox)
+    attributes = load_tract_attributes(code, year)
+    # Keep the geometry file's tract order so every year draws in the same order
+    gdf = geometry.merge(attributes, on='tract_geoid', how='inner')
+    if columns is not None:
+        gdf = select_columns(gdf, columns)
+    return gdf
+
+def find_legacy_files():
+    """Map each CBSA code to the years it has per-year tract files for"""
+    found = {}
+    for filename in sorted(os.listdir('.')):
+        match = LEGACY_PATTERN.match(filename)
+        if match:
+            found.setdefault(match.group(1), []).append(int(match.group(2)))
+    return found
+
+def tract_codes():
+    """CBSA codes that have tract geometry in any layout"""
+    codes = set(find_legacy_files())
+    codes.update(os.path.basename(f).split('.')[0][len('tracts_'):] for f in glob.glob('tracts_*.geojson'))
+    codes.update(os.path.basename(f).split('.')[0][len('tracts_'):] for f in glob.glob('tracts_*.topo.json'))
+    return sorted(codes)
+
+def write_json(filename, data):
+    """Write compact JSON through a temp file so readers never see a partial file"""
+    temp_filename = f'{filename}.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(temp_filename, filename)
+
+def convert_cbsa(code, years):
+    """Split one CBSA's per-year tract files into a geometry file plus attribute tables"""
+    features = {}
+    order = []
+
+    for year in sorted(years):
+        with open(legacy_filename(code, year), 'r') as f:
+            geojson_data = json.load(f)
+
+        columns = {'tract_geoid': []}
+        columns.update({column: [] for column in ATTRIBUTE_COLUMNS})
+
+        for feature in geojson_data['features']:
+            properties = feature['properties']
+            geoid = str(properties['tract_geoid'])
+
+            if geoid not in features:
+                static = {key: value for key, value in properties.items()
+                          if key not in ATTRIBUTE_COLUMNS and key != 'year'}
+                static['tract_geoid'] = geoid
+                features[geoid] = {'type': 'Feature', 'properties': static,
+                                   'geometry': feature['geometry']}
+                order.append(geoid)
+            elif features[geoid]['geometry'] != feature['geometry']:
+                print(f"  Warning: tract {geoid} geometry differs in {year}, keeping the first one")
+
+            columns['tract_geoid'].append(geoid)
+            for column in ATTRIBUTE_COLUMNS:
+                columns[column].append(properties.get(column))
+
+        write_json(attributes_filename(code, year), {'cbsa_code': code, 'year': year, 'columns': columns})
+
+    write_json(geometry_filename(code), {
+        'type': 'FeatureCollection',
+        'name': f'tracts_{code}',
+        'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'}},
+        'features': [features[geoid] for geoid in order]
+    })
+
+    legacy_size = sum(os.path.getsize(legacy_filename(code, year)) for year in years)
+    store_size = os.path.getsize(geometry_filename(code)) + \
+        sum(os.path.getsize(attributes_filename(code, year)) for year in years)
+    attribute_size = max(os.path.getsize(attributes_filename(code, year)) for year in years)
+    print(f"  {code}: {len(order)} tracts, {len(years)} years, "
+          f"{legacy_size / 1e6:.1f} MB -> {store_size / 1e6:.1f} MB "
+          f"(largest year table {attribute_size / 1e3:.0f} KB)")
+
+def convert_tract_files(codes=None):
+    """Convert every per-year tract file in the current directory to the geometry store"""
+    found = find_legacy_files()
+    if codes:
+        found = {code: years for code, years in found.items() if code in codes}
+
+    print(f"Converting tract files for {len(found)} CBSAs")
+    for code, years in found.items():
+        convert_cbsa(code, years)
+    print("Tract store conversion complete!")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write tract geometry once per CBSA plus per-year attribute tables")
+    parser.add_argument('codes', nargs='*', help="CBSA codes to convert (default: all)")
+    args = parser.parse_args()
+    convert_tract_files(args.codes)
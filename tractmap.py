@@ -0,0 +1,360 @@
+import os
+import ast
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+
+# Only the standard library is imported up front: --help and builds with
+# nothing to do never load GeoPandas, matplotlib or requests. Each step
+# imports its script when it runs.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = '.tractmap-build.json'
+
+TRACT_FILES = ['metro_tracts_*.geojson', 'tracts_*.geojson', 'tracts_*.topo.json', 'tract_attrs_*.json']
+
+# The build graph. code lists the scripts a step runs (relative to this file),
+# which count together with every local module they import, and inputs lists
+# data globs (relative to the data directory); a step is stale when the size or
+# modification time of any of them differs from its last successful run, or
+# when none of its outputs exist. Fetch steps (external data) are only stale
+# when their outputs are missing, so a build never replaces fetched layers.
+STEPS = {
+    'landmarks': {
+        'deps': [], 'fetch': True,
+        'code': ['add_landmarks_to_maps.py'], 'inputs': [],
+        'outputs': ['landmarks_*.geojson']
+    },
+    'context': {
+        'deps': [], 'fetch': True,
+        'code': ['add_water_parks_to_maps.py'], 'inputs': [],
+        'outputs': ['water_parks_*.geojson']
+    },
+    'fix-crs': {
+        'deps': [],
+        'code': ['fix_geojson_crs.py'], 'inputs': ['metro_tracts_*.geojson'],
+        'outputs': []
+    },
+    'svg': {
+        'deps': ['context', 'fix-crs'],
+        'code': ['export_metro_maps.py'],
+        'inputs': TRACT_FILES + ['water_parks_*.geojson', 'context/*.geojson', 'gap_classes.json'],
+        'outputs': ['metro-areas/*.svg']
+    },
+    'atlas': {
+        'deps': ['context', 'landmarks', 'fix-crs'],
+        'code': ['card_atlas.py'],
+        'inputs': TRACT_FILES + ['water_parks_*.geojson', 'landmarks_*.geojson', 'gap_classes.json'],
+        'outputs': ['atlas/cards.json']
+    },
+    'hex': {
+        'deps': ['fix-crs'],
+        'code': ['hex_grid.py'],
+        'inputs': TRACT_FILES + ['gap_classes.json'],
+        'outputs': ['hex_*_r*.json']
+    },
+    'package': {
+        'deps': ['svg', 'atlas', 'hex'],
+        'code': ['serve.py'],
+        'inputs': TRACT_FILES + ['*.geojson', '*.json', '*.bin', '*.csv', 'atlas/*.json', 'metro-areas/*.svg'],
+        'outputs': ['*.json.gz']
+    }
+}
+
+def run_landmarks(options):
+    from add_landmarks_to_maps import create_landmarks_geojson
+    create_landmarks_geojson()
+
+def run_context(options):
+    from add_water_parks_to_maps import fetch_water_parks
+    fetch_water_parks(options.get('osm', False), options.get('fake_overpass', False),
+                      options.get('overpass_url'), options.get('concurrency'), options.get('min_interval'),
+                      options.get('cache_dir'), options.get('cache_ttl'), options.get('no_cache', False))
+
+def run_fix_crs(options):
+    from fix_geojson_crs import fix_geojson_crs
+    counts = fix_geojson_crs(options.get('files') or None, options.get('workers', 0),
+                             options.get('check', False), options.get('full', False))
+    if counts.get('error'):
+        raise RuntimeError(f"{counts['error']} files could not be fixed")
+
+def run_svg(options):
+    from export_metro_maps import main
+    results = main(years=options.get('years'), workers=options.get('workers', 1),
+                   reuse_figure=not options.get('per_year', False), force=options.get('force', False),
+                   profile=options.get('profile', False), image_format=options.get('format', 'svg'),
+                   compact=not options.get('plain_svg', False), shard=options.get('shard'))
+    failed = [result for result in results if result['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f"{len(failed)} maps failed")
+
+def run_atlas(options):
+    from card_atlas import build_atlas
+    build_atlas(options.get('years'), options.get('workers', 1))
+
+def run_hex(options):
+    from hex_grid import build_all
+    build_all()
+
+def run_package(options):
+    from serve import precompress
+    precompress('.', force=options.get('force', False))
+
+RUNNERS = {
+    'landmarks': run_landmarks,
+    'context': run_context,
+    'fix-crs': run_fix_crs,
+    'svg': run_svg,
+    'atlas': run_atlas,
+    'hex': run_hex,
+    'package': run_package
+}
+
+def matching_files(patterns, base='.'):
+    """Sorted files matching any of the glob patterns under base"""
+    files = set()
+    for pattern in patterns:
+        files.update(path for path in glob.glob(os.path.join(base, pattern)) if os.path.isfile(path))
+    return sorted(files)
+
+def local_imports(filename):
+    """Modules of this repository that a script imports anywhere, as filenames under ROOT"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return {f'{name}.py' for name in names if os.path.isfile(os.path.join(ROOT, f'{name}.py'))}
+
+def code_files(step):
+    """A step's scripts and every local module they import, directly or not"""
+    files = set()
+    pending = list(STEPS[step]['code'])
+    while pending:
+        name = pending.pop()
+        if name not in files and os.path.isfile(os.path.join(ROOT, name)):
+            files.add(name)
+            pending.extend(local_imports(os.path.join(ROOT, name)) - files)
+    return sorted(files)
+
+def fingerprint(step):
+    """Hash of the size and modification time of every code and input file of a step"""
+    digest = hashlib.sha256()
+    files = [os.path.join(ROOT, name) for name in code_files(step)] + matching_files(STEPS[step]['inputs'])
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        digest.update(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    """Write the build state through a temp file so an interrupted build never leaves half of it"""
+    temp_filename = f'{STATE_FILE}.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(temp_filename, STATE_FILE)
+
+def is_stale(step, state):
+    """Whether a step has to run, and why"""
+    spec = STEPS[step]
+    if spec['outputs'] and not matching_files(spec['outputs']):
+        return True, "no outputs yet"
+    if spec.get('fetch'):
+        return False, "outputs exist"
+    if state.get(step) != fingerprint(step):
+        return True, "inputs changed" if step in state else "never built"
+    return False, "up to date"
+
+def upstream(target):
+    """The target and every step it depends on, dependencies first"""
+    order = []
+    def visit(step):
+        for dep in STEPS[step]['deps']:
+            visit(dep)
+        if step not in order:
+            order.append(step)
+    visit(target)
+    return order
+
+def run_step(step, options):
+    """Run one step; used in worker processes, so it returns (step, seconds) or raises"""
+    start = time.perf_counter()
+    RUNNERS[step](options)
+    return step, time.perf_counter() - start
+
+def build(target, jobs=1, force=False, dry_run=False, options=None):
+    """Run the stale steps the target depends on, independent ones in parallel
+
+    Staleness is decided when a step's dependencies have finished, so a
+    dependency that rewrote its outputs makes the steps after it stale.
+    """
+    options = options or {}
+    steps = upstream(target)
+    state = load_state()
+    done, failed = set(), set()
+    ran = 0
+
+    def ready(step):
+        return all(dep in done for dep in STEPS[step]['deps'])
+
+    def blocked(step):
+        return any(dep in failed for dep in STEPS[step]['deps'])
+
+    def should_run(step):
+        stale, reason = (True, "forced") if force else is_stale(step, state)
+        print(f"  {step}: {reason}" + ((", would run" if dry_run else ", running") if stale else ""))
+        if not stale or dry_run:
+            done.add(step)
+            return False
+        return True
+
+    def finish(step, seconds=0.0, error=None):
+        nonlocal ran
+        if error is not None:
+            print(f"  {step}: FAILED ({type(error).__name__}: {error})")
+            failed.add(step)
+            return
+        print(f"  {step}: done in {seconds:.1f}s")
+        state[step] = fingerprint(step)
+        save_state(state)
+        done.add(step)
+        ran += 1
+
+    def skip(step):
+        print(f"  {step}: skipped, a dependency failed")
+        failed.add(step)
+
+    print(f"Building {target} ({' -> '.join(steps)})")
+    if jobs == 1 or dry_run:
+        for step in steps:
+            if blocked(step):
+                skip(step)
+            elif should_run(step):
+                try:
+                    finish(*run_step(step, options))
+                except Exception as e:
+                    finish(step, error=e)
+    else:
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        pending, running = list(steps), {}
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                for step in list(pending):
+                    if blocked(step):
+                        pending.remove(step)
+                        skip(step)
+                    elif ready(step):
+                        pending.remove(step)
+                        if should_run(step):
+                            running[executor.submit(run_step, step, options)] = step
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        finish(*future.result())
+                    except Exception as e:
+                        finish(step, error=e)
+
+    if failed:
+        print(f"Build of {target} failed: {', '.join(sorted(failed))}")
+        return False
+    print(f"Build of {target} complete ({ran} steps run)")
+    return True
+
+def run_command(step, options):
+    """Run one step unconditionally, as its subcommand does, and record it for later builds"""
+    seconds = run_step(step, options)[1]
+    state = load_state()
+    state[step] = fingerprint(step)
+    save_state(state)
+    print(f"{step} done in {seconds:.1f}s")
+
+def add_export_options(parser):
+    parser.add_argument('--years', type=int, nargs='+', help="Years to render (default: 2018-2024)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Worker processes inside the step (0 = one per CPU core)")
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='tractmap', description="Build the tract map data, maps and site files")
+    parser.add_argument('-C', '--data-dir', default='.',
+                        help="Directory holding the data files (default: current directory)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    context = commands.add_parser('context', help="Write water/park layers (synthetic, or fetched from Overpass)")
+    context.add_argument('--osm', action='store_true', help="Fetch features from the Overpass API")
+    context.add_argument('--fake-overpass', action='store_true', help="Fetch from a local fake Overpass server")
+    context.add_argument('--overpass-url')
+    context.add_argument('--concurrency', type=int, help="Queries in flight at once")
+    context.add_argument('--min-interval', type=float, help="Seconds between the starts of two queries")
+    context.add_argument('--cache-dir')
+    context.add_argument('--cache-ttl', type=float, help="Cache lifetime in hours")
+    context.add_argument('--no-cache', action='store_true', help="Always query the server")
+
+    commands.add_parser('landmarks', help="Write the landmark layers")
+
+    fix_crs = commands.add_parser('fix-crs', help="Check and fix the CRS of GeoJSON files")
+    fix_crs.add_argument('files', nargs='*', help="Files to process (default: metro_tracts_*.geojson)")
+    fix_crs.add_argument('-w', '--workers', type=int, default=0, help="Files processed at once (0 = one per core)")
+    fix_crs.add_argument('--check', action='store_true', help="Report files without a CRS, change nothing")
+    fix_crs.add_argument('--full', action='store_true', help="Decode and rewrite whole files")
+
+    export = commands.add_parser('export', help="Export the metro maps as SVG (or raster thumbnails)")
+    add_export_options(export)
+    export.add_argument('--per-year', action='store_true', help="Rebuild the whole figure for every year")
+    export.add_argument('--force', action='store_true', help="Re-render maps whose inputs are unchanged")
+    export.add_argument('--profile', action='store_true', help="Write a per-stage profile report")
+    export.add_argument('--format', choices=['svg', 'png', 'webp'], default='svg')
+    export.add_argument('--plain-svg', action='store_true', help="Full-precision SVGs, one path per tract")
+    export.add_argument('--shard', metavar='I/N', help="Render only shard I of N (merge with export_shards.py)")
+
+    commands.add_parser('hex', help="Aggregate tract counts onto the hexagon overview grids")
+
+    package = commands.add_parser('package', help="Precompress the data files for serving")
+    package.add_argument('--force', action='store_true', help="Rewrite variants that are up to date")
+
+    build_parser = commands.add_parser('build', help="Run the stale steps a target depends on")
+    build_parser.add_argument('--target', choices=list(STEPS), default='package')
+    build_parser.add_argument('-j', '--jobs', type=int, default=1, help="Independent steps run at once")
+    build_parser.add_argument('--force', action='store_true', help="Run every step, stale or not")
+    build_parser.add_argument('-n', '--dry-run', action='store_true', help="Show what would run")
+    add_export_options(build_parser)
+    return parser
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    os.chdir(args.data_dir)
+    # Steps import the scripts next to this file, whatever the data directory
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    options = {key: value for key, value in vars(args).items() if key not in ('command', 'data_dir')}
+    if options.get('shard'):
+        # Parsed here so --help never imports the exporter's dependencies
+        from export_shards import parse_shard
+        options['shard'] = parse_shard(options['shard'])
+    if args.command == 'build':
+        # --force re-runs the steps; the steps themselves still skip fresh outputs
+        options.pop('force')
+        return 0 if build(args.target, args.jobs, args.force, args.dry_run, options) else 1
+    run_command({'export': 'svg'}.get(args.command, args.command), options)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import os
+import glob
+import gzip
+import math
+import argparse
+import geopandas as gpd
+import pandas as pd
+import shapely
+import mapbox_vector_tile
+from pmtiles.tile import Compression, TileType, zxy_to_tileid
+from pmtiles.writer import write
+from geo_io import read_geojson
+from tract_store import find_legacy_files, load_tract_geometry, tract_codes
+
+# Web Mercator extent and MVT grid
+WORLD_SIZE = 2 * math.pi * 6378137
+TILE_EXTENT = 4096
+# Extra margin around each tile, in tile units, so strokes don't stop at tile edges
+TILE_BUFFER = 64
+# Geometry is simplified to this many tile units at every zoom level
+SIMPLIFY_UNITS = 4
+
+DEFAULT_MIN_ZOOM = 4
+DEFAULT_MAX_ZOOM = 12
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of a tile"""
+    size = WORLD_SIZE / 2 ** z
+    minx = -WORLD_SIZE / 2 + x * size
+    maxy = WORLD_SIZE / 2 - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+def tiles_covering(bounds, z):
+    """All (x, y) tiles at zoom z that touch the given Web Mercator bounds"""
+    size = WORLD_SIZE / 2 ** z
+    last = 2 ** z - 1
+    minx, miny, maxx, maxy = bounds
+    x0 = min(max(int((minx + WORLD_SIZE / 2) // size), 0), last)
+    x1 = min(max(int((maxx + WORLD_SIZE / 2) // size), 0), last)
+    y0 = min(max(int((WORLD_SIZE / 2 - maxy) // size), 0), last)
+    y1 = min(max(int((WORLD_SIZE / 2 - miny) // size), 0), last)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+def read_geojson_layer(pattern, columns):
+    """Concatenate every GeoJSON file matching a pattern into one Web Mercator layer"""
+    frames = []
+    for filename in sorted(glob.glob(pattern)):
+        gdf = read_geojson(filename)
+        if gdf.empty:
+            continue
+        gdf = gdf[[column for column in columns if column in gdf] + ['geometry']]
+        frames.append(gdf.set_crs('EPSG:4326', allow_override=True))
+
+    if not frames:
+        return gpd.GeoDataFrame(columns=columns + ['geometry'], geometry='geometry', crs='EPSG:3857')
+    layer = pd.concat(frames, ignore_index=True)
+    layer = layer[~(layer.geometry.isna() | layer.geometry.is_empty)]
+    return gpd.GeoDataFrame(layer, geometry='geometry').to_crs('EPSG:3857')
+
+def load_tract_layer():
+    """Tract geometry of every metro in the current directory, keyed by tract_geoid"""
+    frames = []
+    legacy = find_legacy_files()
+    for code in tract_codes():
+        gdf = load_tract_geometry(code, legacy.get(code, [None])[0])
+        gdf['cbsa_code'] = code
+        frames.append(gdf[['tract_geoid', 'cbsa_code', 'geometry']])
+
+    tracts = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), geometry='geometry')
+    return tracts.set_crs('EPSG:4326', allow_override=True).to_crs('EPSG:3857')
+
+def simplify_layer(gdf, tolerance, coverage=False):
+    """Simplify a layer for one zoom level, keeping shared tract borders shared"""
+    geometries = gdf.geometry.values
+    if coverage:
+        try:
+            # Simplifies each shared border once, so neighbors never pull apart
+            simplified = shapely.coverage_simplify(geometries, tolerance)
+        except shapely.errors.GEOSException:
+            simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    else:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+    gdf = gdf.copy()
+    gdf['geometry'] = simplified
+    return gdf[~gdf.geometry.is_empty]
+
+def encode_tile(layers, bounds):
+    """Clip every layer to a tile and encode the result as a gzipped MVT, or None if empty"""
+    size = bounds[2] - bounds[0]
+    margin = size * TILE_BUFFER / TILE_EXTENT
+    clip_box = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+
+    encoded_layers = []
+    for name, (gdf, tree) in layers.items():
+        hits = tree.query(shapely.box(*clip_box))
+        if len(hits) == 0:
+            continue
+
+        hits.sort()
+        clipped = shapely.clip_by_rect(gdf.geometry.values[hits], *clip_box)
+        properties = gdf.drop(columns='geometry').iloc[hits].to_dict('records')
+
+        features = [{'geometry': geometry, 'properties': {k: v for k, v in props.items() if pd.notna(v)}}
+                    for geometry, props in zip(clipped, properties) if not geometry.is_empty]
+        if features:
+            encoded_layers.append({'name': name, 'features': features})
+
+    if not encoded_layers:
+        return None
+
+    tile = mapbox_vector_tile.encode(encoded_layers, default_options={
+        'quantize_bounds': bounds, 'extents': TILE_EXTENT})
+    return gzip.compress(tile, mtime=0)
+
+def build_vector_tiles(output='tractmap.pmtiles', min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM):
+    """Build a z/x/y pyramid of tract, water/park and landmark tiles in one PMTiles archive"""
+    source_layers = {
+        'tracts': (load_tract_layer(), True),
+        'water_parks': (read_geojson_layer('water_parks_*.geojson', ['name', 'type']), False),
+        'landmarks': (read_geojson_layer('landmarks_*.geojson', ['name', 'type']), False)
+    }
+    for name, (gdf, _) in source_layers.items():
+        print(f"  {name}: {len(gdf)} features")
+
+    # Only tiles around each metro's tracts and each context feature are built,
+    # not the whole world at every zoom
+    tracts = source_layers['tracts'][0]
+    tract_bounds = tracts.bounds.groupby(tracts['cbsa_code']).agg(
+        {'minx': 'min', 'miny': 'min', 'maxx': 'max', 'maxy': 'max'})
+    feature_bounds = [tuple(b) for b in tract_bounds.values]
+    for name in ['water_parks', 'landmarks']:
+        feature_bounds.extend(tuple(b) for b in source_layers[name][0].bounds.values)
+    extents = [tuple(gdf.total_bounds) for gdf, _ in source_layers.values() if not gdf.empty]
+
+    tiles = {}
+    for z in range(min_zoom, max_zoom + 1):
+        tolerance = WORLD_SIZE / 2 ** z / TILE_EXTENT * SIMPLIFY_UNITS
+        layers = {}
+        for name, (gdf, coverage) in source_layers.items():
+            if gdf.empty:
+                continue
+            simplified = simplify_layer(gdf, tolerance, coverage).reset_index(drop=True)
+            layers[name] = (simplified, shapely.STRtree(simplified.geometry.values))
+
+        candidates = set()
+        for bounds in feature_bounds:
+            candidates.update(tiles_covering(bounds, z))
+
+        count = 0
+        for x, y in sorted(candidates):
+            data = encode_tile(layers, tile_bounds(z, x, y))
+            if data:
+                tiles[zxy_to_tileid(z, x, y)] = data
+                count += 1
+        print(f"  zoom {z}: {count} tiles")
+
+    # Header bounds in degrees
+    lon_lat = gpd.GeoSeries([shapely.box(*b) for b in extents], crs='EPSG:3857').to_crs('EPSG:4326')
+    min_lon, min_lat, max_lon, max_lat = lon_lat.total_bounds
+
+    with write(output) as writer:
+        # PMTiles wants tiles in tile id order so the archive stays clustered
+        for tile_id in sorted(tiles):
+            writer.write_tile(tile_id, tiles[tile_id])
+        writer.finalize({
+            'tile_type': TileType.MVT,
+            'tile_compression': Compression.GZIP,
+            'min_zoom': min_zoom,
+            'max_zoom': max_zoom,
+            'min_lon_e7': int(min_lon * 1e7),
+            'min_lat_e7': int(min_lat * 1e7),
+            'max_lon_e7': int(max_lon * 1e7),
+            'max_lat_e7': int(max_lat * 1e7),
+            'center_zoom': min_zoom,
+            'center_lon_e7': int((min_lon + max_lon) / 2 * 1e7),
+            'center_lat_e7': int((min_lat + max_lat) / 2 * 1e7)
+        }, {
+            'name': 'tractmap',
+            'format': 'pbf',
+            'vector_layers': [
+                {'id': 'tracts', 'fields': {'tract_geoid': 'String', 'cbsa_code': 'String'},
+                 'minzoom': min_zoom, 'maxzoom': max_zoom},
+                {'id': 'water_parks', 'fields': {'name': 'String', 'type': 'String'},
+                 'minzoom': min_zoom, 'maxzoom': max_zoom},
+                {'id': 'landmarks', 'fields': {'name': 'String', 'type': 'String'},
+                 'minzoom': min_zoom, 'maxzoom': max_zoom}
+            ]
+        })
+
+    print(f"Saved {len(tiles)} tiles to {output} ({os.path.getsize(output) / 1e6:.2f} MB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a PMTiles vector tile pyramid of the map layers")
+    parser.add_argument('-o', '--output', default='tractmap.pmtiles', help="Archive to write")
+    parser.add_argument('--min-zoom', type=int, default=DEFAULT_MIN_ZOOM)
+    parser.add_argument('--max-zoom', type=int, default=DEFAULT_MAX_ZOOM)
+    args = parser.parse_args()
+    build_vector_tiles(args.output, args.min_zoom, args.max_zoom)